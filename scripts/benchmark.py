@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+This script measures the overhead of temprl.
+
+It contains two suites:
+- 'reward-machines': the cost of stepping a reward machine, comparing separate
+  calls to 'get_successor' and 'get_reward' against a single call to
+  'transition' or 'transition_bitmask', for the pythomata-based
+  and the compiled reward machines;
+- 'wrapper': the steps per second of TemporalGoalWrapper against the bare
+  environment, varying the number of temporal goals, the number of automaton
+  states and fluents, the step controller and the reward machine backend.
+
+For every benchmark, the best time over several runs is reported, together
+with the memory traced by tracemalloc during one run: the peak of the traced
+memory, and the number of memory blocks still allocated at the end of the run
+(e.g. stored observations or growing caches), divided by the number of steps.
+The results can be saved in JSON format with '--output', so that they can be
+compared between releases.
+
+It is assumed the script is run from the repository root as a module
+('python -m scripts.benchmark'), so that the test utilities can be imported.
+"""
+
+import itertools
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import gym
+import numpy as np
+from gym.spaces import Discrete
+from pythomata.impl.symbolic import SymbolicDFA
+
+import temprl
+from temprl.fluents import FluentVocabulary
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import CompiledRewardMachine
+from temprl.step_controllers.base import AbstractStepController
+from temprl.step_controllers.compiled import CompiledStatefulStepController
+from temprl.step_controllers.stateful import StatefulStepController
+from temprl.step_controllers.stateless import StatelessStepController
+from temprl.types import Interpretation
+from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
+from tests.utils import build_test_automaton
+
+Record = Dict[str, Any]
+MEASUREMENTS = {
+    "us_per_step",
+    "steps_per_second",
+    "peak_bytes",
+    "retained_blocks_per_step",
+}
+
+
+def build_chain_automaton(nb_states: int, nb_fluents: int) -> SymbolicDFA:
+    """
+    Build a chain automaton.
+
+    From the i-th state, the automaton moves to the next state when the fluent
+    f{i % nb_fluents} is true, and stays otherwise. The last state is accepting.
+
+    :param nb_states: the number of states.
+    :param nb_fluents: the number of fluents.
+    :return: the automaton.
+    """
+    automaton = SymbolicDFA()
+    for _ in range(nb_states - 1):
+        automaton.create_state()
+    for state in range(nb_states - 1):
+        fluent = f"f{state % nb_fluents}"
+        automaton.add_transition((state, fluent, state + 1))
+        automaton.add_transition((state, f"~{fluent}", state))
+    automaton.add_transition((nb_states - 1, "true", nb_states - 1))
+    automaton.set_accepting_state(nb_states - 1, True)
+    return automaton
+
+
+def build_started_acceptor() -> SymbolicDFA:
+    """Build the acceptor of the non-empty traces, for the stateful step controller."""
+    automaton = SymbolicDFA()
+    automaton.create_state()
+    automaton.add_transition((0, "true", 1))
+    automaton.add_transition((1, "true", 1))
+    automaton.set_accepting_state(1, True)
+    return automaton
+
+
+class CounterEnv(gym.Env):
+    """An environment whose observation is the number of steps done, modulo a bound."""
+
+    def __init__(self, nb_observations: int):
+        """Initialize the environment."""
+        self.observation_space = Discrete(nb_observations)
+        self.action_space = Discrete(1)
+        self._counter = 0
+
+    def step(self, action):
+        """Do a step in the environment."""
+        self._counter = (self._counter + 1) % self.observation_space.n
+        return self._counter, 0.0, False, {}
+
+    def reset(self, **_kwargs):
+        """Reset the environment."""
+        self._counter = 0
+        return self._counter
+
+    def render(self, mode="human"):
+        """Render the environment."""
+
+
+def measure(run: Callable[[], None], steps: int, repeat: int) -> Record:
+    """
+    Measure a function that does a number of steps.
+
+    :param run: the function to measure.
+    :param steps: the number of steps done by one call of the function.
+    :param repeat: the number of runs.
+    :return: the measurements.
+    """
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        start, _ = tracemalloc.get_traced_memory()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained_blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "filename")
+    )
+    return {
+        "us_per_step": best / steps * 1e6,
+        "steps_per_second": steps / best,
+        "peak_bytes": peak - start,
+        "retained_blocks_per_step": retained_blocks / steps,
+    }
+
+
+def make_two_calls(
+    reward_machine: AbstractRewardMachine, symbols: Sequence[Interpretation]
+) -> Callable[[], None]:
+    """Make a function that reads the symbols with two separate calls."""
+
+    def run() -> None:
+        state = reward_machine.initial_state
+        for symbol in symbols:
+            reward_machine.get_reward(state, symbol)
+            state = reward_machine.get_successor(state, symbol)
+
+    return run
+
+
+def make_single_call(
+    reward_machine: AbstractRewardMachine, symbols: Sequence[Interpretation]
+) -> Callable[[], None]:
+    """Make a function that reads the symbols with a single call to 'transition'."""
+
+    def run() -> None:
+        state = reward_machine.initial_state
+        for symbol in symbols:
+            state, _ = reward_machine.transition(state, symbol)
+
+    return run
+
+
+def make_bitmask_call(
+    reward_machine: AbstractRewardMachine, symbols: Sequence[Interpretation]
+) -> Callable[[], None]:
+    """Make a function that reads the symbols, encoded as bitmasks, with 'transition_bitmask'."""
+    vocabulary = FluentVocabulary([f"s{i}" for i in range(5)])
+    masks = [vocabulary.encode(symbol) for symbol in symbols]
+
+    def run() -> None:
+        state = reward_machine.initial_state
+        for mask in masks:
+            state, _ = reward_machine.transition_bitmask(state, mask, vocabulary)
+
+    return run
+
+
+def run_reward_machines_suite(steps: int, repeat: int) -> List[Record]:
+    """Run the benchmarks of the reward machines."""
+    trace = [{"s1"}, {"s3"}, {"s2"}, {"s0"}, {"s1"}, {"s4"}]
+    symbols = list(itertools.islice(itertools.cycle(trace), steps))
+    reward_automaton = RewardAutomaton(build_test_automaton(), 1.0)
+    reward_machines: Dict[str, AbstractRewardMachine] = {
+        "automaton": reward_automaton,
+        "compiled": CompiledRewardMachine.from_reward_machine(reward_automaton),
+    }
+    records = []
+    for backend, rm in reward_machines.items():
+        for mode, make_run in [
+            ("two-calls", make_two_calls),
+            ("transition", make_single_call),
+            ("bitmask", make_bitmask_call),
+        ]:
+            record = {"suite": "reward-machines", "backend": backend, "mode": mode}
+            record.update(measure(make_run(rm, symbols), steps, repeat))
+            records.append(record)
+    return records
+
+
+def make_step_controller(name: str) -> Optional[AbstractStepController]:
+    """Make a step controller from its name."""
+    if name == "stateless":
+        return StatelessStepController(lambda fluents: True)
+    if name == "stateful":
+        return StatefulStepController(build_started_acceptor())
+    if name == "compiled-stateful":
+        return CompiledStatefulStepController(build_started_acceptor(), fluents=[])
+    raise ValueError(f"unknown step controller: {name}")
+
+
+def make_reward_machine(
+    backend: str, nb_states: int, nb_fluents: int
+) -> AbstractRewardMachine:
+    """Make a reward machine over a chain automaton, with the given backend."""
+    reward_automaton = RewardAutomaton(
+        build_chain_automaton(nb_states, nb_fluents), 1.0
+    )
+    if backend == "automaton":
+        return reward_automaton
+    if backend == "compiled":
+        return CompiledRewardMachine.from_reward_machine(reward_automaton)
+    raise ValueError(f"unknown backend: {backend}")
+
+
+def make_env_run(env: gym.Env, steps: int) -> Callable[[], None]:
+    """Make a function that does a number of steps in an environment."""
+
+    def run() -> None:
+        env.reset()
+        for _ in range(steps):
+            env.step(0)
+
+    return run
+
+
+def run_wrapper_suite(
+    steps: int,
+    repeat: int,
+    *,
+    nb_goals_grid: List[int],
+    nb_states_grid: List[int],
+    nb_fluents_grid: List[int],
+    controllers: List[str],
+    backends: List[str],
+) -> List[Record]:
+    """Run the benchmarks of the wrapper."""
+    records = []
+    record: Record = {"suite": "wrapper", "env": "bare"}
+    record.update(measure(make_env_run(CounterEnv(1), steps), steps, repeat))
+    records.append(record)
+    for nb_goals, nb_states, nb_fluents, controller, backend in itertools.product(
+        nb_goals_grid, nb_states_grid, nb_fluents_grid, controllers, backends
+    ):
+        env = CounterEnv(nb_fluents)
+        reward_machine = make_reward_machine(backend, nb_states, nb_fluents)
+        temp_goals = [TemporalGoal(reward_machine) for _ in range(nb_goals)]
+        wrapped = TemporalGoalWrapper(
+            env,
+            temp_goals,
+            lambda obs, action: {f"f{obs}"},
+            step_controller=make_step_controller(controller),
+        )
+        record = {
+            "suite": "wrapper",
+            "env": "wrapped",
+            "nb_goals": nb_goals,
+            "nb_states": nb_states,
+            "nb_fluents": nb_fluents,
+            "controller": controller,
+            "backend": backend,
+        }
+        record.update(measure(make_env_run(wrapped, steps), steps, repeat))
+        records.append(record)
+    return records
+
+
+def format_record(record: Record) -> str:
+    """Format a record as a line of text."""
+    parameters = " ".join(
+        f"{key}={value}" for key, value in record.items() if key not in MEASUREMENTS
+    )
+    return (
+        f"{parameters:<100} {record['us_per_step']:10.2f} us/step "
+        f"{record['steps_per_second']:12.1f} steps/s "
+        f"{record['peak_bytes']:10d} B peak "
+        f"{record['retained_blocks_per_step']:8.2f} blocks/step"
+    )
+
+
+def parse_args():
+    """Parse arguments."""
+    import argparse  # pylint: disable=import-outside-toplevel
+
+    def int_list(value: str) -> List[int]:
+        return [int(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser("benchmark")
+    parser.add_argument(
+        "--suite",
+        choices=["all", "reward-machines", "wrapper"],
+        default="all",
+        help="The suite to run.",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=1000, help="The number of steps per run."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="The number of runs per benchmark."
+    )
+    parser.add_argument(
+        "--goals", type=int_list, default=[1, 10, 30], help="The numbers of goals."
+    )
+    parser.add_argument(
+        "--states", type=int_list, default=[5, 50], help="The numbers of states."
+    )
+    parser.add_argument(
+        "--fluents", type=int_list, default=[2, 8], help="The numbers of fluents."
+    )
+    parser.add_argument(
+        "--controllers",
+        type=lambda value: value.split(","),
+        default=["stateless", "stateful", "compiled-stateful"],
+        help="The step controllers.",
+    )
+    parser.add_argument(
+        "--backends",
+        type=lambda value: value.split(","),
+        default=["automaton", "compiled"],
+        help="The reward machine backends.",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="The path of the JSON output file."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    results: List[Record] = []
+    if arguments.suite in {"all", "reward-machines"}:
+        results.extend(run_reward_machines_suite(arguments.steps, arguments.repeat))
+    if arguments.suite in {"all", "wrapper"}:
+        results.extend(
+            run_wrapper_suite(
+                arguments.steps,
+                arguments.repeat,
+                nb_goals_grid=arguments.goals,
+                nb_states_grid=arguments.states,
+                nb_fluents_grid=arguments.fluents,
+                controllers=arguments.controllers,
+                backends=arguments.backends,
+            )
+        )
+    for result in results:
+        print(format_record(result))
+    if arguments.output is not None:
+        metadata = {
+            "temprl": temprl.__version__,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "gym": gym.__version__,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "steps": arguments.steps,
+            "repeat": arguments.repeat,
+        }
+        with open(arguments.output, "w", encoding="utf-8") as f:
+            json.dump({"metadata": metadata, "results": results}, f, indent=2)
+        print(f"Results written to {arguments.output}", file=sys.stderr)
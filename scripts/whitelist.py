@@ -8,3 +8,50 @@ StatefulStepController  # unused class (temprl/step_controllers/stateful.py:30)
 logger  # unused variable (temprl/wrapper.py:36)
 _.automaton  # unused property (temprl/wrapper.py:61)
 TemporalGoalWrapper  # unused class (temprl/wrapper.py:89)
+CompiledRewardMachine  # unused class (temprl/reward_machines/compiled.py:65)
+_.from_reward_machine  # unused method (temprl/reward_machines/compiled.py:136)
+_.initial_state_id  # unused property (temprl/reward_machines/compiled.py:198)
+_.get_state  # unused method (temprl/reward_machines/compiled.py:231)
+VectorTemporalGoalWrapper  # unused class (temprl/vector_wrapper.py:37)
+SetToBitmaskFluentExtractor  # unused class (temprl/fluents.py:123)
+_.nb_classes  # unused property (temprl/fluents.py:220)
+hits  # unused variable (temprl/reward_machines/cached.py:37)
+misses  # unused variable (temprl/reward_machines/cached.py:38)
+evictions  # unused variable (temprl/reward_machines/cached.py:39)
+size  # unused variable (temprl/reward_machines/cached.py:41)
+CachedRewardMachine  # unused class (temprl/reward_machines/cached.py:44)
+_.cache_info  # unused method (temprl/reward_machines/cached.py:107)
+_.cache_clear  # unused method (temprl/reward_machines/cached.py:113)
+_.is_product  # unused property (temprl/wrapper.py:182)
+_.histogram  # unused method (temprl/instrumentation.py:92)
+_.summary  # unused method (temprl/instrumentation.py:123)
+CompiledStatefulStepController  # unused class (temprl/step_controllers/compiled.py:115)
+BatchedCompiledStatefulStepController  # unused class (temprl/step_controllers/compiled.py:178)
+iter_array_chunks  # unused function (temprl/relabeling.py:40)
+iter_interpretation_chunks  # unused function (temprl/relabeling.py:69)
+TrajectoryRelabeler  # unused class (temprl/relabeling.py:103)
+_.current_state_ids  # unused property (temprl/relabeling.py:171)
+_.relabel  # unused method (temprl/relabeling.py:248)
+relabel_dataset  # unused function (temprl/relabeling.py:410)
+load_relabeled_dataset  # unused function (temprl/relabeling.py:503)
+compute_fingerprint  # unused function (temprl/reward_machines/compiled.py:97)
+read_fingerprint  # unused function (temprl/reward_machines/serialization.py:102)
+nb_states  # unused variable (temprl/reward_machines/lazy.py:47)
+_.get_automaton_state  # unused method (temprl/reward_machines/lazy.py:117)
+_.exploration_info  # unused method (temprl/reward_machines/lazy.py:141)
+minimize_reward_machine  # unused function (temprl/reward_machines/minimization.py:80)
+_.decode_automata_states  # unused method (temprl/wrapper.py:286)
+_.step_many  # unused method (temprl/wrapper.py:569)
+_.cache_size  # unused property (temprl/step_controllers/stateless.py:86)
+BatchedStatelessStepController  # unused class (temprl/step_controllers/stateless.py:142)
+QTable  # unused class (temprl/tabular.py:47)
+_.from_env  # unused method (temprl/tabular.py:111)
+_.get_indices  # unused method (temprl/tabular.py:240)
+_.epsilon_greedy_actions  # unused method (temprl/tabular.py:297)
+fluent_names  # unused variable (temprl/traces.py:59)
+episodes  # unused variable (temprl/traces.py:60)
+steps  # unused variable (temprl/traces.py:61)
+_.nb_episodes  # unused property (temprl/traces.py:144)
+_.chunk_paths  # unused property (temprl/traces.py:149)
+_.close  # unused method (temprl/traces.py:218)
+load_trace  # unused function (temprl/traces.py:223)
@@ -0,0 +1,268 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""This module contains utilities to represent interpretations as bitmasks."""
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from temprl.helpers import enforce
+from temprl.types import Action, FluentExtractor, Interpretation, Observation, Symbol
+
+TRANSLATION_CHUNK_SIZE = 8
+_TRANSLATION_CHUNK_MASK = (1 << TRANSLATION_CHUNK_SIZE) - 1
+
+BitmaskTranslator = Callable[[int], int]
+
+
+class FluentVocabulary:
+    """
+    A fixed-order vocabulary of fluents.
+
+    An interpretation over the vocabulary is encoded into a bitmask,
+    where the i-th bit is set iff the i-th fluent is true.
+    """
+
+    def __init__(self, fluents: Sequence[Symbol]):
+        """
+        Initialize the vocabulary.
+
+        :param fluents: the fluents; the position in the sequence is the bit position.
+        :raise ValueError: if the fluents are not unique.
+        """
+        self._fluents: Tuple[Symbol, ...] = tuple(fluents)
+        self._fluent_bits: Dict[Symbol, int] = {
+            f: 1 << i for i, f in enumerate(self._fluents)
+        }
+        enforce(
+            len(self._fluent_bits) == len(self._fluents),
+            "fluents are not unique",
+            ValueError,
+        )
+        self._hash = hash(self._fluents)
+        self._translators: Dict["FluentVocabulary", BitmaskTranslator] = {}
+
+    @property
+    def fluents(self) -> Tuple[Symbol, ...]:
+        """Get the fluents, in bit order."""
+        return self._fluents
+
+    def __len__(self) -> int:
+        """Get the number of fluents."""
+        return len(self._fluents)
+
+    def __eq__(self, other) -> bool:
+        """Check equality with another vocabulary."""
+        if self is other:
+            return True
+        return isinstance(other, FluentVocabulary) and self._fluents == other._fluents
+
+    def __hash__(self) -> int:
+        """Compute the hash."""
+        return self._hash
+
+    def index(self, fluent: Symbol) -> int:
+        """
+        Get the bit position of a fluent.
+
+        :param fluent: the fluent.
+        :return: the bit position.
+        :raise ValueError: if the fluent does not belong to the vocabulary.
+        """
+        bit = self._fluent_bits.get(fluent)
+        if bit is None:
+            raise ValueError(f"fluent {fluent} does not belong to the vocabulary")
+        return bit.bit_length() - 1
+
+    def encode(self, symbol: Interpretation) -> int:
+        """
+        Encode an interpretation into a bitmask.
+
+        Fluents that do not belong to the vocabulary are ignored.
+
+        :param symbol: the set of true fluents.
+        :return: the bitmask.
+        """
+        mask = 0
+        fluent_bits = self._fluent_bits
+        for fluent in symbol:
+            mask |= fluent_bits.get(fluent, 0)
+        return mask
+
+    def decode(self, mask: int) -> Interpretation:
+        """
+        Decode a bitmask into an interpretation.
+
+        :param mask: the bitmask.
+        :return: the set of true fluents.
+        """
+        return frozenset(f for f, bit in self._fluent_bits.items() if mask & bit)
+
+    def get_translator(self, target: "FluentVocabulary") -> BitmaskTranslator:
+        """
+        Get the translator of bitmasks over this vocabulary into bitmasks over another one.
+
+        The permutation of the bits is precomputed into one lookup table per chunk
+        of TRANSLATION_CHUNK_SIZE bits, so that a translation takes one lookup per chunk
+        that contains fluents of the target vocabulary. Fluents that do not belong
+        to the target vocabulary are dropped. The translator is cached per target vocabulary.
+
+        :param target: the target vocabulary.
+        :return: the translator.
+        """
+        translator = self._translators.get(target)
+        if translator is None:
+            translator = self._build_translator(target)
+            self._translators[target] = translator
+        return translator
+
+    def _build_translator(self, target: "FluentVocabulary") -> BitmaskTranslator:
+        """Build the function that translates bitmasks into bitmasks over another vocabulary."""
+        if target == self:
+            return int
+        chunks: List[Tuple[int, List[int]]] = []
+        for start in range(0, len(self._fluents), TRANSLATION_CHUNK_SIZE):
+            end = start + TRANSLATION_CHUNK_SIZE
+            bits = [target.encode({fluent}) for fluent in self._fluents[start:end]]
+            if not any(bits):
+                continue
+            bits += [0] * (TRANSLATION_CHUNK_SIZE - len(bits))
+            # Python ints, since the bit positions in the target can exceed 63
+            table = [0] * (1 << TRANSLATION_CHUNK_SIZE)
+            for chunk_mask in range(1, len(table)):
+                lowest_bit = chunk_mask & -chunk_mask
+                table[chunk_mask] = (
+                    table[chunk_mask ^ lowest_bit] | bits[lowest_bit.bit_length() - 1]
+                )
+            chunks.append((start, table))
+
+        if len(chunks) == 1:
+            shift, table_list = chunks[0]
+
+            def translate_chunk(mask: int) -> int:
+                return table_list[(mask >> shift) & _TRANSLATION_CHUNK_MASK]
+
+            return translate_chunk
+
+        def translate(mask: int) -> int:
+            result = 0
+            for shift, table in chunks:
+                result |= table[(mask >> shift) & _TRANSLATION_CHUNK_MASK]
+            return result
+
+        return translate
+
+    def to_bitmask(self, fluents: Union[int, np.ndarray]) -> int:
+        """
+        Convert the output of a bitmask fluent extractor into a bitmask.
+
+        :param fluents: either a bitmask, or a boolean vector over the vocabulary.
+        :return: the bitmask.
+        """
+        if isinstance(fluents, (int, np.integer)):
+            return int(fluents)
+        packed = np.packbits(np.asarray(fluents, dtype=bool), bitorder="little")
+        return int.from_bytes(packed.tobytes(), "little")
+
+    def to_bitmasks(self, fluent_matrix: np.ndarray) -> List[int]:
+        """
+        Convert the rows of a boolean fluent matrix into bitmasks.
+
+        The bitmasks are Python integers, so vocabularies of any size are supported.
+
+        :param fluent_matrix: the boolean matrix of shape (nb_rows, nb_fluents).
+        :return: the bitmasks of the rows.
+        """
+        fluent_matrix = np.asarray(fluent_matrix, dtype=bool)
+        packed = np.packbits(fluent_matrix, axis=1, bitorder="little")
+        return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+
+class SymbolClasses:
+    """
+    The partition of the interpretations into symbol classes.
+
+    Two interpretations are in the same class iff they have the same projection
+    onto a support, e.g. the fluents read by a reward machine. The id of a class
+    is the bitmask of the projection over the vocabulary of the support, so that
+    there are 2 ** len(support) classes, whatever the number of fluents of the
+    interpretations.
+    """
+
+    def __init__(self, support: Sequence[Symbol]):
+        """
+        Initialize the symbol classes.
+
+        :param support: the fluents of the support, in bit order.
+        :raise ValueError: if the fluents are not unique.
+        """
+        self.vocabulary = FluentVocabulary(support)
+
+    @property
+    def nb_classes(self) -> int:
+        """Get the number of symbol classes."""
+        return 1 << len(self.vocabulary)
+
+    def get_class_id(self, symbol: Interpretation) -> int:
+        """
+        Get the class of an interpretation.
+
+        :param symbol: the set of true fluents.
+        :return: the class id.
+        """
+        return self.vocabulary.encode(symbol)
+
+    def get_class_id_bitmask(self, mask: int, vocabulary: FluentVocabulary) -> int:
+        """
+        Get the class of an interpretation encoded as a bitmask.
+
+        :param mask: the bitmask.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the class id.
+        """
+        return vocabulary.get_translator(self.vocabulary)(mask)
+
+    def get_representative(self, class_id: int) -> Interpretation:
+        """
+        Get the representative of a class, i.e. the projection of its interpretations.
+
+        :param class_id: the class id.
+        :return: the set of true fluents of the support.
+        """
+        return self.vocabulary.decode(class_id)
+
+
+class SetToBitmaskFluentExtractor:  # pylint: disable=too-few-public-methods
+    """Adapter that turns a set-based fluent extractor into a bitmask fluent extractor."""
+
+    def __init__(self, fluent_extractor: FluentExtractor, vocabulary: FluentVocabulary):
+        """
+        Initialize the adapter.
+
+        :param fluent_extractor: the set-based fluent extractor.
+        :param vocabulary: the vocabulary used to encode the extracted interpretations.
+        """
+        self.fluent_extractor = fluent_extractor
+        self.vocabulary = vocabulary
+
+    def __call__(self, observation: Observation, action: Action) -> int:
+        """Extract the fluents and encode them into a bitmask."""
+        return self.vocabulary.encode(self.fluent_extractor(observation, action))
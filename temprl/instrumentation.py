@@ -0,0 +1,150 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""This module contains the instrumentation of the temporal goal wrapper."""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from temprl.helpers import enforce
+
+ENV_PHASE = "env"
+FLUENT_EXTRACTOR_PHASE = "fluent_extractor"
+STEP_CONTROLLER_PHASE = "step_controller"
+REWARD_MACHINES_PHASE = "reward_machines"
+PHASES = (
+    ENV_PHASE,
+    FLUENT_EXTRACTOR_PHASE,
+    STEP_CONTROLLER_PHASE,
+    REWARD_MACHINES_PHASE,
+)
+INFO_KEY = "temprl_timings"
+DEFAULT_NB_BUCKETS = 40
+
+StepCallback = Callable[[Dict[str, int], Sequence[bool]], None]
+
+
+class StepProfiler:
+    """
+    A collector of the step latencies of a temporal goal wrapper.
+
+    For every step, it records the time spent in each phase, in nanoseconds,
+    and which temporal goals did a transition. The latencies of each phase
+    are accumulated into a histogram with logarithmic buckets: the i-th bucket
+    counts the latencies d such that 2 ** (i - 1) <= d < 2 ** i nanoseconds
+    (the last bucket also counts the larger latencies).
+    """
+
+    def __init__(
+        self,
+        nb_buckets: int = DEFAULT_NB_BUCKETS,
+        callback: Optional[StepCallback] = None,
+        export_to_info: bool = False,
+    ):
+        """
+        Initialize the profiler.
+
+        :param nb_buckets: the number of buckets of the histograms.
+        :param callback: a callable invoked at every step with the phase timings
+          and, for every temporal goal, whether it did a transition.
+        :param export_to_info: if True, the phase timings of the step are added
+          to the info dictionary returned by the wrapper, under the key 'temprl_timings'.
+        :raise ValueError: if the number of buckets is not positive.
+        """
+        enforce(nb_buckets > 0, "the number of buckets must be positive", ValueError)
+        self.nb_buckets = nb_buckets
+        self.callback = callback
+        self.export_to_info = export_to_info
+        self._histograms = np.zeros((len(PHASES), nb_buckets), dtype=np.int64)
+        self._totals = np.zeros(len(PHASES), dtype=np.int64)
+        self._goal_transitions: List[int] = []
+        self._nb_steps = 0
+
+    @property
+    def nb_steps(self) -> int:
+        """Get the number of recorded steps."""
+        return self._nb_steps
+
+    @property
+    def goal_transitions(self) -> List[int]:
+        """Get, for every temporal goal, the number of transitions done."""
+        return list(self._goal_transitions)
+
+    def histogram(self, phase: str) -> np.ndarray:
+        """
+        Get the histogram of the latencies of a phase.
+
+        :param phase: the phase.
+        :return: the counts of the buckets.
+        """
+        return self._histograms[PHASES.index(phase)].copy()
+
+    def record(self, timings: Dict[str, int], transitions: Sequence[bool]) -> None:
+        """
+        Record a step.
+
+        :param timings: the time spent in each phase, in nanoseconds.
+        :param transitions: for every temporal goal, whether it did a transition.
+        """
+        last_bucket = self.nb_buckets - 1
+        for index, phase in enumerate(PHASES):
+            duration = timings[phase]
+            self._totals[index] += duration
+            self._histograms[index, min(duration.bit_length(), last_bucket)] += 1
+        if len(self._goal_transitions) < len(transitions):
+            self._goal_transitions.extend(
+                [0] * (len(transitions) - len(self._goal_transitions))
+            )
+        for index, transition in enumerate(transitions):
+            self._goal_transitions[index] += transition
+        self._nb_steps += 1
+        if self.callback is not None:
+            self.callback(timings, transitions)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Get a summary of the recorded steps.
+
+        :return: a JSON-serializable dictionary with the number of steps,
+          the total and mean latency of each phase, the histograms,
+          and the number of transitions of each temporal goal.
+        """
+        nb_steps = max(self._nb_steps, 1)
+        return {
+            "nb_steps": self._nb_steps,
+            "phases": {
+                phase: {
+                    "total_ns": int(self._totals[index]),
+                    "mean_ns": float(self._totals[index]) / nb_steps,
+                    "histogram": self._histograms[index].tolist(),
+                }
+                for index, phase in enumerate(PHASES)
+            },
+            "goal_transitions": self.goal_transitions,
+        }
+
+    def reset(self) -> None:
+        """Reset the recorded statistics."""
+        self._histograms[:] = 0
+        self._totals[:] = 0
+        self._goal_transitions = []
+        self._nb_steps = 0
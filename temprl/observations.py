@@ -0,0 +1,132 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Flat encodings of the observations of the wrappers."""
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from gym.spaces import Box, Space
+from gym.spaces.utils import flatdim, flatten, flatten_space
+from gym.vector.utils import batch_space, iterate
+
+
+class FlatObservationEncoder:
+    """
+    Encoder of an observation and of the automaton states into a single float32 vector.
+
+    The vector is the concatenation of the flattened observation (see gym.spaces.flatten)
+    and of the one-hot encodings of the indices of the automaton states, one per temporal goal.
+    The vector is written into a preallocated buffer, which is returned by the
+    encoding methods and overwritten at every call.
+
+    The encoder works either on single observations, or on batches of observations
+    of a vectorized environment, if the number of environments is provided.
+    """
+
+    def __init__(
+        self,
+        observation_space: Space,
+        nb_automaton_states: Sequence[int],
+        num_envs: Optional[int] = None,
+    ):
+        """
+        Initialize the encoder.
+
+        :param observation_space: the observation space of a (single) environment.
+        :param nb_automaton_states: the number of automaton states of every temporal goal.
+        :param num_envs: the number of environments, if the observations are batched.
+        """
+        self._env_space = observation_space
+        self._is_box = isinstance(observation_space, Box)
+        self._env_dim = flatdim(observation_space)
+        sizes = list(nb_automaton_states)
+        self._offsets: List[int] = [
+            self._env_dim + int(offset)
+            for offset in np.cumsum([0] + sizes[:-1]).tolist()
+        ]
+        flat_env_space = flatten_space(observation_space)
+        low = np.concatenate(
+            [
+                np.ravel(flat_env_space.low).astype(np.float32),
+                np.zeros(sum(sizes), dtype=np.float32),
+            ]
+        )
+        high = np.concatenate(
+            [
+                np.ravel(flat_env_space.high).astype(np.float32),
+                np.ones(sum(sizes), dtype=np.float32),
+            ]
+        )
+        self.single_observation_space = Box(low, high, dtype=np.float32)
+        self.num_envs = num_envs
+        if num_envs is None:
+            self.observation_space = self.single_observation_space
+            self._batched_env_space: Optional[Space] = None
+        else:
+            self.observation_space = batch_space(
+                self.single_observation_space, num_envs
+            )
+            self._batched_env_space = batch_space(observation_space, num_envs)
+            self._rows = np.arange(num_envs)[:, None]
+            self._batched_offsets = np.asarray(self._offsets, dtype=np.intp)[None, :]
+        self._buffer = np.zeros(self.observation_space.shape, dtype=np.float32)
+
+    def encode(self, observation: Any, state_indices: Sequence[int]) -> np.ndarray:
+        """
+        Encode an observation and the automaton states.
+
+        :param observation: the observation of the environment.
+        :param state_indices: the indices of the automaton states, one per temporal goal.
+        :return: the preallocated flat vector.
+        """
+        buffer = self._buffer
+        env_dim = self._env_dim
+        if self._is_box:
+            buffer[:env_dim] = np.ravel(observation)
+        else:
+            buffer[:env_dim] = flatten(self._env_space, observation)
+        buffer[env_dim:] = 0.0
+        for offset, index in zip(self._offsets, state_indices):
+            buffer[offset + index] = 1.0
+        return buffer
+
+    def encode_batch(self, observations: Any, state_indices: np.ndarray) -> np.ndarray:
+        """
+        Encode a batch of observations and of automaton states.
+
+        :param observations: the batch of observations of the vectorized environment.
+        :param state_indices: the indices of the automaton states,
+          of shape (num_envs, num_goals).
+        :return: the preallocated flat matrix, of shape (num_envs, flat dimension).
+        """
+        buffer = self._buffer
+        env_dim = self._env_dim
+        if self._is_box:
+            buffer[:, :env_dim] = np.reshape(observations, (len(buffer), env_dim))
+        else:
+            for row, observation in enumerate(
+                iterate(self._batched_env_space, observations)
+            ):
+                buffer[row, :env_dim] = flatten(self._env_space, observation)
+        buffer[:, env_dim:] = 0.0
+        buffer[self._rows, self._batched_offsets + state_indices] = 1.0
+        return buffer
@@ -0,0 +1,527 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""This module contains utilities to relabel recorded trajectories with temporal goals."""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import CompiledRewardMachine
+from temprl.reward_machines.kernels import run_reward_machine
+from temprl.reward_machines.serialization import (
+    load_compiled_reward_machine,
+    save_compiled_reward_machine,
+)
+from temprl.step_controllers.base import AbstractStepController
+from temprl.types import Interpretation, Symbol
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+DEFAULT_SHARD_SIZE = 1 << 20
+INDEX_FILENAME = "index.json"
+
+Chunk = Tuple[np.ndarray, np.ndarray]
+
+
+def iter_array_chunks(
+    fluent_matrix: np.ndarray,
+    dones: np.ndarray,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Chunk]:
+    """
+    Split a dataset of transitions into chunks.
+
+    The arrays are sliced without copies, so that memory-mapped arrays
+    (e.g. numpy.memmap or numpy.load(..., mmap_mode="r")) are read one chunk at a time.
+
+    :param fluent_matrix: the boolean fluent matrix of shape (nb_transitions, nb_fluents).
+    :param dones: the boolean vector of shape (nb_transitions,), True at the last
+      transition of every episode.
+    :param chunk_size: the number of transitions per chunk.
+    :return: the iterator over the pairs (fluent matrix, dones) of the chunks.
+    :raise ValueError: if the arrays have different lengths.
+    """
+    enforce(
+        len(fluent_matrix) == len(dones),
+        f"got {len(fluent_matrix)} fluent rows and {len(dones)} episode flags",
+        ValueError,
+    )
+    enforce(chunk_size > 0, "the chunk size must be positive", ValueError)
+    for start in range(0, len(dones), chunk_size):
+        end = start + chunk_size
+        yield fluent_matrix[start:end], dones[start:end]
+
+
+def iter_interpretation_chunks(
+    transitions: Iterable[Tuple[Interpretation, bool]],
+    fluents: Sequence[Symbol],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Chunk]:
+    """
+    Group a stream of interpretations into chunks.
+
+    :param transitions: the iterable of pairs (interpretation, done).
+    :param fluents: the fluents, in the order of the columns of the fluent matrices.
+    :param chunk_size: the number of transitions per chunk.
+    :return: the iterator over the pairs (fluent matrix, dones) of the chunks.
+    """
+    enforce(chunk_size > 0, "the chunk size must be positive", ValueError)
+    columns = {fluent: index for index, fluent in enumerate(fluents)}
+    fluent_matrix = np.zeros((chunk_size, len(columns)), dtype=bool)
+    dones = np.zeros(chunk_size, dtype=bool)
+    size = 0
+    for interpretation, done in transitions:
+        for fluent in interpretation:
+            column = columns.get(fluent)
+            if column is not None:
+                fluent_matrix[size, column] = True
+        dones[size] = done
+        size += 1
+        if size == chunk_size:
+            yield fluent_matrix, dones
+            fluent_matrix = np.zeros((chunk_size, len(columns)), dtype=bool)
+            dones = np.zeros(chunk_size, dtype=bool)
+            size = 0
+    if size > 0:
+        yield fluent_matrix[:size], dones[:size]
+
+
+class TrajectoryRelabeler:
+    """
+    Run reward machines over recorded trajectories, without a Gym environment.
+
+    The trajectories are read as a stream of chunks. Each chunk is a pair
+    (fluent matrix, dones): the i-th row of the fluent matrix tells which fluents
+    are true after the i-th transition, and dones[i] is True iff the i-th transition
+    is the last one of its episode. The automaton states are carried over
+    between chunks, so that episodes can span several chunks.
+
+    The semantics is the one of TemporalGoalWrapper: the reward machines
+    (and the step controller) start from their initial state at the beginning
+    of every episode, and the reward machines do a transition only if the
+    step controller allows it. As TemporalGoalWrapper does with its temporal goals,
+    the step controller is queried once per reward machine at every transition,
+    in the order of the reward machines.
+    """
+
+    def __init__(
+        self,
+        reward_machines: Sequence[AbstractRewardMachine],
+        fluents: Sequence[Symbol],
+        step_controller: Optional[AbstractStepController] = None,
+    ):
+        """
+        Initialize the relabeler.
+
+        :param reward_machines: the reward machines. Reward machines that are
+          not instances of CompiledRewardMachine are compiled.
+        :param fluents: the fluents, in the order of the columns of the fluent matrices.
+        :param step_controller: the step controller. If None, every transition
+          is read by the reward machines.
+        :raise ValueError: if a reward machine reads a fluent that is not provided.
+        """
+        self.vocabulary = FluentVocabulary(fluents)
+        self.step_controller = step_controller
+        self._reward_machines: List[CompiledRewardMachine] = [
+            rm
+            if isinstance(rm, CompiledRewardMachine)
+            else CompiledRewardMachine.from_reward_machine(rm)
+            for rm in reward_machines
+        ]
+        self._fluent_columns: List[np.ndarray] = []
+        self._fluent_weights: List[np.ndarray] = []
+        for rm in self._reward_machines:
+            missing = [f for f in rm.fluents if f not in self.vocabulary.fluents]
+            enforce(
+                len(missing) == 0,
+                f"fluents {missing} are read by a reward machine but are not provided",
+                ValueError,
+            )
+            self._fluent_columns.append(
+                np.asarray(
+                    [self.vocabulary.index(f) for f in rm.fluents], dtype=np.intp
+                )
+            )
+            self._fluent_weights.append(
+                np.left_shift(1, np.arange(len(rm.fluents), dtype=np.int64))
+            )
+        self._initial_state_ids = [rm.initial_state_id for rm in self._reward_machines]
+        self._current_state_ids = list(self._initial_state_ids)
+
+    @property
+    def reward_machines(self) -> List[CompiledRewardMachine]:
+        """Get the (compiled) reward machines."""
+        return list(self._reward_machines)
+
+    @property
+    def current_state_ids(self) -> List[int]:
+        """Get the current state ids of the reward machines."""
+        return list(self._current_state_ids)
+
+    def reset(self) -> None:
+        """Reset the reward machines and the step controller to their initial state."""
+        self._current_state_ids = list(self._initial_state_ids)
+        if self.step_controller is not None:
+            self.step_controller.reset()
+
+    def _allowed_steps(
+        self, fluent_matrix: np.ndarray, dones: np.ndarray
+    ) -> np.ndarray:
+        """
+        Query the step controller for every transition of a chunk and every reward machine.
+
+        :param fluent_matrix: the boolean fluent matrix of shape (nb_transitions, nb_fluents).
+        :param dones: the boolean vector of shape (nb_transitions,).
+        :return: the boolean matrix of shape (nb_transitions, nb_reward_machines)
+          of the transitions read by every reward machine.
+        """
+        nb_reward_machines = len(self._reward_machines)
+        if self.step_controller is None:
+            return np.ones((len(dones), nb_reward_machines), dtype=bool)
+        step_controller = self.step_controller
+        vocabulary = self.vocabulary
+        allowed = []
+        for mask, done in zip(vocabulary.to_bitmasks(fluent_matrix), dones.tolist()):
+            allowed.append(
+                [
+                    step_controller.step_bitmask(mask, vocabulary)
+                    for _ in range(nb_reward_machines)
+                ]
+            )
+            if done:
+                step_controller.reset()
+        return np.asarray(allowed, dtype=bool).reshape(len(dones), nb_reward_machines)
+
+    def relabel_chunk(
+        self, fluent_matrix: np.ndarray, dones: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Relabel a chunk of transitions.
+
+        :param fluent_matrix: the boolean fluent matrix of shape (nb_transitions, nb_fluents).
+        :param dones: the boolean vector of shape (nb_transitions,), True at the last
+          transition of every episode.
+        :return: the state ids reached after every transition and the rewards
+          of every transition, both of shape (nb_transitions, nb_reward_machines).
+        :raise ValueError: if the arrays have different lengths.
+        """
+        fluent_matrix = np.asarray(fluent_matrix, dtype=bool)
+        dones = np.asarray(dones, dtype=bool)
+        enforce(
+            len(fluent_matrix) == len(dones),
+            f"got {len(fluent_matrix)} fluent rows and {len(dones)} episode flags",
+            ValueError,
+        )
+        nb_transitions = len(dones)
+        nb_reward_machines = len(self._reward_machines)
+        states = np.empty((nb_transitions, nb_reward_machines), dtype=np.int32)
+        rewards = np.zeros((nb_transitions, nb_reward_machines), dtype=np.float64)
+        allowed = self._allowed_steps(fluent_matrix, dones)
+        for index, (rm, columns, weights) in enumerate(
+            zip(self._reward_machines, self._fluent_columns, self._fluent_weights)
+        ):
+            masks = fluent_matrix[:, columns].astype(np.int64) @ weights
+            rm_states, rm_rewards, state_id = run_reward_machine(
+                rm,
+                masks,
+                dones=dones,
+                allowed=allowed[:, index],
+                state_id=self._current_state_ids[index],
+            )
+            states[:, index] = rm_states
+            rewards[:, index] = rm_rewards
+            self._current_state_ids[index] = state_id
+        return states, rewards
+
+    def relabel(
+        self, chunks: Iterable[Chunk]
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Relabel a stream of chunks of transitions.
+
+        Only one chunk at a time is kept in memory.
+
+        :param chunks: the iterable of pairs (fluent matrix, dones).
+        :return: the iterator over the pairs (state ids, rewards) of the chunks.
+        """
+        for fluent_matrix, dones in chunks:
+            yield self.relabel_chunk(fluent_matrix, dones)
+
+
+def split_episodes(dones: np.ndarray, shard_size: int) -> List[Tuple[int, int]]:
+    """
+    Split a dataset of transitions into shards made of whole episodes.
+
+    Consecutive episodes are grouped until a shard has at least 'shard_size'
+    transitions. The shards only depend on the data and on the shard size.
+    A trailing incomplete episode is included in the last shard.
+
+    :param dones: the boolean vector of shape (nb_transitions,), True at the last
+      transition of every episode.
+    :param shard_size: the minimum number of transitions per shard (except the last one).
+    :return: the list of the pairs (start, end) of the shards.
+    """
+    enforce(shard_size > 0, "the shard size must be positive", ValueError)
+    nb_transitions = len(dones)
+    episode_ends = np.flatnonzero(np.asarray(dones, dtype=bool)) + 1
+    shards = []
+    start = 0
+    for end in episode_ends.tolist():
+        if end - start >= shard_size:
+            shards.append((start, end))
+            start = end
+    if start < nb_transitions:
+        shards.append((start, nb_transitions))
+    return shards
+
+
+class _ShardTask(NamedTuple):
+    """
+    The description of the relabeling of a shard.
+
+    The fluent matrix and the dones are either the paths of .npy files,
+    or the rows of the shard.
+    """
+
+    reward_machines: Sequence[str]
+    fluents: Sequence[Symbol]
+    step_controller: Optional[AbstractStepController]
+    fluent_matrix: Union[str, np.ndarray]
+    dones: Union[str, np.ndarray]
+    start: int
+    end: int
+    chunk_size: int
+    states_path: str
+    rewards_path: str
+
+
+def _get_shard_source(
+    source: Union[str, np.ndarray], start: int, end: int
+) -> Union[str, np.ndarray]:
+    """Get the source of the rows of a shard, i.e. the path of a .npy file or the rows."""
+    return source if isinstance(source, str) else source[start:end]
+
+
+def _load_rows(source: Union[str, np.ndarray], start: int, end: int) -> np.ndarray:
+    """Get the rows of a shard, memory-mapping the array if it is stored on disk."""
+    if isinstance(source, str):
+        return np.load(source, mmap_mode="r")[start:end]
+    return source
+
+
+def _relabel_shard(task: _ShardTask) -> None:
+    """Relabel a shard, and save the state ids and the rewards on disk."""
+    relabeler = TrajectoryRelabeler(
+        [load_compiled_reward_machine(path) for path in task.reward_machines],
+        task.fluents,
+        step_controller=task.step_controller,
+    )
+    relabeler.reset()
+    nb_transitions = task.end - task.start
+    states = np.lib.format.open_memmap(
+        task.states_path,
+        mode="w+",
+        dtype=np.int32,
+        shape=(nb_transitions, len(task.reward_machines)),
+    )
+    rewards = np.lib.format.open_memmap(
+        task.rewards_path,
+        mode="w+",
+        dtype=np.float64,
+        shape=(nb_transitions, len(task.reward_machines)),
+    )
+    chunks = iter_array_chunks(
+        _load_rows(task.fluent_matrix, task.start, task.end),
+        _load_rows(task.dones, task.start, task.end),
+        task.chunk_size,
+    )
+    offset = 0
+    for chunk_states, chunk_rewards in relabeler.relabel(chunks):
+        end = offset + len(chunk_states)
+        states[offset:end] = chunk_states
+        rewards[offset:end] = chunk_rewards
+        offset = end
+    states.flush()
+    rewards.flush()
+
+
+class RelabelingOptions(NamedTuple):
+    """
+    The options of the parallel relabeling of a dataset.
+
+    - step_controller: the step controller. It must be picklable, since
+      a copy is sent to every worker. If None, every transition is read by the reward machines;
+    - nb_workers: the number of worker processes. If None, it is the number of CPUs;
+      if 0 or 1, the shards are relabeled in the current process;
+    - shard_size: the minimum number of transitions per shard;
+    - chunk_size: the number of transitions relabeled at a time by a worker.
+    """
+
+    step_controller: Optional[AbstractStepController] = None
+    nb_workers: Optional[int] = None
+    shard_size: int = DEFAULT_SHARD_SIZE
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+
+
+def _as_source(array: Union[str, Path, np.ndarray]) -> Union[str, np.ndarray]:
+    """Get an array as sent to the workers, i.e. the path of a .npy file or an array."""
+    return str(array) if isinstance(array, (str, Path)) else np.asarray(array)
+
+
+def _save_reward_machines(
+    reward_machines: Sequence[CompiledRewardMachine], output_path: Path
+) -> List[str]:
+    """Save compiled reward machines in the output directory, and get their paths."""
+    paths = [
+        str(output_path / "automata" / f"rm_{i:03d}")
+        for i in range(len(reward_machines))
+    ]
+    for rm, path in zip(reward_machines, paths):
+        save_compiled_reward_machine(rm, path)
+    return paths
+
+
+def relabel_dataset(
+    reward_machines: Sequence[AbstractRewardMachine],
+    fluents: Sequence[Symbol],
+    fluent_matrix: Union[str, Path, np.ndarray],
+    dones: Union[str, Path, np.ndarray],
+    output_dir: Union[str, Path],
+    *,
+    options: RelabelingOptions = RelabelingOptions(),
+) -> Dict[str, Any]:
+    """
+    Relabel a dataset of transitions in parallel.
+
+    The reward machines are compiled once, and saved in the output directory
+    (see 'save_compiled_reward_machine'), so that the workers can memory-map
+    their tables read-only.
+    The dataset is split into shards made of whole episodes (see 'split_episodes'),
+    which are relabeled in parallel by a pool of processes. Arrays stored on disk
+    are memory-mapped by the workers; in-memory arrays are sliced, so that every
+    worker only receives the rows of its shards. For every shard,
+    the state ids and the rewards are saved in .npy files, and an index of the
+    shards is saved in 'index.json'. The output does not depend on the number of workers.
+
+    :param reward_machines: the reward machines.
+    :param fluents: the fluents, in the order of the columns of the fluent matrix.
+    :param fluent_matrix: the boolean fluent matrix of shape (nb_transitions, nb_fluents),
+      or the path of the .npy file that contains it.
+    :param dones: the boolean vector of shape (nb_transitions,), True at the last
+      transition of every episode, or the path of the .npy file that contains it.
+    :param output_dir: the output directory.
+    :param options: the step controller, the number of workers, and the sizes
+      of the shards and of the chunks.
+    :return: the index of the shards.
+    :raise ValueError: if a reward machine reads a fluent that is not provided.
+    """
+    output_path = Path(output_dir)
+    relabeler = TrajectoryRelabeler(reward_machines, fluents)
+    shared = _save_reward_machines(relabeler.reward_machines, output_path)
+    fluent_matrix_source = _as_source(fluent_matrix)
+    dones_source = _as_source(dones)
+    all_dones = (
+        np.load(dones_source, mmap_mode="r")
+        if isinstance(dones_source, str)
+        else dones_source
+    )
+    tasks = [
+        _ShardTask(
+            shared,
+            tuple(fluents),
+            options.step_controller,
+            _get_shard_source(fluent_matrix_source, start, end),
+            _get_shard_source(dones_source, start, end),
+            start,
+            end,
+            options.chunk_size,
+            str(output_path / f"shard_{index:05d}_states.npy"),
+            str(output_path / f"shard_{index:05d}_rewards.npy"),
+        )
+        for index, (start, end) in enumerate(
+            split_episodes(all_dones, options.shard_size)
+        )
+    ]
+    nb_workers = (
+        os.cpu_count() or 1 if options.nb_workers is None else options.nb_workers
+    )
+    if nb_workers <= 1:
+        for task in tasks:
+            _relabel_shard(task)
+    else:
+        with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+            list(executor.map(_relabel_shard, tasks))
+
+    index = {
+        "fluents": [str(f) for f in fluents],
+        "nb_reward_machines": len(shared),
+        "nb_transitions": len(all_dones),
+        "shards": [
+            {
+                "start": task.start,
+                "end": task.end,
+                "states": Path(task.states_path).name,
+                "rewards": Path(task.rewards_path).name,
+            }
+            for task in tasks
+        ],
+    }
+    (output_path / INDEX_FILENAME).write_text(json.dumps(index, indent=2))
+    return index
+
+
+def load_relabeled_dataset(
+    output_dir: Union[str, Path]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the output of 'relabel_dataset', merging the shards.
+
+    :param output_dir: the output directory of 'relabel_dataset'.
+    :return: the state ids and the rewards of all the transitions.
+    """
+    output_path = Path(output_dir)
+    index = json.loads((output_path / INDEX_FILENAME).read_text())
+    shape = (index["nb_transitions"], index["nb_reward_machines"])
+    states = np.empty(shape, dtype=np.int32)
+    rewards = np.empty(shape, dtype=np.float64)
+    for shard in index["shards"]:
+        start, end = shard["start"], shard["end"]
+        states[start:end] = np.load(output_path / shard["states"], mmap_mode="r")
+        rewards[start:end] = np.load(output_path / shard["rewards"], mmap_mode="r")
+    return states, rewards
@@ -20,12 +20,14 @@
 #
 
 """Classes that implement automata that give the rewards to the RL agent."""
-from typing import AbstractSet
+from typing import AbstractSet, Dict, Optional, Tuple
 
 from pythomata.core import DFA
 
+from temprl.fluents import FluentVocabulary, SymbolClasses
 from temprl.reward_machines.base import AbstractRewardMachine
-from temprl.types import Interpretation, State, TransitionType
+from temprl.reward_machines.compiled import get_fluents_of_guards, get_guard_fluents
+from temprl.types import Interpretation, State, Symbol, TransitionType
 
 
 class RewardAutomaton(AbstractRewardMachine):
@@ -36,6 +38,10 @@ class RewardAutomaton(AbstractRewardMachine):
         super().__init__()
         self._automaton = dfa
         self._reward = reward
+        self._support: Optional[AbstractSet[Symbol]] = None
+        self._support_computed = False
+        self._symbol_classes: Optional[SymbolClasses] = None
+        self._bitmask_transitions: Dict[State, Dict[int, Tuple[State, float]]] = {}
 
     @property
     def states(self) -> AbstractSet[State]:
@@ -55,15 +61,65 @@ class RewardAutomaton(AbstractRewardMachine):
         """
         return self._automaton.initial_state
 
+    @property
+    def accepting_states(self) -> AbstractSet[State]:
+        """
+        Get the accepting states.
+
+        :return: the accepting states of the automaton.
+        """
+        return self._automaton.accepting_states
+
+    @property
+    def support(self) -> Optional[AbstractSet[Symbol]]:
+        """
+        Get the support, i.e. the set of fluents read by the guards.
+
+        It is computed from the guards at the first access. If the guards
+        are not symbolic expressions, the support is unknown.
+
+        :return: the support, or None if it is unknown.
+        """
+        if not self._support_computed:
+            self._support_computed = True
+            try:
+                self._support = frozenset(
+                    get_fluents_of_guards(
+                        guard for _, guard, _ in self.get_transitions()
+                    )
+                )
+            except ValueError:
+                self._support = None
+        return self._support
+
+    @property
+    def symbol_classes(self) -> Optional[SymbolClasses]:
+        """
+        Get the partition of the interpretations by their projection onto the support.
+
+        :return: the symbol classes, or None if the support is unknown.
+        """
+        if self._symbol_classes is None and self.support is not None:
+            self._symbol_classes = SymbolClasses(get_guard_fluents(self))
+        return self._symbol_classes
+
     def get_successor(self, state: State, symbol: Interpretation) -> State:
         """
         Get the (unique) successor.
 
+        The symbol is projected onto the support, if known,
+        so that only the fluents read by the guards are converted.
+
         :param: state: the starting state.
         :param: symbol: the symbol to read.
         :returns: the next state. If not defined, return None.
         """
-        dfa_symbol = {symbol_name: True for symbol_name in symbol}
+        support = self.support
+        dfa_symbol = {
+            symbol_name: True
+            for symbol_name in symbol
+            if support is None or symbol_name in support
+        }
         return self._automaton.get_successor(state, dfa_symbol)
 
     def get_transitions_from(self, state: State) -> AbstractSet[TransitionType]:
@@ -95,5 +151,47 @@ class RewardAutomaton(AbstractRewardMachine):
         :param symbol: the read symbol.
         :return: the reward signal.
         """
+        return self.transition(state, symbol)[1]
+
+    def transition(self, state: State, symbol: Interpretation) -> Tuple[State, float]:
+        """
+        Do a transition, computing both the successor and the reward.
+
+        The successor is computed only once, and the reward
+        is derived from the acceptance condition of the successor.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state and the reward signal.
+        """
         end_state = self.get_successor(state, symbol)
-        return self.reward if self._automaton.is_accepting(end_state) else 0.0
+        reward = self.reward if self._automaton.is_accepting(end_state) else 0.0
+        return end_state, reward
+
+    def transition_bitmask(
+        self, state: State, mask: int, vocabulary: FluentVocabulary
+    ) -> Tuple[State, float]:
+        """
+        Do a transition, reading a symbol encoded as a bitmask.
+
+        If the support is known, the bitmask is mapped to its symbol class,
+        and the transitions are memoized per (state, symbol class), so that
+        the guards are evaluated only the first time a transition is taken.
+
+        :param state: the starting state.
+        :param mask: the bitmask of the read symbol.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the successor state and the reward signal.
+        """
+        symbol_classes = self.symbol_classes
+        if symbol_classes is None:
+            return super().transition_bitmask(state, mask, vocabulary)
+        class_id = symbol_classes.get_class_id_bitmask(mask, vocabulary)
+        transitions = self._bitmask_transitions.get(state)
+        if transitions is None:
+            transitions = self._bitmask_transitions.setdefault(state, {})
+        result = transitions.get(class_id)
+        if result is None:
+            result = self.transition(state, symbol_classes.get_representative(class_id))
+            transitions[class_id] = result
+        return result
@@ -21,10 +21,11 @@
 
 """Base classes and interfaces for reward machines."""
 from abc import ABC, ABCMeta, abstractmethod
-from typing import AbstractSet, Tuple, cast
+from typing import AbstractSet, Optional, Tuple, cast
 
+from temprl.fluents import FluentVocabulary
 from temprl.helpers import enforce
-from temprl.types import Interpretation, State, TransitionType
+from temprl.types import Interpretation, State, Symbol, TransitionType
 
 
 class _MetaRewardMachine(ABCMeta):
@@ -66,6 +67,31 @@ class AbstractRewardMachine(ABC, metaclass=_MetaRewardMachine):
     def initial_state(self) -> State:
         """Get the initial state."""
 
+    @property
+    def max_nb_states(self) -> int:
+        """
+        Get an upper bound on the number of states.
+
+        The default implementation returns the number of states; reward machines
+        that are not fully materialized can override it with a declared bound.
+
+        :return: the upper bound.
+        """
+        return len(self.states)
+
+    @property
+    def support(self) -> Optional[AbstractSet[Symbol]]:
+        """
+        Get the support, i.e. a set of fluents that contains the fluents read by the guards.
+
+        The truth value of the fluents outside the support does not affect
+        the transitions, so interpretations can be projected onto the support.
+        The default implementation returns None, i.e. the support is unknown.
+
+        :return: the support, or None if it is unknown.
+        """
+        return None
+
     @abstractmethod
     def get_transitions_from(self, state: State) -> AbstractSet[TransitionType]:
         """
@@ -100,6 +126,37 @@ class AbstractRewardMachine(ABC, metaclass=_MetaRewardMachine):
         :raise ValueError: if the provided state does not belong to the automaton.
         """
 
+    def transition(self, state: State, symbol: Interpretation) -> Tuple[State, float]:
+        """
+        Do a transition, computing both the successor and the reward.
+
+        The default implementation calls 'get_successor' and 'get_reward';
+        subclasses can override it to evaluate the transition only once.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        return self.get_successor(state, symbol), self.get_reward(state, symbol)
+
+    def transition_bitmask(
+        self, state: State, mask: int, vocabulary: FluentVocabulary
+    ) -> Tuple[State, float]:
+        """
+        Do a transition, reading a symbol encoded as a bitmask.
+
+        The default implementation decodes the bitmask and calls 'transition';
+        subclasses can override it to consume the bitmask directly.
+
+        :param state: the starting state.
+        :param mask: the bitmask of the read symbol.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        return self.transition(state, vocabulary.decode(mask))
+
     def get_transitions(self) -> AbstractSet[TransitionType]:
         """
         Get all the transitions.
@@ -116,6 +173,8 @@ class AbstractRewardMachine(ABC, metaclass=_MetaRewardMachine):
 class AbstractRewardMachineSimulator(ABC):
     """Interface for abstract reward machine simulator."""
 
+    __slots__ = ()
+
     @abstractmethod
     def step(self, symbol: Interpretation) -> Tuple[State, float]:
         """
@@ -146,6 +205,8 @@ class AbstractRewardMachineSimulator(ABC):
 class RewardMachineSimulator(AbstractRewardMachineSimulator):
     """Concrete class of AbstractRewardMachineSimulator."""
 
+    __slots__ = ("_reward_machine", "_current_state")
+
     def __init__(self, reward_machine: AbstractRewardMachine):
         """Initialize the reward machine simulator."""
         self._reward_machine = reward_machine
@@ -161,6 +222,11 @@ class RewardMachineSimulator(AbstractRewardMachineSimulator):
         """Get the current state."""
         return self._current_state
 
+    @current_state.setter
+    def current_state(self, state: State) -> None:
+        """Set the current state, e.g. to synchronize the simulation with another one."""
+        self._current_state = state
+
     def reset(self) -> None:
         """Reset the simulation to its initial state."""
         self._current_state = self._reward_machine.initial_state
@@ -172,7 +238,24 @@ class RewardMachineSimulator(AbstractRewardMachineSimulator):
         :param symbol: the symbol to read.
         :return: the new state and the generated reward signal.
         """
-        reward = self._reward_machine.get_reward(self._current_state, symbol)
-        next_state = self._reward_machine.get_successor(self._current_state, symbol)
+        next_state, reward = self._reward_machine.transition(
+            self._current_state, symbol
+        )
+        self._current_state = next_state
+        return next_state, reward
+
+    def step_bitmask(
+        self, mask: int, vocabulary: FluentVocabulary
+    ) -> Tuple[State, float]:
+        """
+        Do a step, reading a symbol encoded as a bitmask.
+
+        :param mask: the bitmask of the symbol to read.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the new state and the generated reward signal.
+        """
+        next_state, reward = self._reward_machine.transition_bitmask(
+            self._current_state, mask, vocabulary
+        )
         self._current_state = next_state
         return next_state, reward
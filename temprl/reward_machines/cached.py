@@ -0,0 +1,227 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Reward machines with a memoized transition function."""
+from collections import OrderedDict
+from typing import AbstractSet, Callable, Hashable, NamedTuple, Optional, Tuple
+
+from temprl.fluents import FluentVocabulary, SymbolClasses
+from temprl.helpers import enforce
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import get_guard_fluents
+from temprl.types import Interpretation, State, Symbol, TransitionType
+
+DEFAULT_MAX_SIZE = 1024
+
+
+class CacheInfo(NamedTuple):
+    """Statistics of a transition cache."""
+
+    hits: int
+    misses: int
+    evictions: int
+    max_size: Optional[int]
+    size: int
+
+
+class CachedRewardMachine(AbstractRewardMachine):
+    """
+    A reward machine that memoizes the transitions of another reward machine.
+
+    The pairs (state, interpretation) are mapped to the pairs (successor, reward),
+    where the interpretations are replaced by their symbol class, i.e. their projection
+    onto the support of the reward machine, if known, so that interpretations (or bitmasks)
+    that differ only on unread fluents share an entry; and the least recently used entry
+    is evicted when the cache is full.
+    This is useful when the guards are expensive to evaluate, but a full
+    compilation (see CompiledRewardMachine) is not viable.
+    """
+
+    def __init__(
+        self,
+        reward_machine: AbstractRewardMachine,
+        max_size: Optional[int] = DEFAULT_MAX_SIZE,
+    ):
+        """
+        Initialize the cached reward machine.
+
+        :param reward_machine: the reward machine whose transitions are memoized.
+        :param max_size: the maximum number of cached transitions.
+          If None, the cache is unbounded.
+        :raise ValueError: if the maximum size is not positive.
+        """
+        super().__init__()
+        enforce(
+            max_size is None or max_size > 0,
+            f"max size must be positive, got {max_size}",
+            ValueError,
+        )
+        self._reward_machine = reward_machine
+        support = reward_machine.support
+        self._support = frozenset(support) if support is not None else None
+        self._symbol_classes = (
+            SymbolClasses(get_guard_fluents(reward_machine))
+            if support is not None
+            else None
+        )
+        self._max_size = max_size
+        self._cache: "OrderedDict[Tuple[State, Hashable], Tuple[State, float]]" = (
+            OrderedDict()
+        )
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def reward_machine(self) -> AbstractRewardMachine:
+        """Get the wrapped reward machine."""
+        return self._reward_machine
+
+    @property
+    def states(self) -> AbstractSet[State]:
+        """Get the set of states."""
+        return self._reward_machine.states
+
+    @property
+    def initial_state(self) -> State:
+        """Get the initial state."""
+        return self._reward_machine.initial_state
+
+    @property
+    def max_nb_states(self) -> int:
+        """Get an upper bound on the number of states."""
+        return self._reward_machine.max_nb_states
+
+    @property
+    def support(self) -> Optional[AbstractSet[Symbol]]:
+        """Get the support of the wrapped reward machine."""
+        return self._support
+
+    @property
+    def symbol_classes(self) -> Optional[SymbolClasses]:
+        """Get the symbol classes that key the cache, or None if the support is unknown."""
+        return self._symbol_classes
+
+    def get_transitions_from(self, state: State) -> AbstractSet[TransitionType]:
+        """
+        Get the outgoing transitions from a state.
+
+        :param state: the source state.
+        :return: the set of transitions object associated with that triple.
+        :raise ValueError: if the state does not belong to the automaton.
+        """
+        return self._reward_machine.get_transitions_from(state)
+
+    def cache_info(self) -> CacheInfo:
+        """Get the statistics of the transition cache."""
+        return CacheInfo(
+            self._hits, self._misses, self._evictions, self._max_size, len(self._cache)
+        )
+
+    def cache_clear(self) -> None:
+        """Clear the transition cache and its statistics."""
+        self._cache.clear()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def transition(self, state: State, symbol: Interpretation) -> Tuple[State, float]:
+        """
+        Do a transition, computing both the successor and the reward.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        symbol_classes = self._symbol_classes
+        key = (
+            state,
+            frozenset(symbol)
+            if symbol_classes is None
+            else symbol_classes.get_class_id(symbol),
+        )
+        return self._lookup(key, lambda: self._reward_machine.transition(state, symbol))
+
+    def transition_bitmask(
+        self, state: State, mask: int, vocabulary: FluentVocabulary
+    ) -> Tuple[State, float]:
+        """
+        Do a transition, reading a symbol encoded as a bitmask.
+
+        If the support is known, the bitmask is mapped to its symbol class without
+        decoding it, and shares the cache entry of the interpretations of that class.
+
+        :param state: the starting state.
+        :param mask: the bitmask of the read symbol.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        symbol_classes = self._symbol_classes
+        if symbol_classes is None:
+            return super().transition_bitmask(state, mask, vocabulary)
+        key = (state, symbol_classes.get_class_id_bitmask(mask, vocabulary))
+        return self._lookup(
+            key,
+            lambda: self._reward_machine.transition_bitmask(state, mask, vocabulary),
+        )
+
+    def _lookup(
+        self, key: Tuple[State, Hashable], compute: Callable[[], Tuple[State, float]]
+    ) -> Tuple[State, float]:
+        """Get a cached transition, computing and caching it on a miss."""
+        cache = self._cache
+        result = cache.get(key)
+        if result is not None:
+            self._hits += 1
+            cache.move_to_end(key)
+            return result
+        self._misses += 1
+        result = compute()
+        cache[key] = result
+        if self._max_size is not None and len(cache) > self._max_size:
+            cache.popitem(last=False)
+            self._evictions += 1
+        return result
+
+    def get_successor(self, state: State, symbol: Interpretation) -> State:
+        """
+        Get the (unique) successor.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        return self.transition(state, symbol)[0]
+
+    def get_reward(self, state: State, symbol: Interpretation) -> float:
+        """
+        Get the reward associated to the transition.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        return self.transition(state, symbol)[1]
@@ -0,0 +1,496 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Reward machines compiled into integer lookup tables."""
+import hashlib
+import json
+from typing import (
+    AbstractSet,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+
+import numpy as np
+
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.lazy import LazyRewardMachine
+from temprl.types import Guard, Interpretation, State, Symbol, TransitionType
+
+DEFAULT_MAX_FLUENTS = 16
+
+
+def _sorted_if_possible(items: AbstractSet) -> List:
+    """Sort the items, if they are comparable; otherwise, keep the iteration order."""
+    try:
+        return sorted(items)
+    except TypeError:
+        return list(items)
+
+
+def get_fluents_of_guards(guards: Iterable[Guard]) -> List[Symbol]:
+    """
+    Get the fluents that occur in a collection of guards.
+
+    The guards are expected to be symbolic expressions exposing
+    the attribute 'free_symbols' (e.g. sympy expressions, as in pythomata.SymbolicDFA).
+
+    :param guards: the guards.
+    :return: the sorted list of fluent names.
+    :raise ValueError: if some guard is not a symbolic expression.
+    """
+    fluents: Set[Symbol] = set()
+    for guard in guards:
+        free_symbols = getattr(guard, "free_symbols", None)
+        enforce(
+            free_symbols is not None,
+            f"cannot infer the fluents of guard {guard!r}; please provide them explicitly",
+            ValueError,
+        )
+        fluents.update(str(symbol) for symbol in cast(AbstractSet, free_symbols))
+    return _sorted_if_possible(fluents)
+
+
+def get_guard_fluents(reward_machine: AbstractRewardMachine) -> List[Symbol]:
+    """
+    Get the fluents that occur in the guards of a reward machine.
+
+    If the support of the reward machine is known, it is used instead of the guards.
+
+    :param reward_machine: the reward machine.
+    :return: the sorted list of fluent names.
+    :raise ValueError: if some guard is not a symbolic expression.
+    """
+    support = reward_machine.support
+    if support is not None:
+        return _sorted_if_possible(support)
+    return get_fluents_of_guards(
+        guard for _, guard, _ in reward_machine.get_transitions()
+    )
+
+
+def compute_fingerprint(reward_machine: AbstractRewardMachine) -> str:
+    """
+    Compute the fingerprint of a reward machine.
+
+    The fingerprint is the one of the compiled reward machine
+    (see CompiledRewardMachine.fingerprint). Reward machines that are
+    not instances of CompiledRewardMachine are compiled.
+
+    :param reward_machine: the reward machine.
+    :return: the hexadecimal fingerprint.
+    """
+    if not isinstance(reward_machine, CompiledRewardMachine):
+        reward_machine = CompiledRewardMachine.from_reward_machine(reward_machine)
+    return reward_machine.fingerprint
+
+
+class CompiledRewardMachine(AbstractRewardMachine):
+    """
+    A reward machine whose transition function is compiled into lookup tables.
+
+    States are mapped to dense integer ids, and every interpretation over
+    the fluent vocabulary is mapped to a bitmask, where the i-th bit is set
+    iff the i-th fluent is true. The transition function and the reward
+    function are stored as two tables of shape (nb_states, 2 ** nb_fluents),
+    indexed by (state_id, bitmask).
+
+    Fluents that do not belong to the vocabulary are ignored.
+    """
+
+    # pylint: disable=too-many-public-methods
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        states: Sequence[State],
+        fluents: Sequence[Symbol],
+        initial_state: State,
+        transitions: np.ndarray,
+        rewards: np.ndarray,
+        *,
+        accepting_states: Optional[AbstractSet[State]] = None,
+        fingerprint: Optional[str] = None,
+        check_tables: bool = True,
+    ):
+        """
+        Initialize the compiled reward machine.
+
+        :param states: the states; the position in the sequence is the state id.
+        :param fluents: the fluent vocabulary; the position in the sequence is the bit position.
+        :param initial_state: the initial state.
+        :param transitions: the table of successor ids, of shape (nb_states, 2 ** nb_fluents).
+        :param rewards: the table of rewards, of shape (nb_states, 2 ** nb_fluents).
+        :param accepting_states: the accepting states, if the reward machine is an acceptor.
+        :param fingerprint: the fingerprint, if known (e.g. read from a saved file).
+          If None, it is computed at the first access.
+        :param check_tables: whether to check that the transition table contains valid
+          state ids. This requires to read the whole table; it can be disabled
+          for trusted tables, e.g. to avoid reading memory-mapped tables at loading time.
+        """
+        super().__init__()
+        self._states: Tuple[State, ...] = tuple(states)
+        self._state_set: AbstractSet[State] = frozenset(self._states)
+        self._vocabulary = FluentVocabulary(fluents)
+        self._state_ids: Dict[State, int] = {s: i for i, s in enumerate(self._states)}
+        enforce(
+            len(self._state_ids) == len(self._states),
+            "states are not unique",
+            ValueError,
+        )
+        expected_shape = (len(self._states), 1 << len(self._vocabulary))
+        enforce(
+            transitions.shape == expected_shape,
+            f"expected transition table of shape {expected_shape}, got {transitions.shape}",
+            ValueError,
+        )
+        enforce(
+            rewards.shape == expected_shape,
+            f"expected reward table of shape {expected_shape}, got {rewards.shape}",
+            ValueError,
+        )
+        enforce(
+            not check_tables
+            or bool(np.all((transitions >= 0) & (transitions < len(self._states)))),
+            "transition table contains invalid state ids",
+            ValueError,
+        )
+        self._initial_state = initial_state
+        self._initial_state_id = self.get_state_id(initial_state)
+        self._transitions = np.asarray(transitions, dtype=np.int32)
+        self._rewards = np.asarray(rewards, dtype=np.float64)
+        self._transitions.setflags(write=False)
+        self._rewards.setflags(write=False)
+        # the translator from the vocabulary of the last bitmask, usually the same at every step
+        self._translator_vocabulary = self._vocabulary
+        self._translator = self._vocabulary.get_translator(self._vocabulary)
+        self._accepting_states = (
+            frozenset(accepting_states) if accepting_states is not None else None
+        )
+        enforce(
+            self._accepting_states is None
+            or self._accepting_states.issubset(self._state_set),
+            "accepting states must be states of the reward machine",
+            ValueError,
+        )
+        self._fingerprint = fingerprint
+
+    @classmethod
+    def from_reward_machine(
+        cls,
+        reward_machine: AbstractRewardMachine,
+        fluents: Optional[Sequence[Symbol]] = None,
+        max_fluents: int = DEFAULT_MAX_FLUENTS,
+    ) -> "CompiledRewardMachine":
+        """
+        Compile a reward machine into lookup tables.
+
+        The reward machine is evaluated once for every pair
+        (state, interpretation over the fluents).
+
+        :param reward_machine: the reward machine to compile.
+        :param fluents: the fluent vocabulary. If None, it is inferred from the guards.
+        :param max_fluents: the maximum number of fluents allowed,
+          to bound the size of the tables.
+        :return: the compiled reward machine.
+        :raise ValueError: if there are too many fluents, if the reward machine is not complete,
+          or if it is a lazy reward machine.
+        """
+        enforce(
+            not isinstance(reward_machine, LazyRewardMachine),
+            "cannot compile a lazy reward machine, since its states are not materialized",
+            ValueError,
+        )
+        fluents = (
+            get_guard_fluents(reward_machine) if fluents is None else list(fluents)
+        )
+        enforce(
+            len(fluents) <= max_fluents,
+            f"cannot compile a reward machine over {len(fluents)} fluents (max: {max_fluents})",
+            ValueError,
+        )
+        states = _sorted_if_possible(reward_machine.states)
+        state_ids = {s: i for i, s in enumerate(states)}
+        nb_symbols = 1 << len(fluents)
+        interpretations = [
+            frozenset(f for i, f in enumerate(fluents) if mask & (1 << i))
+            for mask in range(nb_symbols)
+        ]
+        transitions = np.empty((len(states), nb_symbols), dtype=np.int32)
+        rewards = np.empty((len(states), nb_symbols), dtype=np.float64)
+        for state_id, state in enumerate(states):
+            for mask, interpretation in enumerate(interpretations):
+                successor = reward_machine.get_successor(state, interpretation)
+                enforce(
+                    successor is not None,
+                    f"transition from state {state} with symbol {set(interpretation)} "
+                    "is not defined; the reward machine must be complete",
+                    ValueError,
+                )
+                transitions[state_id, mask] = state_ids[successor]
+                rewards[state_id, mask] = reward_machine.get_reward(
+                    state, interpretation
+                )
+        return cls(
+            states,
+            fluents,
+            reward_machine.initial_state,
+            transitions,
+            rewards,
+            accepting_states=getattr(reward_machine, "accepting_states", None),
+        )
+
+    @property
+    def states(self) -> AbstractSet[State]:
+        """Get the set of states."""
+        return self._state_set
+
+    @property
+    def initial_state(self) -> State:
+        """Get the initial state."""
+        return self._initial_state
+
+    @property
+    def accepting_states(self) -> Optional[AbstractSet[State]]:
+        """Get the accepting states, if the reward machine is an acceptor."""
+        return self._accepting_states
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Get the fingerprint, i.e. the SHA-256 digest of a canonical representation.
+
+        The states are numbered in order of discovery from the initial state,
+        and the bitmasks are taken over the fluents sorted by their representation,
+        so that the fingerprint neither depends on the order of the states and of the
+        fluents, nor on the iteration order of sets (e.g. on the hash seed).
+        The representation includes the states, the fluents, the accepting states,
+        and the transition and reward tables. It is computed at the first access.
+
+        :return: the hexadecimal fingerprint.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = self._compute_fingerprint()
+        return self._fingerprint
+
+    def _compute_fingerprint(self) -> str:
+        """Compute the fingerprint from the canonical tables."""
+        fluents = sorted(self.fluents, key=repr)
+        translator = FluentVocabulary(fluents).get_translator(self._vocabulary)
+        columns = [translator(mask) for mask in range(1 << len(fluents))]
+        transitions = self._transitions[:, columns]
+        order = [self._initial_state_id]
+        canonical_ids = {self._initial_state_id: 0}
+        index = 0
+        while index < len(order):
+            for successor in transitions[order[index]].tolist():
+                if successor not in canonical_ids:
+                    canonical_ids[successor] = len(order)
+                    order.append(successor)
+            index += 1
+        unreachable = sorted(
+            set(range(len(self._states))) - set(order),
+            key=lambda state_id: repr(self._states[state_id]),
+        )
+        order.extend(unreachable)
+        renumbering = np.empty(len(order), dtype=np.int32)
+        renumbering[order] = np.arange(len(order), dtype=np.int32)
+        accepting_states = self._accepting_states
+        description = {
+            "states": [repr(self._states[state_id]) for state_id in order],
+            "fluents": [repr(fluent) for fluent in fluents],
+            "accepting_states": sorted(
+                int(renumbering[self._state_ids[state]]) for state in accepting_states
+            )
+            if accepting_states is not None
+            else None,
+        }
+        digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8"))
+        digest.update(renumbering[transitions[order]].astype("<i4").tobytes())
+        digest.update(self._rewards[order][:, columns].astype("<f8").tobytes())
+        return digest.hexdigest()
+
+    @property
+    def initial_state_id(self) -> int:
+        """Get the id of the initial state."""
+        return self._initial_state_id
+
+    @property
+    def fluents(self) -> Tuple[Symbol, ...]:
+        """Get the fluent vocabulary, in bit order."""
+        return self._vocabulary.fluents
+
+    @property
+    def vocabulary(self) -> FluentVocabulary:
+        """Get the fluent vocabulary."""
+        return self._vocabulary
+
+    @property
+    def support(self) -> AbstractSet[Symbol]:
+        """Get the support, i.e. the fluent vocabulary."""
+        return frozenset(self._vocabulary.fluents)
+
+    @property
+    def transitions(self) -> np.ndarray:
+        """Get the (read-only) table of successor ids."""
+        return self._transitions
+
+    @property
+    def rewards(self) -> np.ndarray:
+        """Get the (read-only) table of rewards."""
+        return self._rewards
+
+    def get_state_id(self, state: State) -> int:
+        """
+        Get the id of a state.
+
+        :param state: the state.
+        :return: the state id.
+        :raise ValueError: if the state does not belong to the reward machine.
+        """
+        state_id = self._state_ids.get(state)
+        if state_id is None:
+            raise ValueError(f"state {state} does not belong to the reward machine")
+        return state_id
+
+    def get_state(self, state_id: int) -> State:
+        """
+        Get the state associated to an id.
+
+        :param state_id: the state id.
+        :return: the state.
+        """
+        return self._states[state_id]
+
+    def encode(self, symbol: Interpretation) -> int:
+        """
+        Encode an interpretation into a bitmask.
+
+        :param symbol: the set of true fluents.
+        :return: the bitmask.
+        """
+        return self._vocabulary.encode(symbol)
+
+    def decode(self, mask: int) -> Interpretation:
+        """
+        Decode a bitmask into an interpretation.
+
+        :param mask: the bitmask.
+        :return: the set of true fluents.
+        """
+        return self._vocabulary.decode(mask)
+
+    def translate(self, mask: int, vocabulary: FluentVocabulary) -> int:
+        """
+        Translate a bitmask over another vocabulary into a bitmask over this vocabulary.
+
+        Fluents that do not belong to the other vocabulary are considered false.
+        The permutation of the bits is precomputed once per vocabulary
+        (see FluentVocabulary.get_translator).
+
+        :param mask: the bitmask over the other vocabulary.
+        :param vocabulary: the other vocabulary.
+        :return: the bitmask over the vocabulary of the reward machine.
+        """
+        return vocabulary.get_translator(self._vocabulary)(mask)
+
+    def get_transitions_from(self, state: State) -> AbstractSet[TransitionType]:
+        """
+        Get the outgoing transitions from a state.
+
+        A transition is a triple (source_state, guard, destination_state),
+        where the guard is the frozenset of interpretations that lead to the destination.
+
+        :param state: the source state.
+        :return: the set of transitions object associated with that triple.
+        :raise ValueError: if the state does not belong to the automaton.
+        """
+        state_id = self.get_state_id(state)
+        guards: Dict[int, List[Interpretation]] = {}
+        for mask, successor_id in enumerate(self._transitions[state_id].tolist()):
+            guards.setdefault(successor_id, []).append(self.decode(mask))
+        return {
+            (state, frozenset(guard), self._states[successor_id])
+            for successor_id, guard in guards.items()
+        }
+
+    def get_successor(self, state: State, symbol: Interpretation) -> State:
+        """
+        Get the (unique) successor.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        successor_id = self._transitions[self.get_state_id(state), self.encode(symbol)]
+        return self._states[successor_id]
+
+    def get_reward(self, state: State, symbol: Interpretation) -> float:
+        """
+        Get the reward associated to the transition.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        return float(self._rewards[self.get_state_id(state), self.encode(symbol)])
+
+    def transition(self, state: State, symbol: Interpretation) -> Tuple[State, float]:
+        """
+        Do a transition, computing both the successor and the reward.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        state_id = self.get_state_id(state)
+        mask = self.encode(symbol)
+        successor_id = self._transitions.item(state_id, mask)
+        return self._states[successor_id], self._rewards.item(state_id, mask)
+
+    def transition_bitmask(
+        self, state: State, mask: int, vocabulary: FluentVocabulary
+    ) -> Tuple[State, float]:
+        """
+        Do a transition, reading a symbol encoded as a bitmask.
+
+        :param state: the starting state.
+        :param mask: the bitmask of the read symbol.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state does not belong to the automaton.
+        """
+        state_id = self.get_state_id(state)
+        if vocabulary is not self._translator_vocabulary:
+            self._translator = vocabulary.get_translator(self._vocabulary)
+            self._translator_vocabulary = vocabulary
+        mask = self._translator(mask)
+        successor_id = self._transitions.item(state_id, mask)
+        return self._states[successor_id], self._rewards.item(state_id, mask)
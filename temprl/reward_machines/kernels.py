@@ -0,0 +1,177 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Kernels to run compiled reward machines over sequences of bitmasks.
+
+If numba is installed, the kernel is JIT-compiled to machine code; otherwise,
+the same kernel is run by the interpreter over Python lists. Both give the same results.
+"""
+from typing import List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from temprl.helpers import enforce
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import CompiledRewardMachine
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+_tables_cache: "WeakKeyDictionary[CompiledRewardMachine, Tuple[List, List]]" = (
+    WeakKeyDictionary()
+)
+
+
+def _run_kernel(tables, state_ids, inputs, outputs):
+    """
+    Run the transition and the reward tables over a sequence of bitmasks.
+
+    The arrays can be either NumPy arrays or (nested) Python lists.
+
+    :param tables: the table of successor ids and the table of rewards.
+    :param state_ids: the id of the initial state, reached after the last transition
+      of an episode, and the id of the state before the first transition.
+    :param inputs: the bitmasks, the flags of the last transitions of the episodes,
+      and the flags of the transitions read by the reward machine.
+    :param outputs: where the state ids reached after every transition
+      and the rewards of every transition are written.
+    :return: the id of the state after the last transition.
+    """
+    transitions, rewards = tables
+    initial_state_id, state_id = state_ids
+    masks, dones, allowed = inputs
+    out_states, out_rewards = outputs
+    for t, mask in enumerate(masks):
+        if allowed[t]:
+            out_rewards[t] = rewards[state_id][mask]
+            state_id = transitions[state_id][mask]
+        out_states[t] = state_id
+        if dones[t]:
+            state_id = initial_state_id
+    return state_id
+
+
+_run_kernel_jit = numba.njit(nogil=True)(_run_kernel) if NUMBA_AVAILABLE else None
+
+
+def _get_list_tables(reward_machine: CompiledRewardMachine) -> Tuple[List, List]:
+    """Get the tables of a compiled reward machine as nested lists, faster to index in Python."""
+    tables = _tables_cache.get(reward_machine)
+    if tables is None:
+        tables = (reward_machine.transitions.tolist(), reward_machine.rewards.tolist())
+        _tables_cache[reward_machine] = tables
+    return tables
+
+
+def run_reward_machine(
+    reward_machine: AbstractRewardMachine,
+    masks: np.ndarray,
+    *,
+    dones: Optional[np.ndarray] = None,
+    allowed: Optional[np.ndarray] = None,
+    state_id: Optional[int] = None,
+    use_jit: Optional[bool] = None,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Run a reward machine over a sequence of bitmasks, with episode resets.
+
+    The semantics is the one of TemporalGoalWrapper: a transition that is not allowed
+    (e.g. by a step controller) leaves the state unchanged and gives no reward, and
+    the reward machine goes back to its initial state after the last transition of every episode.
+
+    :param reward_machine: the reward machine, e.g. a reward automaton or a product
+      reward machine. Reward machines that are not instances of CompiledRewardMachine are compiled.
+    :param masks: the bitmasks over the vocabulary of the compiled reward machine.
+    :param dones: the boolean vector, True at the last transition of every episode.
+      If None, the sequence is a single episode.
+    :param allowed: the boolean vector of the transitions read by the reward machine.
+      If None, all the transitions are read.
+    :param state_id: the id of the state before the first transition, e.g. to continue
+      an episode from a previous sequence. If None, the initial state.
+    :param use_jit: whether to use the JIT-compiled kernel.
+      If None, it is used iff numba is installed.
+    :return: the state ids reached after every transition, the rewards of every transition,
+      and the id of the state after the last transition.
+    :raise ValueError: if the arrays have different lengths, or if the JIT-compiled
+      kernel is requested but numba is not installed.
+    """
+    compiled = (
+        reward_machine
+        if isinstance(reward_machine, CompiledRewardMachine)
+        else CompiledRewardMachine.from_reward_machine(reward_machine)
+    )
+    use_jit = NUMBA_AVAILABLE if use_jit is None else use_jit
+    enforce(
+        not use_jit or NUMBA_AVAILABLE,
+        "the JIT-compiled kernel requires numba",
+        ValueError,
+    )
+    masks = np.asarray(masks, dtype=np.int64)
+    nb_transitions = len(masks)
+    dones = (
+        np.zeros(nb_transitions, dtype=bool)
+        if dones is None
+        else np.asarray(dones, dtype=bool)
+    )
+    allowed = (
+        np.ones(nb_transitions, dtype=bool)
+        if allowed is None
+        else np.asarray(allowed, dtype=bool)
+    )
+    enforce(
+        len(dones) == nb_transitions and len(allowed) == nb_transitions,
+        f"got {nb_transitions} bitmasks, {len(dones)} episode flags "
+        f"and {len(allowed)} step flags",
+        ValueError,
+    )
+    initial_state_id = compiled.initial_state_id
+    state_id = initial_state_id if state_id is None else state_id
+
+    if use_jit:
+        states = np.empty(nb_transitions, dtype=np.int32)
+        rewards = np.zeros(nb_transitions, dtype=np.float64)
+        state_id = _run_kernel_jit(  # type: ignore
+            (compiled.transitions, compiled.rewards),
+            (initial_state_id, state_id),
+            (masks, dones, allowed),
+            (states, rewards),
+        )
+        return states, rewards, int(state_id)
+
+    states_list = [0] * nb_transitions
+    rewards_list = [0.0] * nb_transitions
+    state_id = _run_kernel(
+        _get_list_tables(compiled),
+        (initial_state_id, state_id),
+        (masks.tolist(), dones.tolist(), allowed.tolist()),
+        (states_list, rewards_list),
+    )
+    return (
+        np.asarray(states_list, dtype=np.int32),
+        np.asarray(rewards_list, dtype=np.float64),
+        state_id,
+    )
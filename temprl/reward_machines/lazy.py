@@ -0,0 +1,291 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Reward machines whose states are explored on demand."""
+from typing import (
+    AbstractSet,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+
+from temprl.fluents import FluentVocabulary, SymbolClasses
+from temprl.helpers import enforce
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.types import Interpretation, State, Symbol, TransitionType
+
+TransitionFunction = Callable[[Hashable, Interpretation], Tuple[Hashable, float]]
+
+
+class ExplorationInfo(NamedTuple):
+    """Statistics of the exploration of a lazy reward machine."""
+
+    nb_states: int
+    max_nb_states: int
+    nb_transitions: int
+
+
+class LazyRewardMachine(AbstractRewardMachine):
+    """
+    A reward machine whose states and transitions are discovered on demand.
+
+    The underlying automaton is given by its initial state and its transition
+    function, which is only evaluated on the pairs (state, interpretation) that
+    are actually visited. The states of the reward machine are dense integer ids,
+    assigned incrementally in order of discovery (the initial state has id 0),
+    and the explored transitions are cached.
+
+    Since the automaton is never materialized, the number of states must be
+    bounded by a declared upper bound, which is used as the size of the
+    observation space of the temporal goal. The properties 'states' and
+    'get_transitions_from' only describe the explored part of the automaton;
+    the guard of an explored transition is the interpretation that was read.
+
+    If the support of the automaton is declared, the interpretations are
+    projected onto it, so that the transitions are explored and cached once
+    per symbol class rather than once per interpretation.
+    """
+
+    def __init__(
+        self,
+        initial_state: Hashable,
+        transition_function: TransitionFunction,
+        max_nb_states: int,
+        support: Optional[Sequence[Symbol]] = None,
+    ):
+        """
+        Initialize the lazy reward machine.
+
+        :param initial_state: the initial state of the underlying automaton.
+        :param transition_function: the transition function of the underlying automaton.
+          A callable that takes in input a state of the underlying automaton
+          and an interpretation, and returns the successor and the reward.
+        :param max_nb_states: the declared upper bound on the number of states.
+        :param support: the fluents read by the transition function, if known.
+          The transition function must not depend on the other fluents.
+        :raise ValueError: if the upper bound is not positive,
+          or if the fluents of the support are not unique.
+        """
+        super().__init__()
+        enforce(
+            max_nb_states > 0,
+            f"max number of states must be positive, got {max_nb_states}",
+            ValueError,
+        )
+        self._transition_function = transition_function
+        self._max_nb_states = max_nb_states
+        self._symbol_classes = SymbolClasses(support) if support is not None else None
+        self._automaton_states: List[Hashable] = [initial_state]
+        self._state_ids: Dict[Hashable, int] = {initial_state: 0}
+        self._states: Set[State] = {0}
+        self._transitions: List[Dict[Interpretation, Tuple[int, float]]] = [{}]
+        self._bitmask_transitions: Dict[
+            FluentVocabulary, Dict[Tuple[int, int], Tuple[int, float]]
+        ] = {}
+        self._class_transitions: Dict[Tuple[int, int], Tuple[int, float]] = {}
+        self._nb_transitions = 0
+
+    @property
+    def states(self) -> AbstractSet[State]:
+        """Get the set of the explored states."""
+        return self._states
+
+    @property
+    def initial_state(self) -> State:
+        """Get the initial state."""
+        return 0
+
+    @property
+    def max_nb_states(self) -> int:
+        """Get the declared upper bound on the number of states."""
+        return self._max_nb_states
+
+    @property
+    def support(self) -> Optional[AbstractSet[Symbol]]:
+        """Get the declared support, or None if it is unknown."""
+        if self._symbol_classes is None:
+            return None
+        return frozenset(self._symbol_classes.vocabulary.fluents)
+
+    @property
+    def symbol_classes(self) -> Optional[SymbolClasses]:
+        """Get the symbol classes of the declared support, or None if it is unknown."""
+        return self._symbol_classes
+
+    def get_automaton_state(self, state: State) -> Hashable:
+        """
+        Get the state of the underlying automaton associated to a state id.
+
+        :param state: the state id.
+        :return: the state of the underlying automaton.
+        :raise ValueError: if the state has not been explored.
+        """
+        self._check_state(state)
+        return self._automaton_states[cast(int, state)]
+
+    def get_state_id(self, automaton_state: Hashable) -> int:
+        """
+        Get the state id associated to a state of the underlying automaton.
+
+        :param automaton_state: the state of the underlying automaton.
+        :return: the state id.
+        :raise ValueError: if the state has not been explored.
+        """
+        state_id = self._state_ids.get(automaton_state)
+        if state_id is None:
+            raise ValueError(f"state {automaton_state} has not been explored")
+        return state_id
+
+    def exploration_info(self) -> ExplorationInfo:
+        """Get the statistics of the exploration."""
+        return ExplorationInfo(
+            len(self._automaton_states), self._max_nb_states, self._nb_transitions
+        )
+
+    def _check_state(self, state: State) -> None:
+        """Check that a state id has been explored."""
+        if state not in self._states:
+            raise ValueError(f"state {state} has not been explored")
+
+    def _add_state(self, automaton_state: Hashable) -> int:
+        """Get the id of a state of the underlying automaton, assigning a new one if needed."""
+        state_id = self._state_ids.get(automaton_state)
+        if state_id is not None:
+            return state_id
+        state_id = len(self._automaton_states)
+        enforce(
+            state_id < self._max_nb_states,
+            f"the number of explored states exceeds the declared bound {self._max_nb_states}",
+            ValueError,
+        )
+        self._automaton_states.append(automaton_state)
+        self._state_ids[automaton_state] = state_id
+        self._states.add(state_id)
+        self._transitions.append({})
+        return state_id
+
+    def get_transitions_from(self, state: State) -> AbstractSet[TransitionType]:
+        """
+        Get the explored outgoing transitions from a state.
+
+        :param state: the source state.
+        :return: the set of explored transitions, whose guards are interpretations.
+        :raise ValueError: if the state has not been explored.
+        """
+        self._check_state(state)
+        return {
+            (state, symbol, successor)
+            for symbol, (successor, _) in self._transitions[cast(int, state)].items()
+        }
+
+    def transition(self, state: State, symbol: Interpretation) -> Tuple[State, float]:
+        """
+        Do a transition, exploring it if it was not explored yet.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state has not been explored,
+          or if the successor exceeds the declared bound on the number of states.
+        """
+        self._check_state(state)
+        transitions = self._transitions[cast(int, state)]
+        symbol_classes = self._symbol_classes
+        symbol = (
+            frozenset(symbol)
+            if symbol_classes is None
+            else symbol_classes.get_representative(symbol_classes.get_class_id(symbol))
+        )
+        result = transitions.get(symbol)
+        if result is None:
+            successor, reward = self._transition_function(
+                self._automaton_states[cast(int, state)], symbol
+            )
+            result = (self._add_state(successor), float(reward))
+            transitions[symbol] = result
+            self._nb_transitions += 1
+        return result
+
+    def transition_bitmask(
+        self, state: State, mask: int, vocabulary: FluentVocabulary
+    ) -> Tuple[State, float]:
+        """
+        Do a transition, reading a symbol encoded as a bitmask.
+
+        The explored transitions are also cached by (state, symbol class) if the
+        support is declared, and by (state, bitmask) otherwise, so that visited
+        bitmasks are not decoded again.
+
+        :param state: the starting state.
+        :param mask: the bitmask of the read symbol.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :return: the successor state and the reward signal.
+        :raise ValueError: if the provided state has not been explored,
+          or if the successor exceeds the declared bound on the number of states.
+        """
+        symbol_classes = self._symbol_classes
+        if symbol_classes is None:
+            cache = self._bitmask_transitions.get(vocabulary)
+            if cache is None:
+                cache = self._bitmask_transitions.setdefault(vocabulary, {})
+            key = (cast(int, state), mask)
+        else:
+            cache = self._class_transitions
+            mask = symbol_classes.get_class_id_bitmask(mask, vocabulary)
+            vocabulary = symbol_classes.vocabulary
+            key = (cast(int, state), mask)
+        result = cache.get(key)
+        if result is None:
+            result = cast(
+                Tuple[int, float], self.transition(state, vocabulary.decode(mask))
+            )
+            cache[key] = result
+        return result
+
+    def get_successor(self, state: State, symbol: Interpretation) -> State:
+        """
+        Get the (unique) successor.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the successor state.
+        :raise ValueError: if the provided state has not been explored.
+        """
+        return self.transition(state, symbol)[0]
+
+    def get_reward(self, state: State, symbol: Interpretation) -> float:
+        """
+        Get the reward associated to the transition.
+
+        :param state: the starting state.
+        :param symbol: the read symbol.
+        :return: the reward signal.
+        :raise ValueError: if the provided state has not been explored.
+        """
+        return self.transition(state, symbol)[1]
@@ -0,0 +1,160 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Minimization of reward machines."""
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import DEFAULT_MAX_FLUENTS, CompiledRewardMachine
+from temprl.types import State, Symbol
+
+
+def _reachable_state_ids(transitions: np.ndarray, initial_state_id: int) -> List[int]:
+    """Get the ids of the states reachable from the initial state, in breadth-first order."""
+    visited = {initial_state_id}
+    order = [initial_state_id]
+    queue = deque(order)
+    while queue:
+        for successor in np.unique(transitions[queue.popleft()]).tolist():
+            if successor not in visited:
+                visited.add(successor)
+                order.append(successor)
+                queue.append(successor)
+    return order
+
+
+def _refine(
+    transitions: np.ndarray, rewards: np.ndarray, accepting: np.ndarray
+) -> np.ndarray:
+    """
+    Compute the coarsest partition of the states that respects rewards and acceptance.
+
+    Two states are in the same block iff they agree on acceptance and, for every
+    interpretation, they give the same reward and their successors are in the same block.
+
+    :param transitions: the transition table, restricted to a closed set of states.
+    :param rewards: the reward table.
+    :param accepting: the boolean vector of the accepting states.
+    :return: the block of every state.
+    """
+    _, blocks = np.unique(
+        np.column_stack([accepting, rewards]), axis=0, return_inverse=True
+    )
+    blocks = blocks.reshape(-1)
+    nb_blocks = int(blocks.max()) + 1
+    while True:
+        _, refined = np.unique(
+            np.column_stack([blocks, blocks[transitions]]),
+            axis=0,
+            return_inverse=True,
+        )
+        refined = refined.reshape(-1)
+        nb_refined = int(refined.max()) + 1
+        if nb_refined == nb_blocks:
+            return refined
+        blocks, nb_blocks = refined, nb_refined
+
+
+def minimize_reward_machine(
+    reward_machine: AbstractRewardMachine,
+    fluents: Optional[Sequence[Symbol]] = None,
+    max_fluents: int = DEFAULT_MAX_FLUENTS,
+) -> Tuple[CompiledRewardMachine, Dict[State, int]]:
+    """
+    Prune the unreachable states of a reward machine, and merge the equivalent ones.
+
+    The reward machine is compiled (unless it already is), and the states
+    that are not reachable from the initial state are removed. Then, the
+    remaining states are partitioned by Moore's algorithm: two states are
+    merged iff they are both accepting or both non-accepting and, for every
+    interpretation, they give the same reward and lead to equivalent states.
+    Reward machines that do not expose accepting states are minimized
+    with respect to their rewards only.
+
+    The states of the minimized reward machine are dense integer ids, assigned
+    in breadth-first order from the initial state (which has id 0), so that
+    they can be used directly as observations.
+
+    :param reward_machine: the reward machine to minimize.
+    :param fluents: the fluent vocabulary. If None, it is inferred from the guards.
+    :param max_fluents: the maximum number of fluents allowed.
+    :return: the minimized reward machine, and the mapping from the reachable
+      states of the original reward machine to the states of the minimized one.
+    :raise ValueError: if the reward machine cannot be compiled.
+    """
+    compiled = (
+        reward_machine
+        if isinstance(reward_machine, CompiledRewardMachine) and fluents is None
+        else CompiledRewardMachine.from_reward_machine(
+            reward_machine, fluents=fluents, max_fluents=max_fluents
+        )
+    )
+    reachable = np.asarray(
+        _reachable_state_ids(compiled.transitions, compiled.initial_state_id),
+        dtype=np.intp,
+    )
+    local_ids = np.full(len(compiled.states), -1, dtype=np.intp)
+    local_ids[reachable] = np.arange(len(reachable))
+    transitions = local_ids[compiled.transitions[reachable]]
+    rewards = np.asarray(compiled.rewards[reachable])
+    accepting_states = compiled.accepting_states
+    accepting = np.asarray(
+        [
+            accepting_states is not None
+            and compiled.get_state(state_id) in accepting_states
+            for state_id in reachable.tolist()
+        ],
+        dtype=np.float64,
+    )
+    blocks = _refine(transitions, rewards, accepting)
+
+    # renumber the blocks in breadth-first order; the initial state is reachable[0]
+    block_transitions = np.empty(
+        (int(blocks.max()) + 1, transitions.shape[1]), dtype=np.int32
+    )
+    representatives = np.empty(len(block_transitions), dtype=np.intp)
+    representatives[blocks] = np.arange(len(blocks))
+    block_transitions[:] = blocks[transitions[representatives]]
+    order = _reachable_state_ids(block_transitions, int(blocks[0]))
+    new_ids = np.empty(len(order), dtype=np.int32)
+    new_ids[order] = np.arange(len(order), dtype=np.int32)
+    order_array = np.asarray(order, dtype=np.intp)
+    minimized = CompiledRewardMachine(
+        list(range(len(order))),
+        compiled.fluents,
+        0,
+        new_ids[block_transitions[order_array]],
+        rewards[representatives[order_array]],
+        accepting_states={
+            int(new_ids[blocks[i]]) for i in np.flatnonzero(accepting).tolist()
+        }
+        if accepting_states is not None
+        else None,
+    )
+    state_mapping = {
+        compiled.get_state(state_id): int(new_ids[blocks[local_id]])
+        for local_id, state_id in enumerate(reachable.tolist())
+    }
+    return minimized, state_mapping
@@ -0,0 +1,173 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Product of reward machines."""
+from typing import Dict, List, Sequence, Tuple, cast
+
+import numpy as np
+
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import (
+    DEFAULT_MAX_FLUENTS,
+    CompiledRewardMachine,
+    _sorted_if_possible,
+)
+
+DEFAULT_MAX_PRODUCT_SIZE = 1 << 20
+
+
+def _compile(
+    reward_machine: AbstractRewardMachine, max_fluents: int
+) -> CompiledRewardMachine:
+    """Compile a reward machine, if it is not compiled already."""
+    if isinstance(reward_machine, CompiledRewardMachine):
+        return reward_machine
+    return CompiledRewardMachine.from_reward_machine(
+        reward_machine, max_fluents=max_fluents
+    )
+
+
+def _get_component_masks(
+    components: Sequence[CompiledRewardMachine], vocabulary: FluentVocabulary
+) -> List[np.ndarray]:
+    """Get, for every component, its bitmask of every bitmask over the vocabulary."""
+    symbols = np.arange(1 << len(vocabulary), dtype=np.int64)
+    component_masks: List[np.ndarray] = []
+    for component in components:
+        masks = np.zeros(len(symbols), dtype=np.int64)
+        for bit, fluent in enumerate(component.fluents):
+            masks |= ((symbols >> vocabulary.index(fluent)) & 1) << bit
+        component_masks.append(masks)
+    return component_masks
+
+
+def build_product_reward_machine(
+    reward_machines: Sequence[AbstractRewardMachine],
+    max_size: int = DEFAULT_MAX_PRODUCT_SIZE,
+    max_fluents: int = DEFAULT_MAX_FLUENTS,
+) -> CompiledRewardMachine:
+    """
+    Build the synchronous product of reward machines.
+
+    The states of the product are the tuples of the states of the components,
+    and the reward of a transition is the sum of the rewards of the components.
+    The fluent vocabulary is the union of the vocabularies of the components.
+    Only the product states reachable from the initial state are built.
+
+    :param reward_machines: the component reward machines.
+    :param max_size: the maximum number of entries of the product tables,
+      i.e. the number of product states times 2 ** nb_fluents.
+    :param max_fluents: the maximum number of fluents allowed.
+    :return: the product reward machine.
+    :raise ValueError: if there are no components, or if the product exceeds the limits.
+    """
+    enforce(
+        len(reward_machines) > 0,
+        "cannot build the product of no reward machines",
+        ValueError,
+    )
+    components = [_compile(rm, max_fluents) for rm in reward_machines]
+    fluents = _sorted_if_possible(set().union(*(c.fluents for c in components)))
+    enforce(
+        len(fluents) <= max_fluents,
+        f"cannot build a product over {len(fluents)} fluents (max: {max_fluents})",
+        ValueError,
+    )
+    max_states = max_size >> len(fluents)
+    component_masks = _get_component_masks(components, FluentVocabulary(fluents))
+
+    initial = tuple(c.initial_state_id for c in components)
+    product_ids: Dict[Tuple[int, ...], int] = {initial: 0}
+    queue: List[Tuple[int, ...]] = [initial]
+    transitions: List[np.ndarray] = []
+    rewards: List[np.ndarray] = []
+    while len(transitions) < len(queue):
+        current = queue[len(transitions)]
+        successors = np.stack(
+            [
+                c.transitions[state_id, masks]
+                for c, state_id, masks in zip(components, current, component_masks)
+            ],
+            axis=1,
+        )
+        rewards.append(
+            sum(
+                c.rewards[state_id, masks]
+                for c, state_id, masks in zip(components, current, component_masks)
+            )
+        )
+        unique_successors, inverse = np.unique(successors, axis=0, return_inverse=True)
+        unique_ids = []
+        for successor in map(tuple, unique_successors.tolist()):
+            successor_id = product_ids.get(successor)
+            if successor_id is None:
+                successor_id = len(queue)
+                product_ids[successor] = successor_id
+                queue.append(successor)
+            unique_ids.append(successor_id)
+        enforce(
+            len(queue) <= max_states,
+            f"the product has more than {max_states} states over {len(fluents)} fluents "
+            f"(max size: {max_size})",
+            ValueError,
+        )
+        transitions.append(np.asarray(unique_ids, dtype=np.int32)[inverse.ravel()])
+
+    states = [
+        tuple(c.get_state(state_id) for c, state_id in zip(components, product_state))
+        for product_state in queue
+    ]
+    return CompiledRewardMachine(
+        states, fluents, states[0], np.stack(transitions), np.stack(rewards)
+    )
+
+
+def get_component_tables(
+    product: CompiledRewardMachine, component: CompiledRewardMachine, index: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the tables of a component of a product, indexed by the product state ids and bitmasks.
+
+    :param product: the product reward machine (see 'build_product_reward_machine').
+    :param component: the compiled component.
+    :param index: the position of the component in the product.
+    :return: the id of the component state of every product state, and the tables
+      of the successor ids and of the rewards of the component, of shape
+      (nb_product_states, 2 ** nb_fluents) over the fluents of the product.
+    """
+    masks = _get_component_masks([component], product.vocabulary)[0]
+    state_ids = np.asarray(
+        [
+            component.get_state_id(
+                cast(tuple, product.get_state(product_state_id))[index]
+            )
+            for product_state_id in range(len(product.states))
+        ],
+        dtype=np.intp,
+    )
+    return (
+        state_ids,
+        component.transitions[state_ids[:, None], masks],
+        component.rewards[state_ids[:, None], masks],
+    )
@@ -0,0 +1,176 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""On-disk format of compiled reward machines."""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Literal, Optional, Union
+
+import numpy as np
+
+from temprl.helpers import enforce
+from temprl.reward_machines.compiled import CompiledRewardMachine
+
+FORMAT_VERSION = 1
+METADATA_FILENAME = "metadata.json"
+TRANSITIONS_FILENAME = "transitions.npy"
+REWARDS_FILENAME = "rewards.npy"
+
+PathLike = Union[str, Path]
+MmapMode = Optional[Literal["r+", "r", "w+", "c"]]
+
+
+def encode_value(value: Any) -> Any:
+    """
+    Encode a state or a fluent into a JSON-serializable object.
+
+    Tuples are encoded as objects with the single key "tuple", so that they
+    can be told apart from lists.
+
+    :param value: the value, i.e. None, a bool, an int, a float, a str, or a tuple of them.
+    :return: the JSON-serializable object.
+    :raise ValueError: if the value is not supported.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, tuple):
+        return {"tuple": [encode_value(item) for item in value]}
+    raise ValueError(
+        f"cannot serialize {value!r}: only None, bool, int, float, str and tuples are supported"
+    )
+
+
+def decode_value(value: Any) -> Any:
+    """
+    Decode a state or a fluent from a JSON-serializable object (see 'encode_value').
+
+    :param value: the JSON-serializable object.
+    :return: the value.
+    """
+    if isinstance(value, dict):
+        return tuple(decode_value(item) for item in value["tuple"])
+    return value
+
+
+def save_compiled_reward_machine(
+    reward_machine: CompiledRewardMachine, path: PathLike
+) -> None:
+    """
+    Save a compiled reward machine.
+
+    The reward machine is saved in a directory, with the tables in .npy format
+    and the states, the fluents, the initial state, the accepting states and
+    the fingerprint in a JSON metadata file. The metadata file is written last,
+    so that a directory with a metadata file is always complete.
+
+    :param reward_machine: the compiled reward machine.
+    :param path: the path of the directory.
+    :raise ValueError: if the states or the fluents cannot be serialized.
+    """
+    directory = Path(path)
+    states = [
+        reward_machine.get_state(state_id)
+        for state_id in range(len(reward_machine.states))
+    ]
+    accepting_states = reward_machine.accepting_states
+    metadata: Dict[str, Any] = {
+        "format_version": FORMAT_VERSION,
+        "states": [encode_value(state) for state in states],
+        "fluents": [encode_value(fluent) for fluent in reward_machine.fluents],
+        "initial_state_id": reward_machine.initial_state_id,
+        "accepting_state_ids": sorted(
+            reward_machine.get_state_id(state) for state in accepting_states
+        )
+        if accepting_states is not None
+        else None,
+        "fingerprint": reward_machine.fingerprint,
+    }
+    directory.mkdir(parents=True, exist_ok=True)
+    np.save(directory / TRANSITIONS_FILENAME, reward_machine.transitions)
+    np.save(directory / REWARDS_FILENAME, reward_machine.rewards)
+    temporary_path = directory / f".{METADATA_FILENAME}.{os.getpid()}"
+    temporary_path.write_text(json.dumps(metadata))
+    os.replace(temporary_path, directory / METADATA_FILENAME)
+
+
+def read_fingerprint(path: PathLike) -> Optional[str]:
+    """
+    Read the fingerprint of a saved compiled reward machine, without loading it.
+
+    :param path: the path of the directory.
+    :return: the fingerprint, or None if the directory does not contain
+      a saved reward machine or if it has no fingerprint.
+    """
+    metadata_path = Path(path) / METADATA_FILENAME
+    if not metadata_path.exists():
+        return None
+    return json.loads(metadata_path.read_text()).get("fingerprint")
+
+
+def load_compiled_reward_machine(
+    path: PathLike,
+    mmap_mode: MmapMode = "r",
+    fingerprint: Optional[str] = None,
+    check_tables: bool = False,
+) -> CompiledRewardMachine:
+    """
+    Load a compiled reward machine.
+
+    By default, the tables are memory-mapped read-only, so that loading does not
+    copy them, and processes that load the same reward machine share their pages.
+
+    :param path: the path of the directory.
+    :param mmap_mode: the memory-map mode of the tables (see numpy.load).
+      If None, the tables are read into memory.
+    :param fingerprint: the expected fingerprint. If provided, it must match
+      the fingerprint of the saved reward machine.
+    :param check_tables: whether to check that the transition table contains valid state ids.
+    :return: the compiled reward machine.
+    :raise ValueError: if the format version or the fingerprint do not match.
+    """
+    directory = Path(path)
+    metadata = json.loads((directory / METADATA_FILENAME).read_text())
+    enforce(
+        metadata["format_version"] == FORMAT_VERSION,
+        f"unsupported format version {metadata['format_version']} (expected {FORMAT_VERSION})",
+        ValueError,
+    )
+    enforce(
+        fingerprint is None or metadata["fingerprint"] == fingerprint,
+        f"fingerprint mismatch: expected {fingerprint}, got {metadata['fingerprint']}",
+        ValueError,
+    )
+    states = [decode_value(state) for state in metadata["states"]]
+    accepting_state_ids = metadata["accepting_state_ids"]
+    return CompiledRewardMachine(
+        states,
+        [decode_value(fluent) for fluent in metadata["fluents"]],
+        states[metadata["initial_state_id"]],
+        np.load(directory / TRANSITIONS_FILENAME, mmap_mode=mmap_mode),
+        np.load(directory / REWARDS_FILENAME, mmap_mode=mmap_mode),
+        accepting_states={states[i] for i in accepting_state_ids}
+        if accepting_state_ids is not None
+        else None,
+        fingerprint=metadata["fingerprint"],
+        check_tables=check_tables,
+    )
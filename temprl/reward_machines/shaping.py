@@ -0,0 +1,211 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Potential-based reward shaping for reward machines."""
+import math
+from collections import deque
+from typing import AbstractSet, Dict, Optional, Sequence, Set, Tuple, cast
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.compiled import CompiledRewardMachine
+from temprl.types import State
+
+DEFAULT_DISCOUNT = 0.99
+
+_distances_cache: "WeakKeyDictionary[AbstractRewardMachine, Dict[State, float]]" = (
+    WeakKeyDictionary()
+)
+
+
+def compute_distances_to_acceptance(
+    reward_machine: AbstractRewardMachine,
+) -> Dict[State, float]:
+    """
+    Compute the shortest distance of every state to the accepting states.
+
+    The distances are computed by a backward breadth-first search from the
+    accepting states over the transitions, assuming that every guard is satisfiable.
+
+    :param reward_machine: the reward machine. It must expose its accepting states.
+    :return: the number of transitions needed to reach an accepting state from
+      every state; it is infinite for the states from which no accepting state is reachable.
+    :raise ValueError: if the reward machine does not expose its accepting states.
+    """
+    accepting_states: Optional[AbstractSet[State]] = getattr(
+        reward_machine, "accepting_states", None
+    )
+    if accepting_states is None:
+        raise ValueError("the reward machine does not expose its accepting states")
+    predecessors: Dict[State, Set[State]] = {s: set() for s in reward_machine.states}
+    for start, _, end in reward_machine.get_transitions():
+        predecessors[end].add(start)
+    distances: Dict[State, float] = {s: math.inf for s in reward_machine.states}
+    queue = deque(accepting_states)
+    for state in accepting_states:
+        distances[state] = 0.0
+    while queue:
+        state = queue.popleft()
+        for predecessor in predecessors[state]:
+            if distances[predecessor] == math.inf:
+                distances[predecessor] = distances[state] + 1
+                queue.append(predecessor)
+    return distances
+
+
+def get_distances_to_acceptance(
+    reward_machine: AbstractRewardMachine,
+) -> Dict[State, float]:
+    """
+    Get the shortest distance of every state to the accepting states.
+
+    The distances are computed once per reward machine (see
+    'compute_distances_to_acceptance'), and cached as long as the reward machine is alive.
+
+    :param reward_machine: the reward machine.
+    :return: the distances; the returned dictionary must not be modified.
+    :raise ValueError: if the reward machine does not expose its accepting states.
+    """
+    distances = _distances_cache.get(reward_machine)
+    if distances is None:
+        distances = compute_distances_to_acceptance(reward_machine)
+        _distances_cache[reward_machine] = distances
+    return distances
+
+
+class PotentialShaping:
+    """
+    Potential-based reward shaping from the distance to acceptance.
+
+    The potential of a state is phi(s) = -scale * d(s), where d(s) is the shortest
+    distance of s to the accepting states. The states from which no accepting state
+    is reachable have distance equal to the number of states. The shaping reward of
+    a transition from s to s' is gamma * phi(s') - phi(s), where phi(s') is taken
+    to be 0 if the transition is the last one of the episode. The shaping reward is
+    given at every step of the environment, including the ones where the reward machine
+    does not move (e.g. because the step controller does not allow the transition),
+    so that the shaping rewards telescope: the discounted return of every episode
+    changes by -phi(s0), and the optimal policies are preserved (Ng et al., 1999).
+    """
+
+    def __init__(
+        self,
+        reward_machine: AbstractRewardMachine,
+        discount: float = DEFAULT_DISCOUNT,
+        scale: float = 1.0,
+    ):
+        """
+        Initialize the shaping.
+
+        :param reward_machine: the reward machine. It must expose its accepting states.
+        :param discount: the discount factor gamma of the learner.
+        :param scale: the scale of the potentials.
+        :raise ValueError: if the reward machine does not expose its accepting states.
+        """
+        distances = get_distances_to_acceptance(reward_machine)
+        dead_distance = float(len(distances))
+        self.discount = discount
+        self.scale = scale
+        self._potentials: Dict[State, float] = {
+            state: -scale * (dead_distance if math.isinf(d) else d)
+            for state, d in distances.items()
+        }
+
+    def potential(self, state: State) -> float:
+        """
+        Get the potential of a state.
+
+        :param state: the state.
+        :return: the potential.
+        """
+        return self._potentials[state]
+
+    def __call__(self, state: State, next_state: State, done: bool = False) -> float:
+        """
+        Get the shaping reward of a transition.
+
+        :param state: the starting state.
+        :param next_state: the successor state.
+        :param done: whether the transition is the last one of the episode.
+        :return: the shaping reward.
+        """
+        potentials = self._potentials
+        if done:
+            return -potentials[state]
+        return self.discount * potentials[next_state] - potentials[state]
+
+
+def get_product_potentials(
+    product: CompiledRewardMachine, shapings: Sequence[Optional[PotentialShaping]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the potentials of the states of a product, i.e. the sums of the ones of the components.
+
+    :param product: the product reward machine (see 'build_product_reward_machine').
+    :param shapings: the shaping of every component, or None if it is not shaped.
+    :return: the discounted potentials and the potentials of every product state id.
+    """
+    nb_states = len(product.states)
+    states = [product.get_state(state_id) for state_id in range(nb_states)]
+    discounted_potentials = np.zeros(nb_states, dtype=np.float64)
+    potentials = np.zeros(nb_states, dtype=np.float64)
+    for index, shaping in enumerate(shapings):
+        if shaping is None:
+            continue
+        component_potentials = np.asarray(
+            [shaping.potential(cast(tuple, state)[index]) for state in states],
+            dtype=np.float64,
+        )
+        discounted_potentials += shaping.discount * component_potentials
+        potentials += component_potentials
+    return discounted_potentials, potentials
+
+
+def shape_product_reward_machine(
+    product: CompiledRewardMachine, shapings: Sequence[Optional[PotentialShaping]]
+) -> CompiledRewardMachine:
+    """
+    Add the shaping rewards of the components to the reward table of a product.
+
+    :param product: the product reward machine (see 'build_product_reward_machine').
+    :param shapings: the shaping of every component, or None if it is not shaped.
+    :return: the product reward machine with the shaped rewards, where the potentials
+      of the successors are not zeroed at the end of the episode (see PotentialShaping).
+    """
+    discounted_potentials, potentials = get_product_potentials(product, shapings)
+    states = [product.get_state(state_id) for state_id in range(len(product.states))]
+    rewards = (
+        product.rewards
+        + discounted_potentials[product.transitions]
+        - potentials[:, None]
+    )
+    return CompiledRewardMachine(
+        states,
+        product.fluents,
+        product.initial_state,
+        product.transitions,
+        rewards,
+        accepting_states=product.accepting_states,
+        check_tables=False,
+    )
@@ -22,13 +22,19 @@
 """This module contains the AbstractStepController interface."""
 
 from abc import abstractmethod
+from typing import Optional
 
+import numpy as np
+
+from temprl.fluents import FluentVocabulary
 from temprl.types import Interpretation
 
 
 class AbstractStepController:
     """A class that allows to control the steps to be done by the temporal goals."""
 
+    __slots__ = ()
+
     @abstractmethod
     def step(self, fluents: Interpretation) -> bool:
         """
@@ -38,6 +44,49 @@ class AbstractStepController:
         :return: True if the step can be taken, False otherwise
         """
 
+    def step_bitmask(self, mask: int, vocabulary: FluentVocabulary) -> bool:
+        """
+        Update the step controller, reading fluents encoded as a bitmask.
+
+        The default implementation decodes the bitmask and calls 'step';
+        subclasses can override it to consume the bitmask directly.
+
+        :param: mask: the bitmask of the true fluents
+        :param: vocabulary: the vocabulary over which the bitmask is defined
+        :return: True if the step can be taken, False otherwise
+        """
+        return self.step(vocabulary.decode(mask))
+
     @abstractmethod
     def reset(self) -> None:
         """Reset the StepController."""
+
+
+class AbstractBatchedStepController:
+    """A class that controls the steps of the temporal goals of several environments at once."""
+
+    __slots__ = ()
+
+    @property
+    @abstractmethod
+    def num_envs(self) -> int:
+        """Get the number of environments."""
+
+    @abstractmethod
+    def step(self, fluent_matrix: np.ndarray) -> np.ndarray:
+        """
+        Update the step controllers and check whether the steps on the DFA can take place.
+
+        :param fluent_matrix: the boolean fluent matrix of shape (num_envs, num_fluents).
+        :return: the boolean vector that tells, for every environment,
+          whether the step can be taken.
+        """
+
+    @abstractmethod
+    def reset(self, indices: Optional[np.ndarray] = None) -> None:
+        """
+        Reset the step controllers.
+
+        :param indices: the indices, or the boolean mask, of the environments to reset.
+          If None, all the environments are reset.
+        """
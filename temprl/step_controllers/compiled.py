@@ -0,0 +1,249 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""This module contains step controllers whose acceptor is compiled into lookup tables."""
+from typing import Optional, Sequence
+
+import numpy as np
+from pythomata.core import DFA
+
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.reward_machines.compiled import (
+    DEFAULT_MAX_FLUENTS,
+    _sorted_if_possible,
+    get_fluents_of_guards,
+)
+from temprl.step_controllers.base import (
+    AbstractBatchedStepController,
+    AbstractStepController,
+)
+from temprl.types import Guard, Interpretation, State, Symbol
+
+
+class CompiledAcceptor:
+    """
+    An acceptor DFA compiled into lookup tables.
+
+    States are mapped to dense integer ids, and interpretations over the fluent
+    vocabulary are mapped to bitmasks. Missing transitions lead to an additional
+    non-accepting sink state, so that the compiled acceptor is complete.
+    """
+
+    def __init__(
+        self,
+        acceptor: DFA[State, Interpretation, Guard],
+        fluents: Optional[Sequence[Symbol]] = None,
+        max_fluents: int = DEFAULT_MAX_FLUENTS,
+    ):
+        """
+        Compile the acceptor.
+
+        :param acceptor: a pythomata.DFA object.
+        :param fluents: the fluent vocabulary. If None, it is inferred from the guards.
+        :param max_fluents: the maximum number of fluents allowed,
+          to bound the size of the tables.
+        :raise ValueError: if there are too many fluents.
+        """
+        if fluents is None:
+            fluents = get_fluents_of_guards(
+                guard for _, guard, _ in acceptor.get_transitions()
+            )
+        enforce(
+            len(fluents) <= max_fluents,
+            f"cannot compile an acceptor over {len(fluents)} fluents (max: {max_fluents})",
+            ValueError,
+        )
+        self._vocabulary = FluentVocabulary(fluents)
+        states = _sorted_if_possible(acceptor.states)
+        state_ids = {s: i for i, s in enumerate(states)}
+        sink_id = len(states)
+        nb_symbols = 1 << len(fluents)
+        transitions = np.full((len(states) + 1, nb_symbols), sink_id, dtype=np.int32)
+        for mask in range(nb_symbols):
+            symbol = {f: True for f in self._vocabulary.decode(mask)}
+            for state_id, state in enumerate(states):
+                successor = acceptor.get_successor(state, symbol)
+                if successor is not None:
+                    transitions[state_id, mask] = state_ids[successor]
+        accepting = np.zeros(len(states) + 1, dtype=bool)
+        for state in acceptor.accepting_states:
+            accepting[state_ids[state]] = True
+        self._transitions = transitions
+        self._accepting = accepting
+        self._transitions.setflags(write=False)
+        self._accepting.setflags(write=False)
+        self._initial_state_id = state_ids[acceptor.initial_state]
+
+    @property
+    def vocabulary(self) -> FluentVocabulary:
+        """Get the fluent vocabulary."""
+        return self._vocabulary
+
+    @property
+    def transitions(self) -> np.ndarray:
+        """Get the (read-only) table of successor ids."""
+        return self._transitions
+
+    @property
+    def accepting(self) -> np.ndarray:
+        """Get the (read-only) accepting-state bitmap."""
+        return self._accepting
+
+    @property
+    def initial_state_id(self) -> int:
+        """Get the id of the initial state."""
+        return self._initial_state_id
+
+
+class CompiledStatefulStepController(AbstractStepController):
+    """
+    A stateful step controller whose acceptor is compiled into lookup tables.
+
+    It behaves as StatefulStepController, but every step is an array lookup.
+    """
+
+    __slots__ = ("_acceptor", "_transitions", "_accepting", "_current_state")
+
+    def __init__(
+        self,
+        acceptor: DFA[State, Interpretation, Guard],
+        fluents: Optional[Sequence[Symbol]] = None,
+    ):
+        """
+        Create the StepController.
+
+        :param acceptor: a pythomata.DFA object.
+        :param fluents: the fluent vocabulary. If None, it is inferred from the guards.
+        """
+        self._acceptor = CompiledAcceptor(acceptor, fluents)
+        self._transitions = self._acceptor.transitions.tolist()
+        self._accepting = self._acceptor.accepting.tolist()
+        self._current_state = self._acceptor.initial_state_id
+
+    @property
+    def acceptor(self) -> CompiledAcceptor:
+        """Get the compiled acceptor."""
+        return self._acceptor
+
+    def is_true(self) -> bool:
+        """Check whether the acceptor is in an accepting state."""
+        return self._accepting[self._current_state]
+
+    def _step_mask(self, mask: int) -> bool:
+        """Do a step reading a bitmask over the vocabulary of the acceptor."""
+        self._current_state = self._transitions[self._current_state][mask]
+        return self._accepting[self._current_state]
+
+    def step(self, fluents: Interpretation) -> bool:
+        """
+        Update the step controller and check whether the step on the DFA can take place.
+
+        :param: fluents: A set of fluents
+        :return: True if the step can be taken, False otherwise
+        """
+        return self._step_mask(self._acceptor.vocabulary.encode(fluents))
+
+    def step_bitmask(self, mask: int, vocabulary: FluentVocabulary) -> bool:
+        """
+        Update the step controller, reading fluents encoded as a bitmask.
+
+        :param: mask: the bitmask of the true fluents
+        :param: vocabulary: the vocabulary over which the bitmask is defined
+        :return: True if the step can be taken, False otherwise
+        """
+        translator = vocabulary.get_translator(self._acceptor.vocabulary)
+        return self._step_mask(translator(mask))
+
+    def reset(self) -> None:
+        """Reset the StepController."""
+        self._current_state = self._acceptor.initial_state_id
+
+
+class BatchedCompiledStatefulStepController(AbstractBatchedStepController):
+    """
+    A batch of stateful step controllers that share the same compiled acceptor.
+
+    It advances the controllers of several environments at once,
+    e.g. for vectorized environments.
+    """
+
+    __slots__ = ("_acceptor", "_weights", "_current_states")
+
+    def __init__(
+        self,
+        acceptor: DFA[State, Interpretation, Guard],
+        num_envs: int,
+        fluents: Optional[Sequence[Symbol]] = None,
+    ):
+        """
+        Create the batch of step controllers.
+
+        :param acceptor: a pythomata.DFA object.
+        :param num_envs: the number of controllers.
+        :param fluents: the fluent vocabulary, in the same order as the columns
+          of the fluent matrices. If None, it is inferred from the guards.
+        """
+        self._acceptor = CompiledAcceptor(acceptor, fluents)
+        self._weights = np.left_shift(
+            1, np.arange(len(self._acceptor.vocabulary), dtype=np.int64)
+        )
+        self._current_states = np.full(
+            num_envs, self._acceptor.initial_state_id, dtype=np.int32
+        )
+
+    @property
+    def acceptor(self) -> CompiledAcceptor:
+        """Get the compiled acceptor."""
+        return self._acceptor
+
+    @property
+    def num_envs(self) -> int:
+        """Get the number of controllers."""
+        return len(self._current_states)
+
+    def is_true(self) -> np.ndarray:
+        """Check, for every controller, whether the acceptor is in an accepting state."""
+        return self._acceptor.accepting[self._current_states]
+
+    def step(self, fluent_matrix: np.ndarray) -> np.ndarray:
+        """
+        Update the step controllers.
+
+        :param fluent_matrix: the boolean fluent matrix of shape (num_envs, num_fluents).
+        :return: the boolean vector that tells, for every controller, whether the step can be taken.
+        """
+        masks = np.asarray(fluent_matrix, dtype=np.int64) @ self._weights
+        self._current_states = self._acceptor.transitions[self._current_states, masks]
+        return self.is_true()
+
+    def reset(self, indices: Optional[np.ndarray] = None) -> None:
+        """
+        Reset the step controllers.
+
+        :param indices: the indices, or the boolean mask, of the controllers to reset.
+          If None, all the controllers are reset.
+        """
+        if indices is None:
+            self._current_states[:] = self._acceptor.initial_state_id
+        else:
+            self._current_states[indices] = self._acceptor.initial_state_id
@@ -20,15 +20,30 @@
 #
 
 """This module contains an implementation of a stateless step controller."""
+from typing import Dict, Optional
+
 from pythomata.core import DFA
-from pythomata.simulator import AutomatonSimulator
 
+from temprl.fluents import FluentVocabulary
+from temprl.reward_machines.compiled import get_fluents_of_guards
 from temprl.step_controllers.base import AbstractStepController
 from temprl.types import Guard, Interpretation, State
 
 
 class StatefulStepController(AbstractStepController):
-    """A class that allows to control the steps to be done by the temporal goals."""
+    """
+    A class that allows to control the steps to be done by the temporal goals.
+
+    The current state of the acceptor is None after a missing transition.
+    """
+
+    __slots__ = (
+        "_acceptor",
+        "_current_state",
+        "_vocabulary",
+        "_vocabulary_computed",
+        "_bitmask_transitions",
+    )
 
     def __init__(self, acceptor: DFA[State, Interpretation, Guard]):
         """
@@ -37,7 +52,17 @@ class StatefulStepController(AbstractStepController):
         :param acceptor: a pythomata.DFA object.
         """
         self._acceptor = acceptor
-        self._simulator = AutomatonSimulator(self._acceptor)
+        self._current_state: Optional[State] = acceptor.initial_state
+        self._vocabulary: Optional[FluentVocabulary] = None
+        self._vocabulary_computed = False
+        self._bitmask_transitions: Dict[State, Dict[int, Optional[State]]] = {}
+
+    def _is_true(self) -> bool:
+        """Check whether the acceptor is in an accepting state."""
+        return (
+            self._current_state is not None
+            and self._current_state in self._acceptor.accepting_states
+        )
 
     def step(self, fluents: Interpretation) -> bool:
         """
@@ -46,9 +71,57 @@ class StatefulStepController(AbstractStepController):
         :param: fluents: A set of fluents
         :return: True if the step can be taken, False otherwise
         """
-        self._simulator.step({f: True for f in fluents})
-        return self._simulator.is_true()
+        if self._current_state is not None:
+            self._current_state = self._acceptor.get_successor(
+                self._current_state, {f: True for f in fluents}
+            )
+        return self._is_true()
+
+    def _get_vocabulary(self) -> Optional[FluentVocabulary]:
+        """Get the vocabulary of the fluents read by the guards, if they are symbolic."""
+        if not self._vocabulary_computed:
+            self._vocabulary_computed = True
+            try:
+                self._vocabulary = FluentVocabulary(
+                    get_fluents_of_guards(
+                        guard for _, guard, _ in self._acceptor.get_transitions()
+                    )
+                )
+            except ValueError:
+                self._vocabulary = None
+        return self._vocabulary
+
+    def step_bitmask(self, mask: int, vocabulary: FluentVocabulary) -> bool:
+        """
+        Update the step controller, reading fluents encoded as a bitmask.
+
+        If the guards are symbolic, the bitmask is translated onto the fluents
+        read by the guards, and the transitions are memoized per
+        (state, translated bitmask).
+
+        :param: mask: the bitmask of the true fluents
+        :param: vocabulary: the vocabulary over which the bitmask is defined
+        :return: True if the step can be taken, False otherwise
+        """
+        own_vocabulary = self._get_vocabulary()
+        if own_vocabulary is None:
+            return self.step(vocabulary.decode(mask))
+        state = self._current_state
+        if state is None:
+            return False
+        mask = vocabulary.get_translator(own_vocabulary)(mask)
+        transitions = self._bitmask_transitions.get(state)
+        if transitions is None:
+            transitions = self._bitmask_transitions.setdefault(state, {})
+        if mask in transitions:
+            self._current_state = transitions[mask]
+        else:
+            self._current_state = self._acceptor.get_successor(
+                state, {f: True for f in own_vocabulary.decode(mask)}
+            )
+            transitions[mask] = self._current_state
+        return self._is_true()
 
     def reset(self) -> None:
         """Reset the StepController."""
-        self._simulator.reset()
+        self._current_state = self._acceptor.initial_state
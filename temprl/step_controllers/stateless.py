@@ -21,27 +21,72 @@
 
 """This module contains an implementation of a stateless step controller."""
 
-from typing import Callable
+from typing import Callable, Dict, Optional, Sequence, Union
 
-from temprl.step_controllers.base import AbstractStepController
+import numpy as np
+
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.step_controllers.base import (
+    AbstractBatchedStepController,
+    AbstractStepController,
+)
 from temprl.types import Interpretation
 
+BatchedStepFunction = Callable[[np.ndarray], np.ndarray]
+
+DEFAULT_MAX_CACHE_SIZE = 4096
+
 
 class StatelessStepController(AbstractStepController):
-    """A class that allows to control the steps to be done by the temporal goals."""
+    """
+    A class that allows to control the steps to be done by the temporal goals.
+
+    The step function must only depend on the fluents: when the fluents are
+    encoded as bitmasks, its results are memoized per bitmask, over the last
+    vocabulary read, until the cache is full.
+    """
+
+    __slots__ = (
+        "started",
+        "step_func",
+        "allow_first",
+        "_max_cache_size",
+        "_vocabulary",
+        "_bitmask_results",
+    )
 
     def __init__(
-        self, step_func: Callable[[Interpretation], bool], allow_first: bool = True
+        self,
+        step_func: Callable[[Interpretation], bool],
+        allow_first: bool = True,
+        max_cache_size: int = DEFAULT_MAX_CACHE_SIZE,
     ):
         """
         Create the StepController.
 
         :param step_func: A function that takes a set of fluents and returns a boolean
         :param allow_first: If True, the first step always takes place
+        :param max_cache_size: the maximum number of memoized bitmasks; once reached,
+          the results of new bitmasks are not memoized. If 0, nothing is memoized.
+        :raise ValueError: if the maximum cache size is negative.
         """
+        enforce(
+            max_cache_size >= 0,
+            f"max cache size must be non-negative, got {max_cache_size}",
+            ValueError,
+        )
         self.started = False
         self.step_func = step_func
         self.allow_first = allow_first
+        self._max_cache_size = max_cache_size
+        self._vocabulary: Optional[FluentVocabulary] = None
+        self._bitmask_results: Dict[int, bool] = {}
+
+    @property
+    def cache_size(self) -> int:
+        """Get the number of memoized bitmasks."""
+        return len(self._bitmask_results)
 
     def step(self, fluents: Interpretation) -> bool:
         """
@@ -61,6 +106,103 @@ class StatelessStepController(AbstractStepController):
         # else, simply check with the step function
         return self.step_func(fluents)
 
+    def step_bitmask(self, mask: int, vocabulary: FluentVocabulary) -> bool:
+        """
+        Update the step controller, reading fluents encoded as a bitmask.
+
+        The step function is evaluated only the first time a bitmask is read,
+        as long as the vocabulary does not change and the cache is not full.
+
+        :param: mask: the bitmask of the true fluents
+        :param: vocabulary: the vocabulary over which the bitmask is defined
+        :return: True if the step can be taken, False otherwise
+        """
+        if self.allow_first and not self.started:
+            self.started = True
+            return True
+        results = self._bitmask_results
+        if vocabulary is not self._vocabulary:
+            # only the results over the last vocabulary are kept
+            results.clear()
+            self._vocabulary = vocabulary
+        result = results.get(mask)
+        if result is None:
+            result = bool(self.step_func(vocabulary.decode(mask)))
+            if len(results) < self._max_cache_size:
+                results[mask] = result
+        if not self.started:
+            self.started = result
+        return result
+
     def reset(self):
         """Reset the StepController."""
         self.started = False
+
+
+class BatchedStatelessStepController(AbstractBatchedStepController):
+    """
+    A batch of stateless step controllers that share the same step function.
+
+    The step function is evaluated once per batch, on the fluent matrix of all
+    the environments, and the 'started' and 'allow_first' flags are kept
+    as boolean arrays, one entry per environment.
+    """
+
+    __slots__ = ("step_func", "allow_first", "started")
+
+    def __init__(
+        self,
+        step_func: BatchedStepFunction,
+        num_envs: int,
+        allow_first: Union[bool, Sequence[bool], np.ndarray] = True,
+    ):
+        """
+        Create the batch of step controllers.
+
+        :param step_func: a function that takes a boolean fluent matrix of shape
+          (num_envs, num_fluents) and returns a boolean vector of shape (num_envs,).
+        :param num_envs: the number of environments.
+        :param allow_first: if True, the first step always takes place;
+          either a single flag, or one flag per environment.
+        :raise ValueError: if the number of flags does not match the number of environments.
+        """
+        allow_first_array = np.asarray(allow_first, dtype=bool)
+        enforce(
+            allow_first_array.ndim == 0 or allow_first_array.shape == (num_envs,),
+            f"expected {num_envs} 'allow_first' flags, got {allow_first_array.size}",
+            ValueError,
+        )
+        self.step_func = step_func
+        self.allow_first = np.broadcast_to(allow_first_array, (num_envs,)).copy()
+        self.started = np.zeros(num_envs, dtype=bool)
+
+    @property
+    def num_envs(self) -> int:
+        """Get the number of environments."""
+        return len(self.started)
+
+    def step(self, fluent_matrix: np.ndarray) -> np.ndarray:
+        """
+        Update the step controllers and check whether the steps on the DFA can take place.
+
+        :param fluent_matrix: the boolean fluent matrix of shape (num_envs, num_fluents).
+        :return: the boolean vector that tells, for every environment,
+          whether the step can be taken.
+        """
+        allowed = np.asarray(self.step_func(fluent_matrix), dtype=bool)
+        # always allow the first step, where requested
+        allowed = allowed | (self.allow_first & ~self.started)
+        self.started |= allowed
+        return allowed
+
+    def reset(self, indices: Optional[np.ndarray] = None) -> None:
+        """
+        Reset the step controllers.
+
+        :param indices: the indices, or the boolean mask, of the environments to reset.
+          If None, all the environments are reset.
+        """
+        if indices is None:
+            self.started[:] = False
+        else:
+            self.started[indices] = False
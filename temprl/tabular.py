@@ -0,0 +1,334 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Tabular value storage for environments wrapped with temporal goals."""
+import math
+from typing import Any, Dict, Hashable, Iterator, Optional, Sequence, Tuple, Union, cast
+
+import gym
+import numpy as np
+from gym.spaces import Discrete, MultiDiscrete, Space
+from gym.spaces import Tuple as GymTuple
+from gym.vector.utils import batch_space, iterate
+
+from temprl.helpers import enforce
+from temprl.wrapper import DENSE_OBSERVATION_MODE, TemporalGoalWrapper
+
+DEFAULT_INITIAL_CAPACITY = 64
+DEFAULT_MAX_SIZE = 1 << 28
+
+
+class QTable:
+    """
+    Action values stored in a dense array, indexed by observation, automaton state and action.
+
+    The automaton state is the tuple of the indices of the states of the temporal goals,
+    as in the "dense" observation mode of TemporalGoalWrapper (or as the state ids of
+    VectorTemporalGoalWrapper); it is mapped to its index in the product of the state
+    spaces of the temporal goals, in row-major order.
+
+    If the observation space of the environment is Discrete or MultiDiscrete, the
+    observation index is computed from the observation. Otherwise, observations
+    (which must be hashable, or NumPy arrays) get an index in order of discovery,
+    and the table grows as new observations are met.
+    """
+
+    def __init__(
+        self,
+        automata_shape: Sequence[int],
+        nb_actions: int,
+        observation_space: Optional[Space] = None,
+        initial_value: float = 0.0,
+        initial_capacity: int = DEFAULT_INITIAL_CAPACITY,
+        *,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        """
+        Initialize the table.
+
+        :param automata_shape: the number of states of every temporal goal.
+        :param nb_actions: the number of actions.
+        :param observation_space: the observation space of the environment. If it is
+          neither Discrete nor MultiDiscrete (e.g. None), the table grows lazily.
+        :param initial_value: the initial value of every entry.
+        :param initial_capacity: the initial number of observations of a lazily growing table.
+        :param max_size: the maximum number of entries of the table.
+        :raise ValueError: if the initial capacity is not positive,
+          or if the table has more than max_size entries.
+        """
+        enforce(
+            initial_capacity > 0,
+            f"initial capacity must be positive, got {initial_capacity}",
+            ValueError,
+        )
+        self._automata_shape: Tuple[int, ...] = tuple(int(n) for n in automata_shape)
+        self._nb_automaton_states = math.prod(self._automata_shape)
+        self._max_size = max_size
+        self._nb_actions = nb_actions
+        self._initial_value = initial_value
+        self._observation_space = observation_space
+        self._observation_shape: Optional[Tuple[int, ...]] = None
+        self._observation_offset = 0
+        if isinstance(observation_space, Discrete):
+            self._observation_shape = (int(observation_space.n),)
+            self._observation_offset = int(getattr(observation_space, "start", 0))
+        elif isinstance(observation_space, MultiDiscrete):
+            self._observation_shape = tuple(
+                int(n) for n in np.ravel(observation_space.nvec)
+            )
+        self._observation_ids: Dict[Hashable, int] = {}
+        nb_rows = (
+            math.prod(self._observation_shape)
+            if self._observation_shape is not None
+            else initial_capacity
+        )
+        self._check_size(nb_rows)
+        self._values = np.full(
+            (nb_rows, self.nb_automaton_states, nb_actions),
+            initial_value,
+            dtype=np.float64,
+        )
+
+    @classmethod
+    def from_env(cls, env: gym.Env, initial_value: float = 0.0) -> "QTable":
+        """
+        Build the table from the spaces of a wrapped environment.
+
+        For vectorized environments, the spaces of a single environment are used.
+
+        :param env: a TemporalGoalWrapper in "dense" observation mode,
+          or a VectorTemporalGoalWrapper.
+        :param initial_value: the initial value of every entry.
+        :return: the table.
+        :raise ValueError: if the automaton states in the observations are not indices,
+          or if the action space is not Discrete.
+        """
+        enforce(
+            not isinstance(env, TemporalGoalWrapper)
+            or env.observation_mode == DENSE_OBSERVATION_MODE,
+            f"expected a wrapper in {DENSE_OBSERVATION_MODE!r} observation mode",
+            ValueError,
+        )
+        observation_space = getattr(
+            env, "single_observation_space", env.observation_space
+        )
+        action_space = getattr(env, "single_action_space", env.action_space)
+        enforce(
+            isinstance(observation_space, GymTuple)
+            and len(observation_space.spaces) == 2
+            and isinstance(observation_space.spaces[1], MultiDiscrete),
+            "expected observations made of the observation of the environment "
+            "and of the automaton states",
+            ValueError,
+        )
+        enforce(
+            isinstance(action_space, Discrete),
+            f"expected a Discrete action space, got {action_space}",
+            ValueError,
+        )
+        env_space, automata_space = cast(GymTuple, observation_space).spaces
+        return cls(
+            np.ravel(cast(MultiDiscrete, automata_space).nvec).tolist(),
+            int(cast(Discrete, action_space).n),
+            observation_space=env_space,
+            initial_value=initial_value,
+        )
+
+    @property
+    def nb_automaton_states(self) -> int:
+        """Get the number of states of the product of the temporal goals."""
+        return self._nb_automaton_states
+
+    @property
+    def nb_actions(self) -> int:
+        """Get the number of actions."""
+        return self._nb_actions
+
+    @property
+    def nb_observations(self) -> int:
+        """Get the number of observations, i.e. the ones met so far if the table grows lazily."""
+        if self._observation_shape is not None:
+            return len(self._values)
+        return len(self._observation_ids)
+
+    @property
+    def values(self) -> np.ndarray:
+        """Get the values, of shape (nb_observations, nb_automaton_states, nb_actions)."""
+        return self._values[: self.nb_observations]
+
+    def _check_size(self, nb_rows: int) -> None:
+        """Check that a table with a number of observations has at most max_size entries."""
+        size = nb_rows * self._nb_automaton_states * self._nb_actions
+        enforce(
+            size <= self._max_size,
+            f"the table would have {size} entries ({nb_rows} observations, "
+            f"{self._nb_automaton_states} automaton states, {self._nb_actions} actions), "
+            f"more than the maximum of {self._max_size}",
+            ValueError,
+        )
+
+    def _grow(self, nb_rows: int) -> None:
+        """Grow the table to at least a number of observations, doubling the capacity."""
+        capacity = len(self._values)
+        if nb_rows <= capacity:
+            return
+        self._check_size(nb_rows)
+        row_size = max(self._nb_automaton_states * self._nb_actions, 1)
+        new_capacity = min(max(nb_rows, 2 * capacity), self._max_size // row_size)
+        values = np.full(
+            (new_capacity,) + self._values.shape[1:],
+            self._initial_value,
+            dtype=self._values.dtype,
+        )
+        values[:capacity] = self._values
+        self._values = values
+
+    def _get_observation_id(self, observation: Any) -> int:
+        """Get the index of an observation, assigning a new one if it was never met."""
+        key = (
+            (observation.shape, observation.tobytes())
+            if isinstance(observation, np.ndarray)
+            else observation
+        )
+        observation_id = self._observation_ids.get(key)
+        if observation_id is None:
+            observation_id = len(self._observation_ids)
+            self._grow(observation_id + 1)
+            self._observation_ids[key] = observation_id
+        return observation_id
+
+    def get_index(self, observation: Tuple[Any, Sequence[int]]) -> Tuple[int, int]:
+        """
+        Get the indices of an observation of the wrapped environment.
+
+        :param observation: the pair (observation of the environment, automaton state indices).
+        :return: the observation index and the automaton index.
+        :raise ValueError: if some index is out of bounds.
+        """
+        env_observation, automata_states = observation
+        automaton_index = int(
+            np.ravel_multi_index(tuple(automata_states), self._automata_shape)
+        )
+        if self._observation_shape is None:
+            return self._get_observation_id(env_observation), automaton_index
+        if isinstance(self._observation_space, Discrete):
+            observation_index = int(env_observation) - self._observation_offset
+            enforce(
+                0 <= observation_index < len(self._values),
+                f"invalid observation {env_observation}",
+                ValueError,
+            )
+            return observation_index, automaton_index
+        observation_index = int(
+            np.ravel_multi_index(
+                tuple(np.ravel(env_observation) - self._observation_offset),
+                self._observation_shape,
+            )
+        )
+        return observation_index, automaton_index
+
+    def _iterate(self, observations: Any, batch_size: int) -> Iterator:
+        """Iterate over a batch of observations."""
+        if self._observation_space is None:
+            return iter(observations)
+        return iterate(batch_space(self._observation_space, batch_size), observations)
+
+    def get_indices(
+        self, observations: Any, automata_states: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the indices of a batch of observations, e.g. of a vectorized environment.
+
+        :param observations: the batch of observations of the environments.
+        :param automata_states: the automaton state indices,
+          of shape (batch size, nb_temporal_goals).
+        :return: the observation indices and the automaton indices, of shape (batch size,).
+        :raise ValueError: if some index is out of bounds.
+        """
+        automata_states = np.asarray(automata_states)
+        automaton_indices = np.asarray(
+            np.ravel_multi_index(tuple(automata_states.T), self._automata_shape),
+            dtype=np.intp,
+        )
+        if self._observation_shape is None:
+            observation_indices = np.asarray(
+                [
+                    self._get_observation_id(observation)
+                    for observation in self._iterate(observations, len(automata_states))
+                ],
+                dtype=np.intp,
+            )
+            return observation_indices, automaton_indices
+        observations = np.reshape(
+            np.asarray(observations) - self._observation_offset,
+            (len(automata_states), len(self._observation_shape)),
+        )
+        observation_indices = np.asarray(
+            np.ravel_multi_index(tuple(observations.T), self._observation_shape),
+            dtype=np.intp,
+        )
+        return observation_indices, automaton_indices
+
+    def __getitem__(self, observation: Tuple[Any, Sequence[int]]) -> np.ndarray:
+        """
+        Get the action values of an observation of the wrapped environment.
+
+        :param observation: the pair (observation of the environment, automaton state indices).
+        :return: the writable view of the action values.
+        """
+        observation_index, automaton_index = self.get_index(observation)
+        return self._values[observation_index, automaton_index]
+
+    def greedy_actions(
+        self,
+        observation_indices: Union[int, np.ndarray],
+        automaton_indices: Union[int, np.ndarray],
+    ) -> np.ndarray:
+        """
+        Get the greedy actions, with ties broken in favour of the lowest action.
+
+        :param observation_indices: the observation indices.
+        :param automaton_indices: the automaton indices.
+        :return: the actions that maximize the values, with the shape of the indices.
+        """
+        return self._values[observation_indices, automaton_indices].argmax(axis=-1)
+
+    def epsilon_greedy_actions(
+        self,
+        observation_indices: Union[int, np.ndarray],
+        automaton_indices: Union[int, np.ndarray],
+        eps: float,
+        rng: np.random.Generator,
+    ) -> np.ndarray:
+        """
+        Get epsilon-greedy actions.
+
+        :param observation_indices: the observation indices.
+        :param automaton_indices: the automaton indices.
+        :param eps: the probability of a uniformly random action.
+        :param rng: the random number generator.
+        :return: the actions, with the shape of the indices.
+        """
+        actions = self.greedy_actions(observation_indices, automaton_indices)
+        explore = rng.random(actions.shape) < eps
+        return np.where(
+            explore, rng.integers(0, self._nb_actions, size=actions.shape), actions
+        )
@@ -0,0 +1,254 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Recording of the automaton traces of the episodes, in columnar format."""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.reward_machines.serialization import PathLike, decode_value, encode_value
+from temprl.types import Symbol
+
+DEFAULT_CHUNK_SIZE = 65536
+MAX_TRACE_FLUENTS = 63
+TRACE_METADATA_FILENAME = "metadata.json"
+CHUNK_FILENAME_PREFIX = "chunk_"
+CHUNK_FILENAME_SUFFIX = ".npz"
+
+
+class Trace(NamedTuple):
+    """
+    The columns of a recorded trace, one row per step.
+
+    - fluent_names: the fluents over which the bitmasks are defined;
+    - episodes: the index of the episode of every step;
+    - steps: the index of every step in its episode;
+    - states: the indices of the automaton states reached after every step,
+      one column per temporal goal;
+    - rewards: the rewards of the temporal goals at every step;
+    - fluents: the bitmasks, over the fluents of the trace, of the fluents true at every step;
+    - transitions: whether the step controller let every temporal goal do a transition.
+    """
+
+    fluent_names: Tuple[Symbol, ...]
+    episodes: np.ndarray
+    steps: np.ndarray
+    states: np.ndarray
+    rewards: np.ndarray
+    fluents: np.ndarray
+    transitions: np.ndarray
+
+
+class TraceRecorder:
+    """
+    A recorder of the automaton traces of the episodes of a temporal goal wrapper.
+
+    Every step is appended to preallocated columnar buffers (see Trace). When the
+    buffers are full, they are flushed to a chunk file in .npz format in the output
+    directory, so the memory used by the recorder does not depend on the length of the trace.
+    Chunk files are written to a temporary file first and then renamed,
+    so every chunk file in the output directory is complete.
+    """
+
+    def __init__(
+        self,
+        output_dir: PathLike,
+        fluents: Sequence[Symbol],
+        nb_goals: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        compress: bool = False,
+    ):
+        """
+        Initialize the recorder.
+
+        :param output_dir: the directory of the chunk files. It is created if it does not exist.
+        :param fluents: the fluents over which the bitmasks of the trace are defined.
+        :param nb_goals: the number of temporal goals.
+        :param chunk_size: the number of steps of every chunk.
+        :param compress: whether to compress the chunk files.
+        :raise ValueError: if the chunk size is not positive, if there are too many fluents,
+          or if the output directory already contains a trace.
+        """
+        enforce(
+            chunk_size > 0,
+            f"chunk size must be positive, got {chunk_size}",
+            ValueError,
+        )
+        enforce(
+            len(fluents) <= MAX_TRACE_FLUENTS,
+            f"at most {MAX_TRACE_FLUENTS} fluents can be recorded, got {len(fluents)}",
+            ValueError,
+        )
+        self.output_dir = Path(output_dir)
+        enforce(
+            not (self.output_dir / TRACE_METADATA_FILENAME).exists(),
+            f"directory {self.output_dir} already contains a trace",
+            ValueError,
+        )
+        self.vocabulary = FluentVocabulary(fluents)
+        self.nb_goals = nb_goals
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self._episodes = np.zeros(chunk_size, dtype=np.int64)
+        self._steps = np.zeros(chunk_size, dtype=np.int64)
+        self._states = np.zeros((chunk_size, nb_goals), dtype=np.int64)
+        self._rewards = np.zeros((chunk_size, nb_goals), dtype=np.float64)
+        self._fluents = np.zeros(chunk_size, dtype=np.int64)
+        self._transitions = np.zeros((chunk_size, nb_goals), dtype=bool)
+        self._size = 0
+        self._episode = 0
+        self._step = 0
+        self._nb_steps = 0
+        self._chunk_paths: List[Path] = []
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        metadata: Dict[str, Any] = {
+            "fluents": [encode_value(fluent) for fluent in self.vocabulary.fluents],
+            "nb_goals": nb_goals,
+        }
+        temporary_path = self.output_dir / f".{TRACE_METADATA_FILENAME}.{os.getpid()}"
+        temporary_path.write_text(json.dumps(metadata))
+        os.replace(temporary_path, self.output_dir / TRACE_METADATA_FILENAME)
+
+    @property
+    def nb_steps(self) -> int:
+        """Get the number of recorded steps."""
+        return self._nb_steps
+
+    @property
+    def nb_episodes(self) -> int:
+        """Get the number of ended episodes."""
+        return self._episode
+
+    @property
+    def chunk_paths(self) -> List[Path]:
+        """Get the paths of the chunk files written so far."""
+        return list(self._chunk_paths)
+
+    def record(
+        self,
+        state_indices: Sequence[int],
+        rewards: Sequence[float],
+        mask: int,
+        transitions: Sequence[bool],
+    ) -> None:
+        """
+        Record a step.
+
+        :param state_indices: the indices of the automaton states reached after the step.
+        :param rewards: the rewards of the temporal goals.
+        :param mask: the bitmask of the true fluents, over the fluents of the recorder.
+        :param transitions: whether every temporal goal did a transition.
+        """
+        row = self._size
+        self._episodes[row] = self._episode
+        self._steps[row] = self._step
+        self._states[row] = state_indices
+        self._rewards[row] = rewards
+        self._fluents[row] = mask
+        self._transitions[row] = transitions
+        self._size = row + 1
+        self._step += 1
+        self._nb_steps += 1
+        if self._size == self.chunk_size:
+            self.flush()
+
+    def end_episode(self) -> None:
+        """End the current episode, if any step of it was recorded."""
+        if self._step > 0:
+            self._episode += 1
+            self._step = 0
+
+    def flush(self) -> Optional[Path]:
+        """
+        Write the buffered steps to a new chunk file.
+
+        :return: the path of the chunk file, or None if no step is buffered.
+        """
+        size = self._size
+        if size == 0:
+            return None
+        path = (
+            self.output_dir
+            / f"{CHUNK_FILENAME_PREFIX}{len(self._chunk_paths):06d}{CHUNK_FILENAME_SUFFIX}"
+        )
+        temporary_path = path.with_name(f".{path.name}.{os.getpid()}")
+        save = np.savez_compressed if self.compress else np.savez
+        with temporary_path.open("wb") as f:
+            save(
+                f,
+                episodes=self._episodes[:size],
+                steps=self._steps[:size],
+                states=self._states[:size],
+                rewards=self._rewards[:size],
+                fluents=self._fluents[:size],
+                transitions=self._transitions[:size],
+            )
+        os.replace(temporary_path, path)
+        self._chunk_paths.append(path)
+        self._size = 0
+        return path
+
+    def close(self) -> None:
+        """Flush the buffered steps."""
+        self.flush()
+
+
+def load_trace(path: PathLike) -> Trace:
+    """
+    Load a trace written by a TraceRecorder, concatenating its chunks.
+
+    :param path: the output directory of the recorder.
+    :return: the trace.
+    :raise ValueError: if the directory does not contain a trace.
+    """
+    directory = Path(path)
+    metadata_path = directory / TRACE_METADATA_FILENAME
+    enforce(
+        metadata_path.exists(),
+        f"directory {directory} does not contain a trace",
+        ValueError,
+    )
+    metadata = json.loads(metadata_path.read_text())
+    nb_goals = metadata["nb_goals"]
+    columns: Dict[str, List[np.ndarray]] = {
+        "episodes": [np.zeros(0, dtype=np.int64)],
+        "steps": [np.zeros(0, dtype=np.int64)],
+        "states": [np.zeros((0, nb_goals), dtype=np.int64)],
+        "rewards": [np.zeros((0, nb_goals), dtype=np.float64)],
+        "fluents": [np.zeros(0, dtype=np.int64)],
+        "transitions": [np.zeros((0, nb_goals), dtype=bool)],
+    }
+    for chunk_path in sorted(
+        directory.glob(f"{CHUNK_FILENAME_PREFIX}*{CHUNK_FILENAME_SUFFIX}")
+    ):
+        with np.load(chunk_path) as chunk:
+            for name, arrays in columns.items():
+                arrays.append(chunk[name])
+    return Trace(
+        fluent_names=tuple(decode_value(fluent) for fluent in metadata["fluents"]),
+        **{name: np.concatenate(arrays) for name, arrays in columns.items()},
+    )
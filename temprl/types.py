@@ -20,7 +20,9 @@
 #
 
 """This module contains the definition of custom types."""
-from typing import AbstractSet, Callable, Hashable, Optional, Tuple
+from typing import AbstractSet, Any, Callable, Hashable, Optional, Tuple, Union
+
+import numpy as np
 
 # reward machine typing
 State = Hashable
@@ -32,3 +34,7 @@ Interpretation = AbstractSet[Symbol]
 Observation = Hashable
 Action = Hashable
 FluentExtractor = Callable[[Observation, Optional[Action]], Interpretation]
+BitmaskFluentExtractor = Callable[
+    [Observation, Optional[Action]], Union[int, np.ndarray]
+]
+BatchedFluentExtractor = Callable[[Any, Optional[Any]], np.ndarray]
@@ -0,0 +1,289 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Gym wrapper to include temporal goals in vectorized environments."""
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from gym.spaces import MultiDiscrete
+from gym.spaces import Tuple as GymTuple
+from gym.vector import VectorEnv, VectorEnvWrapper
+from gym.vector.utils import concatenate, create_empty_array, iterate
+
+from temprl.helpers import enforce
+from temprl.observations import FlatObservationEncoder
+from temprl.reward_machines.compiled import CompiledRewardMachine
+from temprl.step_controllers.base import AbstractBatchedStepController
+from temprl.types import BatchedFluentExtractor, Symbol
+from temprl.wrapper import FLAT_OBSERVATION_MODE, RAW_OBSERVATION_MODE, TemporalGoal
+
+
+class VectorTemporalGoalWrapper(VectorEnvWrapper):
+    """
+    Gym wrapper to include temporal goals in a vectorized environment.
+
+    The automaton states of all the copies of the environment are kept in
+    a single integer array of shape (num_envs, num_goals), whose entries
+    are the state ids of the compiled reward machines of the temporal goals.
+    At every step, all the automata are advanced with NumPy indexing.
+
+    The automata of the environments that are done are reset to their
+    initial state, consistently with the autoreset of the vectorized environment.
+    The shaping rewards of the temporal goals with reward shaping are computed
+    from tables of the potentials of their states.
+    """
+
+    def __init__(
+        self,
+        env: VectorEnv,
+        temp_goals: List[TemporalGoal],
+        fluents: Sequence[Symbol],
+        fluent_extractor: BatchedFluentExtractor,
+        step_controller: Optional[AbstractBatchedStepController] = None,
+        *,
+        observation_mode: str = RAW_OBSERVATION_MODE,
+        copy_observations: bool = False,
+    ):
+        """
+        Wrap a vectorized Gym environment with temporal goals.
+
+        :param env: the vectorized Gym environment to wrap.
+        :param temp_goals: the temporal goals to be learnt. Reward machines that are
+          not instances of CompiledRewardMachine are compiled.
+        :param fluents: the fluents, in the same order as the columns of the fluent matrix.
+        :param fluent_extractor: the batched extractor of the fluents.
+          A callable that takes in input the batch of observations and the batch
+          of the last actions taken, and returns a boolean matrix of shape
+          (num_envs, num_fluents), where the entry (i, j) is True iff the j-th fluent
+          is true in the current state of the i-th environment.
+        :param step_controller: the batched step controller that decides, for every
+          environment, when a transition of the automata has to take place. It reads
+          the same fluent matrix, and the controllers of the environments that are
+          done are reset. If None, all the transitions take place.
+        :param observation_mode: in "raw" mode, the observation is the pair
+          (batch of observations, automaton state ids). In "flat" mode, it is a float32
+          matrix whose rows are made of the flattened observation of an environment
+          followed by the one-hot encodings of its automaton states (see FlatObservationEncoder).
+        :param copy_observations: in "flat" mode, the matrix is preallocated and overwritten
+          at every step. If False, it is returned as it is, and it must be copied if it has
+          to be stored; if True, a copy is returned.
+        :raise ValueError: if a temporal goal reads a fluent that is not provided,
+          or if the observation mode is not supported.
+        """
+        enforce(
+            observation_mode in (RAW_OBSERVATION_MODE, FLAT_OBSERVATION_MODE),
+            f"observation mode {observation_mode!r} not supported, "
+            f"expected one of {(RAW_OBSERVATION_MODE, FLAT_OBSERVATION_MODE)}",
+            ValueError,
+        )
+        super().__init__(env)
+        self.temp_goals = temp_goals
+        self.fluents: Tuple[Symbol, ...] = tuple(fluents)
+        self.fluent_extractor: BatchedFluentExtractor = fluent_extractor
+        self.step_controller = step_controller
+        self._reward_machines: List[CompiledRewardMachine] = [
+            tg.automaton
+            if isinstance(tg.automaton, CompiledRewardMachine)
+            else CompiledRewardMachine.from_reward_machine(tg.automaton)
+            for tg in temp_goals
+        ]
+        columns = {fluent: index for index, fluent in enumerate(self.fluents)}
+        self._fluent_columns: List[np.ndarray] = []
+        self._fluent_weights: List[np.ndarray] = []
+        for rm in self._reward_machines:
+            missing = [f for f in rm.fluents if f not in columns]
+            enforce(
+                len(missing) == 0,
+                f"fluents {missing} are read by a temporal goal but are not provided",
+                ValueError,
+            )
+            self._fluent_columns.append(
+                np.asarray([columns[f] for f in rm.fluents], dtype=np.intp)
+            )
+            self._fluent_weights.append(
+                np.left_shift(1, np.arange(len(rm.fluents), dtype=np.int64))
+            )
+        # the discount factor and the potential of every state id of the shaped goals
+        self._shapings: List[Optional[Tuple[float, np.ndarray]]] = [
+            (
+                tg.shaping.discount,
+                np.asarray(
+                    [
+                        tg.shaping.potential(rm.get_state(state_id))
+                        for state_id in range(len(rm.states))
+                    ],
+                    dtype=np.float64,
+                ),
+            )
+            if tg.shaping is not None
+            else None
+            for tg, rm in zip(temp_goals, self._reward_machines)
+        ]
+        self._initial_state_ids = np.asarray(
+            [rm.initial_state_id for rm in self._reward_machines], dtype=np.int32
+        )
+        self._automata_states = np.tile(self._initial_state_ids, (self.num_envs, 1))
+
+        temp_goals_shape = [len(rm.states) for rm in self._reward_machines]
+        self.single_observation_space = GymTuple(
+            (self.env.single_observation_space, MultiDiscrete(temp_goals_shape))
+        )
+        self.observation_space = GymTuple(
+            (
+                self.env.observation_space,
+                MultiDiscrete(np.tile(temp_goals_shape, (self.num_envs, 1)).tolist()),
+            )
+        )
+        self.observation_mode = observation_mode
+        self.copy_observations = copy_observations
+        self._flat_encoder: Optional[FlatObservationEncoder] = None
+        if observation_mode == FLAT_OBSERVATION_MODE:
+            self._flat_encoder = FlatObservationEncoder(
+                self.env.single_observation_space,
+                temp_goals_shape,
+                num_envs=self.num_envs,
+            )
+            self.single_observation_space = self._flat_encoder.single_observation_space
+            self.observation_space = self._flat_encoder.observation_space
+        self._actions = None
+
+    @property
+    def automata_states(self) -> np.ndarray:
+        """Get a copy of the current automaton state ids, of shape (num_envs, num_goals)."""
+        return self._automata_states.copy()
+
+    def _make_observations(self, observations):
+        """Build the observations of the wrapper, according to the observation mode."""
+        flat_encoder = self._flat_encoder
+        if flat_encoder is None:
+            return observations, self.automata_states
+        flat_observations = flat_encoder.encode_batch(
+            observations, self._automata_states
+        )
+        return flat_observations.copy() if self.copy_observations else flat_observations
+
+    def _advance(
+        self,
+        fluent_matrix: np.ndarray,
+        allowed: Optional[np.ndarray] = None,
+        dones: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Advance all the automata.
+
+        The shaping rewards are given to all the environments, including the ones
+        whose automata do not take the step (see PotentialShaping).
+
+        :param fluent_matrix: the boolean fluent matrix of shape (num_envs, num_fluents).
+        :param allowed: the boolean vector of the environments whose automata
+          can take the step. If None, all the automata take the step.
+        :param dones: the boolean vector of the environments whose episode ends
+          with the step. If None, no episode ends.
+        :return: the rewards of the temporal goals, of shape (num_envs, num_goals).
+        """
+        fluent_matrix = np.asarray(fluent_matrix, dtype=bool)
+        rewards = np.zeros(self._automata_states.shape, dtype=np.float64)
+        rows = slice(None) if allowed is None else allowed
+        not_dones = 1.0 if dones is None else ~np.asarray(dones, dtype=bool)
+        for goal_index, (rm, columns, weights, shaping) in enumerate(
+            zip(
+                self._reward_machines,
+                self._fluent_columns,
+                self._fluent_weights,
+                self._shapings,
+            )
+        ):
+            masks = fluent_matrix[rows][:, columns].astype(np.int64) @ weights
+            states = self._automata_states[:, goal_index]
+            current = states[rows]
+            rewards[rows, goal_index] = rm.rewards[current, masks]
+            if shaping is not None:
+                discount, potentials = shaping
+                rewards[:, goal_index] -= potentials[states]
+            states[rows] = rm.transitions[current, masks]
+            if shaping is not None:
+                rewards[:, goal_index] += discount * potentials[states] * not_dones
+        return rewards
+
+    def _last_observations(self, observations, dones, infos):
+        """Replace the observations of the done environments with the terminal ones."""
+        if not np.any(dones):
+            return observations
+        single_space = self.env.single_observation_space
+        last_observations = [
+            info["terminal_observation"] if done else observation
+            for observation, done, info in zip(
+                iterate(self.env.observation_space, observations), dones, infos
+            )
+        ]
+        return concatenate(
+            single_space,
+            last_observations,
+            create_empty_array(single_space, n=self.num_envs),
+        )
+
+    def reset_wait(self, **kwargs):
+        """
+        Reset the vectorized Gym environment.
+
+        :param kwargs: the keyword arguments of the reset function.
+        :return: the batch of initial observations and automaton state ids.
+        """
+        observations = self.env.reset_wait(**kwargs)
+        self._automata_states[:] = self._initial_state_ids
+        if self.step_controller is not None:
+            self.step_controller.reset()
+        return self._make_observations(observations)
+
+    def call_wait(self, **kwargs):
+        """Get the results of the methods called in the vectorized Gym environment."""
+        return self.env.call_wait(**kwargs)
+
+    def set_attr(self, name, values):
+        """Set an attribute of the copies of the vectorized Gym environment."""
+        return self.env.set_attr(name, values)
+
+    def render(self, mode="human"):
+        """Render the vectorized Gym environment."""
+        return self.env.render(mode=mode)
+
+    def step_async(self, actions):
+        """Send the actions to the vectorized Gym environment."""
+        self._actions = actions
+        return self.env.step_async(actions)
+
+    def step_wait(self):
+        """Do a step in the vectorized Gym environment."""
+        observations, rewards, dones, infos = self.env.step_wait()
+        last_observations = self._last_observations(observations, dones, infos)
+        fluent_matrix = self.fluent_extractor(last_observations, self._actions)
+        allowed = (
+            np.asarray(self.step_controller.step(fluent_matrix), dtype=bool)
+            if self.step_controller is not None
+            else None
+        )
+        done_mask = np.asarray(dones, dtype=bool)
+        temp_goal_rewards = self._advance(fluent_matrix, allowed, done_mask)
+        self._automata_states[done_mask] = self._initial_state_ids
+        if self.step_controller is not None:
+            self.step_controller.reset(done_mask)
+        rewards_prime = rewards + temp_goal_rewards.sum(axis=1)
+        return self._make_observations(observations), rewards_prime, dones, infos
@@ -21,42 +21,301 @@
 
 """Main module."""
 import logging
-from typing import List, Optional, Tuple
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
 
 import gym
+import numpy as np
 from gym.core import ActType
 from gym.spaces import Discrete, MultiDiscrete
 from gym.spaces import Tuple as GymTuple
 
+from temprl.fluents import FluentVocabulary
+from temprl.helpers import enforce
+from temprl.instrumentation import (
+    ENV_PHASE,
+    FLUENT_EXTRACTOR_PHASE,
+    INFO_KEY,
+    REWARD_MACHINES_PHASE,
+    STEP_CONTROLLER_PHASE,
+    StepProfiler,
+)
+from temprl.observations import FlatObservationEncoder
 from temprl.reward_machines.base import AbstractRewardMachine, RewardMachineSimulator
+from temprl.reward_machines.compiled import CompiledRewardMachine, _sorted_if_possible
+from temprl.reward_machines.lazy import LazyRewardMachine
+from temprl.reward_machines.product import (
+    DEFAULT_MAX_PRODUCT_SIZE,
+    build_product_reward_machine,
+    get_component_tables,
+)
+from temprl.reward_machines.shaping import (
+    DEFAULT_DISCOUNT,
+    PotentialShaping,
+    get_product_potentials,
+    shape_product_reward_machine,
+)
 from temprl.step_controllers.base import AbstractStepController
 from temprl.step_controllers.stateless import StatelessStepController
-from temprl.types import FluentExtractor, Interpretation, Observation, State
+from temprl.traces import TraceRecorder
+from temprl.types import (
+    BitmaskFluentExtractor,
+    FluentExtractor,
+    Interpretation,
+    Observation,
+    State,
+    Symbol,
+)
 
 logger = logging.getLogger(__name__)
 
+RAW_OBSERVATION_MODE = "raw"
+DENSE_OBSERVATION_MODE = "dense"
+FLAT_OBSERVATION_MODE = "flat"
+DEFAULT_PIPELINE_DEPTH = 2
+OBSERVATION_MODES = (
+    RAW_OBSERVATION_MODE,
+    DENSE_OBSERVATION_MODE,
+    FLAT_OBSERVATION_MODE,
+)
+
+
+CounterfactualTransitions = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
 
 class TemporalGoal:
     """Abstract class to represent a temporal goal."""
 
+    __slots__ = (
+        "_reward_machine",
+        "_simulator",
+        "_shaping",
+        "_state_to_index",
+        "_index_to_state",
+        "_counterfactual_tables",
+    )
+
     def __init__(
         self,
         reward_machine: AbstractRewardMachine,
+        reward_shaping: bool = False,
+        discount: float = DEFAULT_DISCOUNT,
     ):
         """
         Initialize a temporal goal.
 
         :param reward_machine: the reward
+        :param reward_shaping: if True, the potential-based shaping reward computed
+          from the distance to acceptance (see PotentialShaping) is added to the
+          reward of every transition of the reward machine.
+        :param discount: the discount factor of the learner, used by the shaping.
+        :raise ValueError: if the reward shaping is enabled, but the reward machine
+          does not expose its accepting states.
         """
         self._reward_machine = reward_machine
         self._simulator = RewardMachineSimulator(
             reward_machine,
         )
+        self._shaping: Optional[PotentialShaping] = (
+            PotentialShaping(reward_machine, discount=discount)
+            if reward_shaping
+            else None
+        )
+        self._state_to_index: Callable[[State], int]
+        self._index_to_state: Callable[[int], State]
+        if isinstance(reward_machine, CompiledRewardMachine):
+            self._state_to_index = reward_machine.get_state_id
+            self._index_to_state = reward_machine.get_state
+        elif isinstance(reward_machine, LazyRewardMachine):
+            # the states of lazy reward machines are already dense ids
+            self._state_to_index = cast(Callable[[State], int], int)
+            self._index_to_state = int
+        else:
+            states = _sorted_if_possible(reward_machine.states)
+            indices: Dict[State, int] = {q: i for i, q in enumerate(states)}
+            self._state_to_index = indices.__getitem__
+            self._index_to_state = states.__getitem__
+        self._counterfactual_tables: Optional[
+            Tuple[CompiledRewardMachine, np.ndarray, np.ndarray]
+        ] = None
 
     @property
     def observation_space(self) -> Discrete:
         """Return the observation space of the temporal goal."""
-        return Discrete(len(self._reward_machine.states))
+        return Discrete(self._reward_machine.max_nb_states)
+
+    def get_state_index(self, state: State) -> int:
+        """
+        Get the dense index of a state, in the range of the observation space.
+
+        The mapping is fixed at construction time: compiled reward machines
+        use their state ids, lazy reward machines their (already dense) states,
+        and the other reward machines the position of the state in sorted order.
+
+        :param state: the state of the reward machine.
+        :return: the index of the state.
+        :raise ValueError: if the state does not belong to the reward machine.
+        """
+        try:
+            return self._state_to_index(state)
+        except KeyError:
+            raise ValueError(
+                f"state {state} does not belong to the reward machine"
+            ) from None
+
+    def get_state(self, index: int) -> State:
+        """
+        Get the state associated to a dense index (see 'get_state_index').
+
+        :param index: the index of the state.
+        :return: the state of the reward machine.
+        :raise ValueError: if the index is not valid.
+        """
+        enforce(
+            0 <= index < self.observation_space.n,
+            f"invalid state index {index}",
+            ValueError,
+        )
+        try:
+            return self._index_to_state(index)
+        except IndexError:
+            raise ValueError(f"invalid state index {index}") from None
+
+    def _get_counterfactual_tables(
+        self,
+    ) -> Tuple[CompiledRewardMachine, np.ndarray, np.ndarray]:
+        """Get the compiled reward machine, and the state index and potential of every state id."""
+        if self._counterfactual_tables is None:
+            reward_machine = self._reward_machine
+            compiled = (
+                reward_machine
+                if isinstance(reward_machine, CompiledRewardMachine)
+                else CompiledRewardMachine.from_reward_machine(reward_machine)
+            )
+            nb_states = len(compiled.states)
+            # the state index of every compiled state id, and its potential
+            state_indices = np.asarray(
+                [
+                    self.get_state_index(compiled.get_state(state_id))
+                    for state_id in range(nb_states)
+                ],
+                dtype=np.int64,
+            )
+            potentials = np.zeros(nb_states, dtype=np.float64)
+            if self._shaping is not None:
+                potentials[:] = [
+                    self._shaping.potential(compiled.get_state(state_id))
+                    for state_id in range(nb_states)
+                ]
+            self._counterfactual_tables = (compiled, state_indices, potentials)
+        return self._counterfactual_tables
+
+    def _fill_counterfactual_transitions(
+        self,
+        compiled: CompiledRewardMachine,
+        state_indices: np.ndarray,
+        potentials: np.ndarray,
+        mask: int,
+        out: Optional[CounterfactualTransitions],
+        *,
+        done: bool,
+    ) -> CounterfactualTransitions:
+        """Read the counterfactual transitions of a bitmask from the compiled tables."""
+        nb_states = len(state_indices)
+        states, next_states, rewards = (
+            out
+            if out is not None
+            else (
+                np.empty(nb_states, dtype=np.int64),
+                np.empty(nb_states, dtype=np.int64),
+                np.empty(nb_states, dtype=np.float64),
+            )
+        )
+        next_state_ids = compiled.transitions[:, mask]
+        states[:] = state_indices
+        next_states[:] = state_indices[next_state_ids]
+        rewards[:] = compiled.rewards[:, mask]
+        if self._shaping is not None:
+            rewards -= potentials
+            if not done:
+                rewards += self._shaping.discount * potentials[next_state_ids]
+        return states, next_states, rewards
+
+    def get_counterfactual_transitions(
+        self,
+        symbol: Interpretation,
+        out: Optional[CounterfactualTransitions] = None,
+        done: bool = False,
+    ) -> CounterfactualTransitions:
+        """
+        Get the transitions that reading a symbol would trigger from every state.
+
+        This allows to replay an environment transition from all the automaton
+        states (counterfactual experiences, as in CRM). The transitions are read
+        from the compiled tables of the reward machine, which is compiled at the
+        first call if needed. The step controller is not taken into account.
+
+        :param symbol: the symbol to read.
+        :param out: optional arrays (e.g. slices of the storage of a replay buffer)
+          where the states, the next states and the rewards are written.
+          Each of them must have length equal to the number of states.
+        :param done: whether the transition is the last one of the episode, for the shaping.
+        :return: the state indices, the next state indices and the rewards
+          (including the shaping reward, if enabled), one entry per state.
+        :raise ValueError: if the reward machine cannot be compiled.
+        """
+        compiled, state_indices, potentials = self._get_counterfactual_tables()
+        return self._fill_counterfactual_transitions(
+            compiled, state_indices, potentials, compiled.encode(symbol), out, done=done
+        )
+
+    def get_counterfactual_transitions_bitmask(
+        self,
+        mask: int,
+        vocabulary: FluentVocabulary,
+        out: Optional[CounterfactualTransitions] = None,
+        done: bool = False,
+    ) -> CounterfactualTransitions:
+        """
+        Get the counterfactual transitions of a symbol encoded as a bitmask.
+
+        See 'get_counterfactual_transitions'.
+
+        :param mask: the bitmask of the symbol to read.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :param out: optional arrays where the states, the next states and the rewards are written.
+        :param done: whether the transition is the last one of the episode, for the shaping.
+        :return: the state indices, the next state indices and the rewards, one entry per state.
+        :raise ValueError: if the reward machine cannot be compiled.
+        """
+        compiled, state_indices, potentials = self._get_counterfactual_tables()
+        return self._fill_counterfactual_transitions(
+            compiled,
+            state_indices,
+            potentials,
+            compiled.translate(mask, vocabulary),
+            out,
+            done=done,
+        )
+
+    @property
+    def shaping(self) -> Optional[PotentialShaping]:
+        """Get the reward shaping, if enabled."""
+        return self._shaping
 
     @property
     def automaton(self) -> AbstractRewardMachine:
@@ -68,6 +327,11 @@ class TemporalGoal:
         """Get the current state."""
         return self._simulator.current_state
 
+    @current_state.setter
+    def current_state(self, state: State) -> None:
+        """Set the current state, e.g. to synchronize the temporal goal with a product."""
+        self._simulator.current_state = state
+
     def reset(self) -> None:
         """
         Reset the simulator.
@@ -76,25 +340,73 @@ class TemporalGoal:
         """
         return self._simulator.reset()
 
-    def step(self, symbol: Interpretation) -> Tuple[State, float]:
+    def step(self, symbol: Interpretation, done: bool = False) -> Tuple[State, float]:
         """
         Do a step.
 
         :param symbol: the symbol to read.
+        :param done: whether the step is the last one of the episode, for the shaping.
         :return: the generated reward signal.
         """
-        return self._simulator.step(symbol)
+        if self._shaping is None:
+            return self._simulator.step(symbol)
+        state = self._simulator.current_state
+        next_state, reward = self._simulator.step(symbol)
+        return next_state, reward + self._shaping(state, next_state, done)
+
+    def step_bitmask(
+        self, mask: int, vocabulary: FluentVocabulary, done: bool = False
+    ) -> Tuple[State, float]:
+        """
+        Do a step, reading a symbol encoded as a bitmask.
+
+        :param mask: the bitmask of the symbol to read.
+        :param vocabulary: the vocabulary over which the bitmask is defined.
+        :param done: whether the step is the last one of the episode, for the shaping.
+        :return: the new state and the generated reward signal.
+        """
+        if self._shaping is None:
+            return self._simulator.step_bitmask(mask, vocabulary)
+        state = self._simulator.current_state
+        next_state, reward = self._simulator.step_bitmask(mask, vocabulary)
+        return next_state, reward + self._shaping(state, next_state, done)
+
+    def skip(self, done: bool = False) -> Tuple[State, float]:
+        """
+        Do a step without reading a symbol, e.g. if the step controller does not allow it.
+
+        The state does not change. If the shaping is enabled, the reward is the shaping
+        reward of staying in the current state, so that the shaping rewards telescope
+        over the episode (see PotentialShaping); otherwise, it is 0.
+
+        :param done: whether the step is the last one of the episode, for the shaping.
+        :return: the current state and the shaping reward.
+        """
+        state = self._simulator.current_state
+        if self._shaping is None:
+            return state, 0.0
+        return state, self._shaping(state, state, done)
 
 
 class TemporalGoalWrapper(gym.Wrapper):
     """Gym wrapper to include a temporal goal in the environment."""
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
         self,
         env: gym.Env,
         temp_goals: List[TemporalGoal],
-        fluent_extractor: FluentExtractor,
+        fluent_extractor: Union[FluentExtractor, BitmaskFluentExtractor],
         step_controller: Optional[AbstractStepController] = None,
+        *,
+        fluents: Optional[Sequence[Symbol]] = None,
+        product: bool = False,
+        max_product_size: int = DEFAULT_MAX_PRODUCT_SIZE,
+        profiler: Optional[StepProfiler] = None,
+        observation_mode: str = RAW_OBSERVATION_MODE,
+        copy_observations: bool = False,
+        fluent_executor: Optional[Executor] = None,
+        pipeline_depth: int = DEFAULT_PIPELINE_DEPTH,
+        trace_recorder: Optional[TraceRecorder] = None,
     ):
         """
         Wrap a Gym environment with a temporal goal.
@@ -106,10 +418,67 @@ class TemporalGoalWrapper(gym.Wrapper):
           taken, and returns the set of fluents true in the current state.
         :param step_controller: the step controller that decides when a
           transition to the DFA has to take place.
+        :param fluents: the fluent vocabulary. If provided, the fluent extractor
+          must return either a bitmask or a boolean vector over the vocabulary
+          (set-based extractors can be adapted with SetToBitmaskFluentExtractor),
+          and the symbols are passed as bitmasks to the temporal goals
+          and to the step controller.
+        :param product: if True, the reward machines of the temporal goals are
+          compiled into a single product reward machine, so that all the goals
+          are stepped with one lookup, and the states of the temporal goals are
+          synchronized with the state of the product; the shaping rewards of the
+          temporal goals, if any, are added to the reward table of the product.
+          Since a step controller is queried once per temporal goal, the product
+          is only used with the default step controller, which allows all the
+          transitions. If a step controller is provided, or if the product cannot
+          be built (e.g. it exceeds the size limit), the temporal goals are stepped separately.
+        :param max_product_size: the maximum number of entries of the product tables.
+        :param profiler: if provided, the collector of the latencies of the phases
+          of every step (env step, fluent extraction, step controller, reward machines).
+          If None, the steps are not instrumented.
+        :param observation_mode: how the automaton states are included in the observation.
+          In "raw" mode, they are the states of the reward machines. In "dense" mode,
+          they are encoded as a NumPy integer array, whose i-th entry is the index of
+          the state of the i-th temporal goal (see TemporalGoal.get_state_index), so that
+          it belongs to the MultiDiscrete observation space. In "flat" mode, the whole
+          observation is a float32 vector, made of the flattened observation of the
+          environment followed by the one-hot encodings of the state indices, and the
+          observation space is a Box (see FlatObservationEncoder).
+        :param copy_observations: in "dense" and "flat" mode, the arrays are preallocated
+          and overwritten at every step. If False, they are returned as they are, and
+          they must be copied if they have to be stored; if True, a copy is returned.
+        :param fluent_executor: if provided, the executor (thread or process pool) where
+          the fluent extractor runs in 'step_many', while the environment computes
+          the next steps. With a process pool, the fluent extractor must be picklable.
+        :param pipeline_depth: the maximum number of fluent extractions in flight in 'step_many'.
+        :param trace_recorder: if provided, the recorder of the automaton state indices,
+          the rewards of the temporal goals, the fluents and the decisions of the step
+          controller at every step. In product mode, the rewards of the temporal goals are
+          read from their tables over the product states, since the product only gives their sum.
+        :raise ValueError: if the observation mode is not supported, if the pipeline
+          depth is not positive, or if the trace recorder is not compatible.
         """
+        enforce(
+            observation_mode in OBSERVATION_MODES,
+            f"observation mode {observation_mode!r} not supported, "
+            f"expected one of {OBSERVATION_MODES}",
+            ValueError,
+        )
+        enforce(
+            pipeline_depth > 0,
+            f"pipeline depth must be positive, got {pipeline_depth}",
+            ValueError,
+        )
+        enforce(
+            trace_recorder is None or trace_recorder.nb_goals == len(temp_goals),
+            f"the trace recorder expects {getattr(trace_recorder, 'nb_goals', None)} "
+            f"temporal goals, got {len(temp_goals)}",
+            ValueError,
+        )
         super().__init__(env)
         self.temp_goals = temp_goals
-        self.fluent_extractor: FluentExtractor = fluent_extractor
+        self.fluent_extractor = fluent_extractor
+        self.vocabulary = FluentVocabulary(fluents) if fluents is not None else None
         self.step_controller = (
             step_controller
             if step_controller
@@ -118,6 +487,80 @@ class TemporalGoalWrapper(gym.Wrapper):
             )
         )
         self.observation_space = self._get_observation_space()
+        # the discounted potential of every product state, zeroed at the end of the episode
+        self._product_terminal_potentials: Optional[Dict[State, float]] = None
+        self._product_simulator: Optional[RewardMachineSimulator] = (
+            self._build_product_simulator(max_product_size, step_controller)
+            if product
+            else None
+        )
+        self.profiler = profiler
+        self.observation_mode = observation_mode
+        self.copy_observations = copy_observations
+        self.fluent_executor = fluent_executor
+        self.pipeline_depth = pipeline_depth
+        self.trace_recorder = trace_recorder
+        # buffers reused at every step, to avoid allocations in the hot path
+        self._automata_states: List[State] = [tg.current_state for tg in temp_goals]
+        self._state_indices: List[int] = [0] * len(temp_goals)
+        self._goal_rewards: List[float] = [0.0] * len(temp_goals)
+        self._goal_transitions: List[bool] = [
+            self._product_simulator is not None
+        ] * len(temp_goals)
+        # the time spent in the step controller and in the reward machines
+        self._advance_timings: List[int] = [0, 0]
+        # the reward tables of the temporal goals over the product, built for the trace recorder
+        self._product_reward_tables: Optional[List[np.ndarray]] = None
+        self._dense_states: Optional[np.ndarray] = None
+        self._flat_encoder: Optional[FlatObservationEncoder] = None
+        if observation_mode == DENSE_OBSERVATION_MODE:
+            automata_space = cast(MultiDiscrete, self.observation_space[1])
+            self._dense_states = np.zeros(
+                len(self.temp_goals), dtype=automata_space.dtype
+            )
+        elif observation_mode == FLAT_OBSERVATION_MODE:
+            self._flat_encoder = FlatObservationEncoder(
+                self.env.observation_space,
+                [tg.observation_space.n for tg in self.temp_goals],
+            )
+            self.observation_space = self._flat_encoder.observation_space
+
+    def _build_product_simulator(
+        self,
+        max_product_size: int,
+        step_controller: Optional[AbstractStepController],
+    ) -> Optional[RewardMachineSimulator]:
+        """Build the simulator of the product of the temporal goals, if possible."""
+        try:
+            enforce(
+                step_controller is None,
+                "a step controller is queried once per temporal goal",
+                ValueError,
+            )
+            product = build_product_reward_machine(
+                [tg.automaton for tg in self.temp_goals], max_size=max_product_size
+            )
+        except ValueError as e:
+            logger.warning(
+                "cannot build the product of the temporal goals, "
+                "stepping them separately: %s",
+                e,
+            )
+            return None
+        shapings = [tg.shaping for tg in self.temp_goals]
+        if any(shaping is not None for shaping in shapings):
+            discounted_potentials, _ = get_product_potentials(product, shapings)
+            self._product_terminal_potentials = {
+                product.get_state(state_id): potential
+                for state_id, potential in enumerate(discounted_potentials.tolist())
+            }
+            product = shape_product_reward_machine(product, shapings)
+        return RewardMachineSimulator(product)
+
+    @property
+    def is_product(self) -> bool:
+        """Check whether the temporal goals are stepped through their product."""
+        return self._product_simulator is not None
 
     def _get_observation_space(self) -> gym.spaces.Space:
         """Return the observation space."""
@@ -126,21 +569,397 @@ class TemporalGoalWrapper(gym.Wrapper):
             (self.env.observation_space, MultiDiscrete(list(temp_goals_shape)))
         )
 
-    def step(self, action: ActType) -> Tuple[Observation, float, bool, dict]:
-        """Do a step in the Gym environment."""
-        obs, reward, done, info = super().step(action)
-        fluents = self.fluent_extractor(obs, action)
-        states_and_rewards = [
-            tg.step(fluents)
-            if self.step_controller.step(fluents)
-            else (tg.current_state, 0.0)
+    def decode_automata_states(
+        self, automata_states: Union[Sequence[int], np.ndarray]
+    ) -> List[State]:
+        """
+        Get the states of the reward machines from their dense indices.
+
+        This is the inverse of the encoding of the "dense" observation mode,
+        and is meant for debugging and logging.
+
+        :param automata_states: the indices of the states, one per temporal goal.
+        :return: the states of the reward machines.
+        :raise ValueError: if some index is not valid.
+        """
+        enforce(
+            len(automata_states) == len(self.temp_goals),
+            f"expected {len(self.temp_goals)} automaton states, got {len(automata_states)}",
+            ValueError,
+        )
+        return [
+            tg.get_state(int(index))
+            for tg, index in zip(self.temp_goals, automata_states)
+        ]
+
+    def get_counterfactual_transitions(
+        self, observation: Observation, action: Optional[ActType] = None
+    ) -> List[CounterfactualTransitions]:
+        """
+        Get the counterfactual transitions of every temporal goal.
+
+        The fluents are extracted from the observation as in 'step', and the
+        transitions that they would trigger from every state of every temporal
+        goal are returned (see TemporalGoal.get_counterfactual_transitions).
+
+        :param observation: the observation of the environment, after the action.
+        :param action: the action taken.
+        :return: the state indices, the next state indices and the rewards
+          of every temporal goal.
+        :raise ValueError: if some reward machine cannot be compiled.
+        """
+        if self.vocabulary is None:
+            symbol = cast(FluentExtractor, self.fluent_extractor)(observation, action)
+            return [tg.get_counterfactual_transitions(symbol) for tg in self.temp_goals]
+        vocabulary = self.vocabulary
+        extractor = cast(BitmaskFluentExtractor, self.fluent_extractor)
+        mask = vocabulary.to_bitmask(extractor(observation, action))
+        return [
+            tg.get_counterfactual_transitions_bitmask(mask, vocabulary)
             for tg in self.temp_goals
         ]
-        next_automata_states, temp_goal_rewards = zip(*states_and_rewards)
-        total_goal_rewards = sum(temp_goal_rewards)
-        obs_prime = (obs, next_automata_states)
-        reward_prime = reward + total_goal_rewards
-        return obs_prime, reward_prime, done, info
+
+    def _fill_state_indices(self, automata_states: Sequence[State]) -> List[int]:
+        """Write the indices of the automaton states into the reused buffer."""
+        state_indices = self._state_indices
+        for i, tg in enumerate(self.temp_goals):
+            state_indices[i] = tg.get_state_index(automata_states[i])
+        return state_indices
+
+    def _make_observation(
+        self, obs: Observation, automata_states: Any, copy: bool = False
+    ) -> Any:
+        """
+        Build the observation of the wrapper, according to the observation mode.
+
+        :param obs: the observation of the environment.
+        :param automata_states: the automaton states. In "raw" mode, they are
+          copied into a tuple, since the sequence can be a reused buffer.
+        :param copy: whether to copy the preallocated arrays, regardless of 'copy_observations'.
+        :return: the observation of the wrapper.
+        """
+        copy = copy or self.copy_observations
+        flat_encoder = self._flat_encoder
+        if flat_encoder is not None:
+            flat_obs = flat_encoder.encode(
+                obs, self._fill_state_indices(automata_states)
+            )
+            return flat_obs.copy() if copy else flat_obs
+        dense_states = self._dense_states
+        if dense_states is None:
+            return obs, tuple(automata_states)
+        dense_states[:] = self._fill_state_indices(automata_states)
+        return obs, dense_states.copy() if copy else dense_states
+
+    def step(self, action: ActType) -> Tuple[Observation, float, bool, dict]:
+        """Do a step in the Gym environment."""
+        if self.profiler is None:
+            obs, reward, done, info = super().step(action)
+            fluents = self.fluent_extractor(obs, action)
+            env_time = extractor_time = 0
+        else:
+            clock = time.perf_counter_ns
+            start = clock()
+            obs, reward, done, info = super().step(action)
+            env_end = clock()
+            fluents = self.fluent_extractor(obs, action)
+            env_time, extractor_time = env_end - start, clock() - env_end
+        next_automata_states, goal_reward = self._advance(
+            fluents, done, info, env_time, extractor_time
+        )
+        obs_prime = self._make_observation(obs, next_automata_states)
+        return obs_prime, reward + goal_reward, done, info
+
+    def step_many(
+        self, actions: Iterable[ActType]
+    ) -> List[Tuple[Observation, float, bool, dict]]:
+        """
+        Do a sequence of steps, whose actions are known in advance.
+
+        If a fluent executor is set, the fluent extraction of every step is submitted
+        to it, and the environment goes on with the next steps while the fluents are
+        extracted, with at most 'pipeline_depth' extractions in flight. The temporal
+        goals and the step controller are updated in order as the results arrive,
+        so the returned transitions are the same as the ones of calling 'step' on
+        every action. The sequence stops at the end of the episode.
+
+        Since the action of a step cannot depend on the automaton states of the
+        previous steps, this is meant for open-loop action sequences (e.g. action
+        repeat, or the execution of plans). With a fluent executor, the profiler,
+        if any, records as fluent extraction time the time spent submitting
+        the extraction and waiting for its result.
+
+        :param actions: the actions.
+        :return: the transitions (observation, reward, done, info) of the steps,
+          where the preallocated observation arrays are always copied.
+        """
+        executor = self.fluent_executor
+        clock = time.perf_counter_ns if self.profiler is not None else None
+        pending: Deque[Tuple[Any, Observation, float, bool, dict, int, int]] = deque()
+        transitions: List[Tuple[Observation, float, bool, dict]] = []
+
+        def complete_oldest() -> None:
+            (
+                fluents,
+                obs,
+                reward,
+                done,
+                info,
+                env_time,
+                extractor_time,
+            ) = pending.popleft()
+            if executor is not None:
+                start = clock() if clock is not None else 0
+                fluents = cast(Future, fluents).result()
+                if clock is not None:
+                    extractor_time += clock() - start
+            next_automata_states, goal_reward = self._advance(
+                fluents, done, info, env_time, extractor_time
+            )
+            obs_prime = self._make_observation(obs, next_automata_states, copy=True)
+            transitions.append((obs_prime, reward + goal_reward, done, info))
+
+        try:
+            for action in actions:
+                start = clock() if clock is not None else 0
+                obs, reward, done, info = self.env.step(action)
+                env_end = clock() if clock is not None else 0
+                fluents = (
+                    self.fluent_extractor(obs, action)
+                    if executor is None
+                    else executor.submit(self.fluent_extractor, obs, action)
+                )
+                extractor_time = clock() - env_end if clock is not None else 0
+                pending.append(
+                    (fluents, obs, reward, done, info, env_end - start, extractor_time)
+                )
+                if len(pending) >= self.pipeline_depth or executor is None:
+                    complete_oldest()
+                if done:
+                    break
+            while pending:
+                complete_oldest()
+        finally:
+            for fluents, _, _, _, _, _, _ in pending:
+                if executor is not None:
+                    cast(Future, fluents).cancel()
+        return transitions
+
+    def _advance(
+        self, fluents: Any, done: bool, info: dict, env_time: int, extractor_time: int
+    ) -> Tuple[Any, float]:
+        """
+        Advance the temporal goals, and record the step with the trace recorder and the profiler.
+
+        :param fluents: the output of the fluent extractor.
+        :param done: whether the step is the last one of the episode.
+        :param info: the info dictionary of the step, where the timings are exported.
+        :param env_time: the time spent in the environment step, in nanoseconds.
+        :param extractor_time: the time spent in the fluent extractor, in nanoseconds.
+        :return: the next automaton states and the sum of the rewards of the temporal goals.
+        """
+        profiler = self.profiler
+        clock = time.perf_counter_ns if profiler is not None else None
+        if self.trace_recorder is None:
+            result = self._advance_goals(fluents, done, clock)
+        else:
+            result = self._advance_goals_recorded(
+                fluents, done, self.trace_recorder, clock
+            )
+        if profiler is not None:
+            controller_time, reward_machines_time = self._advance_timings
+            timings = {
+                ENV_PHASE: env_time,
+                FLUENT_EXTRACTOR_PHASE: extractor_time,
+                STEP_CONTROLLER_PHASE: controller_time,
+                REWARD_MACHINES_PHASE: reward_machines_time,
+            }
+            profiler.record(timings, tuple(self._goal_transitions))
+            if profiler.export_to_info:
+                info[INFO_KEY] = timings
+        return result
+
+    def _advance_goals(
+        self, fluents: Any, done: bool, clock: Optional[Callable[[], int]] = None
+    ) -> Tuple[Any, float]:
+        """
+        Advance the temporal goals, given the output of the fluent extractor.
+
+        The next automaton states are written into a buffer that is reused at every
+        step, so that no container is allocated when the temporal goals are stepped separately.
+        The temporal goals that the step controller does not allow to step are skipped
+        (see TemporalGoal.skip).
+
+        :param fluents: the output of the fluent extractor.
+        :param done: whether the step is the last one of the episode.
+        :param clock: if provided, the clock used to measure the time spent in the step
+          controller and in the reward machines, in nanoseconds, which is written
+          into the reused buffer of the timings.
+        :return: the next automaton states and the sum of the rewards of the temporal goals.
+        """
+        vocabulary = self.vocabulary
+        mask = vocabulary.to_bitmask(fluents) if vocabulary is not None else 0
+        start = controller_end = controller_time = reward_machines_time = 0
+        if self._product_simulator is not None:
+            if clock is not None:
+                start = clock()
+            result = self._step_product(self._product_simulator, fluents, mask, done)
+            if clock is not None:
+                self._advance_timings[:] = (0, clock() - start)
+            return result
+        step_controller = self.step_controller
+        automata_states = self._automata_states
+        goal_rewards = self._goal_rewards
+        goal_transitions = self._goal_transitions
+        goal_reward = 0.0
+        for i, tg in enumerate(self.temp_goals):
+            if clock is not None:
+                start = clock()
+            allowed = (
+                step_controller.step(fluents)
+                if vocabulary is None
+                else step_controller.step_bitmask(mask, vocabulary)
+            )
+            if clock is not None:
+                controller_end = clock()
+                controller_time += controller_end - start
+            if allowed:
+                automata_states[i], reward = (
+                    tg.step(fluents, done)
+                    if vocabulary is None
+                    else tg.step_bitmask(mask, vocabulary, done)
+                )
+            else:
+                automata_states[i], reward = tg.skip(done)
+            goal_reward += reward
+            goal_rewards[i] = reward
+            goal_transitions[i] = bool(allowed)
+            if clock is not None:
+                reward_machines_time += clock() - controller_end
+        if clock is not None:
+            self._advance_timings[:] = (controller_time, reward_machines_time)
+        return automata_states, goal_reward
+
+    def _step_product(
+        self, simulator: RewardMachineSimulator, fluents: Any, mask: int, done: bool
+    ) -> Tuple[Any, float]:
+        """
+        Step the product of the temporal goals, and synchronize the temporal goals.
+
+        :param simulator: the simulator of the product.
+        :param fluents: the output of the fluent extractor.
+        :param mask: the bitmask of the fluents, if a fluent vocabulary is set.
+        :param done: whether the step is the last one of the episode.
+        :return: the next automaton states and the sum of the rewards of the temporal goals.
+        """
+        vocabulary = self.vocabulary
+        if vocabulary is None:
+            next_automata_states, goal_reward = simulator.step(fluents)
+        else:
+            next_automata_states, goal_reward = simulator.step_bitmask(mask, vocabulary)
+        for tg, state in zip(self.temp_goals, cast(tuple, next_automata_states)):
+            tg.current_state = state
+        if done and self._product_terminal_potentials is not None:
+            # the shaped table adds the discounted potential of the successor
+            goal_reward -= self._product_terminal_potentials[next_automata_states]
+        return next_automata_states, goal_reward
+
+    def _get_product_reward_tables(
+        self, product: CompiledRewardMachine
+    ) -> List[np.ndarray]:
+        """
+        Get the reward tables of the temporal goals over the product, built at the first call.
+
+        :param product: the product of the temporal goals.
+        :return: the table of the rewards of every temporal goal (including the shaping reward,
+          if enabled, before the end of the episode), indexed by the product state ids
+          and the bitmasks over the product fluents.
+        """
+        if self._product_reward_tables is None:
+            tables = []
+            for index, tg in enumerate(self.temp_goals):
+                component = (
+                    tg.automaton
+                    if isinstance(tg.automaton, CompiledRewardMachine)
+                    else CompiledRewardMachine.from_reward_machine(tg.automaton)
+                )
+                state_ids, next_state_ids, rewards = get_component_tables(
+                    product, component, index
+                )
+                if tg.shaping is not None:
+                    potentials = np.asarray(
+                        [
+                            tg.shaping.potential(component.get_state(state_id))
+                            for state_id in range(len(component.states))
+                        ]
+                    )
+                    rewards = (
+                        rewards
+                        + tg.shaping.discount * potentials[next_state_ids]
+                        - potentials[state_ids][:, None]
+                    )
+                tables.append(rewards)
+            self._product_reward_tables = tables
+        return self._product_reward_tables
+
+    def _advance_goals_recorded(
+        self,
+        fluents: Any,
+        done: bool,
+        recorder: TraceRecorder,
+        clock: Optional[Callable[[], int]] = None,
+    ) -> Tuple[Any, float]:
+        """
+        Advance the temporal goals as '_advance_goals', and record the step.
+
+        :param fluents: the output of the fluent extractor.
+        :param done: whether the step is the last one of the episode.
+        :param recorder: the trace recorder.
+        :param clock: if provided, the clock passed to '_advance_goals'.
+        :return: the next automaton states and the sum of the rewards of the temporal goals.
+        """
+        simulator = self._product_simulator
+        product_state_id = (
+            cast(CompiledRewardMachine, simulator.reward_machine).get_state_id(
+                simulator.current_state
+            )
+            if simulator is not None
+            else 0
+        )
+        next_automata_states, goal_reward = self._advance_goals(fluents, done, clock)
+        vocabulary = self.vocabulary
+        if vocabulary is None:
+            mask = recorder.vocabulary.encode(fluents)
+        else:
+            mask = vocabulary.to_bitmask(fluents)
+        if simulator is not None:
+            # the product only gives the sum of the rewards of the temporal goals
+            product = cast(CompiledRewardMachine, simulator.reward_machine)
+            product_mask = (
+                product.encode(fluents)
+                if vocabulary is None
+                else product.translate(mask, vocabulary)
+            )
+            for i, (tg, table) in enumerate(
+                zip(self.temp_goals, self._get_product_reward_tables(product))
+            ):
+                reward = float(table[product_state_id, product_mask])
+                if done and tg.shaping is not None:
+                    reward -= tg.shaping.discount * tg.shaping.potential(
+                        tg.current_state
+                    )
+                self._goal_rewards[i] = reward
+        if vocabulary is not None:
+            mask = vocabulary.get_translator(recorder.vocabulary)(mask)
+        recorder.record(
+            self._fill_state_indices(next_automata_states),
+            self._goal_rewards,
+            mask,
+            self._goal_transitions,
+        )
+        if done:
+            recorder.end_episode()
+        return next_automata_states, goal_reward
 
     def reset(self, **kwargs) -> Observation:
         """
@@ -154,6 +973,12 @@ class TemporalGoalWrapper(gym.Wrapper):
         obs = super().reset(**kwargs)
         for tg in self.temp_goals:
             tg.reset()
-        automata_states = [tg.current_state for tg in self.temp_goals]
+        if self._product_simulator is not None:
+            self._product_simulator.reset()
+            automata_states = list(cast(tuple, self._product_simulator.current_state))
+        else:
+            automata_states = [tg.current_state for tg in self.temp_goals]
         self.step_controller.reset()
-        return obs, automata_states
+        if self.trace_recorder is not None:
+            self.trace_recorder.end_episode()
+        return self._make_observation(obs, automata_states)
@@ -0,0 +1,95 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Tests for `temprl.fluents` module."""
+import numpy as np
+import pytest
+
+from temprl.fluents import FluentVocabulary, SetToBitmaskFluentExtractor
+
+
+def test_encode_decode() -> None:
+    """Test the encoding of interpretations into bitmasks and back."""
+    vocabulary = FluentVocabulary(["a", "b", "c"])
+    assert len(vocabulary) == 3
+    assert vocabulary.index("c") == 2
+    assert vocabulary.encode({"a", "c", "unknown"}) == 0b101
+    assert vocabulary.decode(0b101) == {"a", "c"}
+    assert vocabulary == FluentVocabulary(("a", "b", "c"))
+    assert vocabulary != FluentVocabulary(["b", "a", "c"])
+
+
+def test_to_bitmask() -> None:
+    """Test the conversion of the outputs of bitmask fluent extractors."""
+    vocabulary = FluentVocabulary(["a", "b", "c"])
+    assert vocabulary.to_bitmask(0b110) == 0b110
+    assert vocabulary.to_bitmask(np.int32(0b110)) == 0b110
+    assert vocabulary.to_bitmask(np.array([True, False, True])) == 0b101
+
+
+@pytest.mark.parametrize("nb_fluents", [4, 20])
+def test_translator(nb_fluents: int) -> None:
+    """Test the translation of bitmasks between vocabularies."""
+    source = FluentVocabulary([f"f{i}" for i in range(nb_fluents)])
+    target = FluentVocabulary(["x", "f2", "f0", f"f{nb_fluents - 1}"])
+    translator = source.get_translator(target)
+    assert source.get_translator(target) is translator
+    assert source.get_translator(FluentVocabulary(source.fluents))(0b101) == 0b101
+    rng = np.random.default_rng(42)
+    for mask in rng.integers(0, 1 << nb_fluents, size=100).tolist():
+        assert translator(mask) == target.encode(source.decode(mask))
+    for mask in range(1 << len(target)):
+        assert target.get_translator(source)(mask) == source.encode(target.decode(mask))
+
+
+def test_large_vocabulary() -> None:
+    """Test that bitmasks over more than 63 fluents are exact."""
+    source = FluentVocabulary([f"f{i}" for i in range(100)])
+    target = FluentVocabulary(list(reversed(source.fluents)))
+    rng = np.random.default_rng(42)
+    fluent_matrix = rng.random((20, len(source))) < 0.5
+    fluent_matrix[0] = False
+    fluent_matrix[0, [63, 70, 99]] = True
+    masks = source.to_bitmasks(fluent_matrix)
+    assert masks[0] == (1 << 63) | (1 << 70) | (1 << 99)
+    for row, mask in zip(fluent_matrix, masks):
+        expected = {f for f, value in zip(source.fluents, row) if value}
+        assert source.to_bitmask(row) == mask
+        assert source.decode(mask) == expected
+        assert target.decode(source.get_translator(target)(mask)) == expected
+        assert target.get_translator(source)(target.encode(expected)) == mask
+
+
+def test_invalid_vocabulary() -> None:
+    """Test that vocabularies with repeated fluents or unknown fluents are rejected."""
+    with pytest.raises(ValueError, match="not unique"):
+        FluentVocabulary(["a", "a"])
+    with pytest.raises(ValueError, match="does not belong"):
+        FluentVocabulary(["a"]).index("b")
+
+
+def test_set_to_bitmask_adapter() -> None:
+    """Test the adapter from set-based to bitmask fluent extractors."""
+    vocabulary = FluentVocabulary(["s0", "s1"])
+    extractor = SetToBitmaskFluentExtractor(lambda obs, action: {f"s{obs}"}, vocabulary)
+    assert extractor(1, None) == 0b10
+    assert extractor(2, None) == 0
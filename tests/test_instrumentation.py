@@ -0,0 +1,126 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Tests for `temprl.instrumentation` module."""
+import pytest
+
+from temprl.instrumentation import INFO_KEY, PHASES, StepProfiler
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.step_controllers.stateless import StatelessStepController
+from temprl.traces import TraceRecorder, load_trace
+from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
+from tests.utils import GymTestEnv, build_test_automaton
+
+
+def test_step_profiler_record() -> None:
+    """Test that the profiler accumulates the timings into histograms."""
+    recorded = []
+    profiler = StepProfiler(
+        nb_buckets=4, callback=lambda timings, transitions: recorded.append(timings)
+    )
+    timings = dict(zip(PHASES, [0, 1, 3, 100]))
+    profiler.record(timings, [True])
+    profiler.record(timings, [False, True])
+    assert profiler.nb_steps == 2
+    assert profiler.goal_transitions == [1, 1]
+    assert profiler.histogram("env").tolist() == [2, 0, 0, 0]
+    assert profiler.histogram("fluent_extractor").tolist() == [0, 2, 0, 0]
+    assert profiler.histogram("step_controller").tolist() == [0, 0, 2, 0]
+    # larger latencies are counted in the last bucket
+    assert profiler.histogram("reward_machines").tolist() == [0, 0, 0, 2]
+    assert recorded == [timings, timings]
+
+    summary = profiler.summary()
+    assert summary["nb_steps"] == 2
+    assert summary["phases"]["reward_machines"]["total_ns"] == 200
+    assert summary["phases"]["reward_machines"]["mean_ns"] == 100.0
+
+    profiler.reset()
+    assert profiler.nb_steps == 0
+    assert not profiler.goal_transitions
+    assert profiler.histogram("env").sum() == 0
+
+
+def test_step_profiler_invalid_nb_buckets() -> None:
+    """Test that a non-positive number of buckets is rejected."""
+    with pytest.raises(ValueError, match="must be positive"):
+        StepProfiler(nb_buckets=0)
+
+
+@pytest.mark.parametrize("product", [False, True])
+def test_wrapper_with_profiler(product: bool) -> None:
+    """Test that the instrumented wrapper gives the same results and records the steps."""
+
+    def make_wrapper(profiler=None):
+        return TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [
+                TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+                TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0)),
+            ],
+            lambda obs, action: {f"s{obs}"},
+            # the product is only used with the default step controller
+            step_controller=None
+            if product
+            else StatelessStepController(
+                lambda fluents: fluents != {"s1"}, allow_first=False
+            ),
+            product=product,
+            profiler=profiler,
+        )
+
+    profiler = StepProfiler(export_to_info=True)
+    reference, instrumented = make_wrapper(), make_wrapper(profiler)
+    assert reference.reset() == instrumented.reset()
+    actions = [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2]
+    for action in actions:
+        obs, reward, done, info = instrumented.step(action)
+        assert (obs, reward, done) == reference.step(action)[:3]
+        assert set(info[INFO_KEY]) == set(PHASES)
+        assert all(duration >= 0 for duration in info[INFO_KEY].values())
+    assert profiler.nb_steps == len(actions)
+    # the observation is s1 after the first, the sixth and the eighth action
+    expected_transitions = len(actions) if product else len(actions) - 3
+    assert profiler.goal_transitions == [expected_transitions] * 2
+
+
+def test_step_many_with_profiler_and_trace_recorder(tmp_path) -> None:
+    """Test that the steps of 'step_many' are profiled, also while recording a trace."""
+    profiler = StepProfiler(export_to_info=True)
+    recorder = TraceRecorder(
+        tmp_path / "trace", [f"s{i}" for i in range(5)], nb_goals=1
+    )
+    wrapper = TemporalGoalWrapper(
+        GymTestEnv(n_states=5),
+        [TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0))],
+        lambda obs, action: {f"s{obs}"},
+        profiler=profiler,
+        trace_recorder=recorder,
+    )
+    wrapper.reset()
+    actions = [2, 2, 2, 0, 1, 1, 1]
+    transitions = wrapper.step_many(actions)
+    assert profiler.nb_steps == len(transitions) == len(actions)
+    assert profiler.goal_transitions == [len(actions)]
+    assert all(set(info[INFO_KEY]) == set(PHASES) for _, _, _, info in transitions)
+    recorder.close()
+    assert len(load_trace(tmp_path / "trace").steps) == len(actions)
@@ -0,0 +1,285 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Tests for `temprl.relabeling` module."""
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Tuple, cast
+
+import numpy as np
+import pytest
+from pythomata.impl.symbolic import SymbolicDFA
+
+import temprl.relabeling
+from temprl.relabeling import (
+    RelabelingOptions,
+    TrajectoryRelabeler,
+    iter_array_chunks,
+    iter_interpretation_chunks,
+    load_relabeled_dataset,
+    relabel_dataset,
+    split_episodes,
+)
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.step_controllers.base import AbstractStepController
+from temprl.step_controllers.compiled import CompiledStatefulStepController
+from temprl.step_controllers.stateful import StatefulStepController
+from temprl.step_controllers.stateless import StatelessStepController
+from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
+from tests.utils import GymTestEnv, build_eventually_automaton, build_test_automaton
+
+FLUENTS = [f"s{i}" for i in range(5)]
+
+
+def make_reward_machines():
+    """Make the reward machines used in the tests."""
+    return [
+        RewardAutomaton(build_test_automaton(), 10.0),
+        RewardAutomaton(build_test_automaton(), 1.0),
+    ]
+
+
+def is_not_s1(fluents) -> bool:
+    """Check that the fluents are not {s1}."""
+    return fluents != {"s1"}
+
+
+def make_step_controller():
+    """Make the step controller used in the tests."""
+    return StatelessStepController(is_not_s1, allow_first=False)
+
+
+def record_trajectories(
+    nb_transitions: int,
+    reward_machines: Optional[Sequence[AbstractRewardMachine]] = None,
+    step_controller: Optional[AbstractStepController] = None,
+):
+    """
+    Record trajectories with the wrapper, together with the expected labels.
+
+    By default, the reward machines and the step controller used in the tests.
+    """
+    wrapper = TemporalGoalWrapper(
+        GymTestEnv(n_states=5),
+        [TemporalGoal(rm) for rm in reward_machines or make_reward_machines()],
+        lambda obs, action: {f"s{obs}"},
+        step_controller=step_controller or make_step_controller(),
+    )
+    # a copy of the environment, to compute the rewards of the environment alone
+    env = GymTestEnv(n_states=5)
+    rng = np.random.default_rng(42)
+    observations, dones, states, goal_rewards = [], [], [], []
+    wrapper.reset()
+    env.reset()
+    for _ in range(nb_transitions):
+        action = int(rng.integers(0, 3))
+        observation, reward, done, _ = wrapper.step(action)
+        obs, automata_states = cast(Tuple[int, Tuple[int, ...]], observation)
+        _, env_reward, _, _ = env.step(action)
+        observations.append(obs)
+        dones.append(done)
+        states.append(automata_states)
+        goal_rewards.append(reward - env_reward)
+        if done:
+            wrapper.reset()
+            env.reset()
+    fluent_matrix = np.arange(5) == np.asarray(observations)[:, None]
+    return fluent_matrix, np.asarray(dones), np.asarray(states), goal_rewards
+
+
+def test_relabeling_matches_wrapper() -> None:
+    """Test that relabeling in chunks gives the same labels as the wrapper."""
+    fluent_matrix, dones, expected_states, expected_rewards = record_trajectories(500)
+    assert dones.sum() > 1
+    relabeler = TrajectoryRelabeler(
+        make_reward_machines(), FLUENTS, step_controller=make_step_controller()
+    )
+    results = list(relabeler.relabel(iter_array_chunks(fluent_matrix, dones, 7)))
+    assert len(results) == 72
+    states = np.concatenate([states for states, _ in results])
+    rewards = np.concatenate([rewards for _, rewards in results])
+    assert states.tolist() == expected_states.tolist()
+    assert rewards.sum(axis=1).tolist() == expected_rewards
+
+
+def build_alternating_acceptor() -> SymbolicDFA:
+    """Build an acceptor whose state alternates at every step, so that it is stepped in turn."""
+    dfa = SymbolicDFA()
+    dfa.create_state()
+    dfa.add_transition((0, "true", 1))
+    dfa.add_transition((1, "true", 0))
+    dfa.set_accepting_state(1, True)
+    return dfa
+
+
+@pytest.mark.parametrize(
+    "make_controller",
+    [
+        lambda: StatefulStepController(build_alternating_acceptor()),
+        lambda: CompiledStatefulStepController(build_alternating_acceptor()),
+        lambda: StatelessStepController(is_not_s1),
+    ],
+)
+def test_relabeling_queries_step_controller_per_goal(
+    make_controller: Callable[[], AbstractStepController]
+) -> None:
+    """Test that the step controller is queried once per reward machine, as by the wrapper."""
+    reward_machines = make_reward_machines() + [
+        RewardAutomaton(build_eventually_automaton("s3"), 5.0)
+    ]
+    fluent_matrix, dones, expected_states, expected_rewards = record_trajectories(
+        300, reward_machines, make_controller()
+    )
+    relabeler = TrajectoryRelabeler(
+        reward_machines, FLUENTS, step_controller=make_controller()
+    )
+    states, rewards = relabeler.relabel_chunk(fluent_matrix, dones)
+    assert states.tolist() == expected_states.tolist()
+    assert rewards.sum(axis=1).tolist() == expected_rewards
+
+
+def test_relabeling_memory_mapped(tmp_path: Path) -> None:
+    """Test relabeling of memory-mapped arrays."""
+    fluent_matrix, dones, expected_states, _ = record_trajectories(100)
+    np.save(tmp_path / "fluents.npy", fluent_matrix)
+    np.save(tmp_path / "dones.npy", dones)
+    relabeler = TrajectoryRelabeler(
+        make_reward_machines(), FLUENTS, step_controller=make_step_controller()
+    )
+    chunks = iter_array_chunks(
+        np.load(tmp_path / "fluents.npy", mmap_mode="r"),
+        np.load(tmp_path / "dones.npy", mmap_mode="r"),
+        chunk_size=16,
+    )
+    states = np.concatenate([states for states, _ in relabeler.relabel(chunks)])
+    assert states.tolist() == expected_states.tolist()
+
+
+def test_relabeling_interpretations() -> None:
+    """Test relabeling of a stream of interpretations, without a step controller."""
+    transitions = [({"s3"}, False), ({"s0"}, False), ({"s4", "x"}, True), (set(), True)]
+    chunks = list(iter_interpretation_chunks(transitions, FLUENTS, chunk_size=3))
+    assert [len(dones) for _, dones in chunks] == [3, 1]
+    assert chunks[0][0][2].tolist() == [False, False, False, False, True]
+    relabeler = TrajectoryRelabeler(make_reward_machines(), FLUENTS)
+    states, rewards = zip(*relabeler.relabel(chunks))
+    assert np.concatenate(states).tolist() == [[1, 1], [2, 2], [3, 3], [0, 0]]
+    assert np.concatenate(rewards)[:, 0].tolist() == [0.0, 0.0, 10.0, 0.0]
+    assert relabeler.current_state_ids == [0, 0]
+
+
+def test_relabeling_errors() -> None:
+    """Test that invalid inputs are rejected."""
+    with pytest.raises(ValueError, match="are not provided"):
+        TrajectoryRelabeler(make_reward_machines(), ["s0"])
+    with pytest.raises(ValueError, match="episode flags"):
+        list(iter_array_chunks(np.zeros((2, 5)), np.zeros(3)))
+    relabeler = TrajectoryRelabeler(make_reward_machines(), FLUENTS)
+    with pytest.raises(ValueError, match="episode flags"):
+        relabeler.relabel_chunk(np.zeros((2, 5)), np.zeros(3))
+
+
+def test_split_episodes() -> None:
+    """Test the split of a dataset into shards of whole episodes."""
+    dones = np.array([0, 1, 0, 0, 1, 1, 0, 0, 0, 1, 0], dtype=bool)
+    assert split_episodes(dones, 1) == [(0, 2), (2, 5), (5, 6), (6, 10), (10, 11)]
+    assert split_episodes(dones, 3) == [(0, 5), (5, 10), (10, 11)]
+    assert split_episodes(dones, 100) == [(0, 11)]
+    assert not split_episodes(np.zeros(0, dtype=bool), 3)
+
+
+@pytest.mark.parametrize("nb_workers", [0, 2])
+def test_relabel_dataset(tmp_path: Path, nb_workers: int) -> None:
+    """Test that the parallel relabeling gives the same labels as the sequential one."""
+    fluent_matrix, dones, expected_states, _ = record_trajectories(300)
+    np.save(tmp_path / "fluents.npy", fluent_matrix)
+    np.save(tmp_path / "dones.npy", dones)
+    index = relabel_dataset(
+        make_reward_machines(),
+        FLUENTS,
+        tmp_path / "fluents.npy",
+        tmp_path / "dones.npy",
+        tmp_path / "output",
+        options=RelabelingOptions(
+            step_controller=make_step_controller(),
+            nb_workers=nb_workers,
+            shard_size=40,
+            chunk_size=16,
+        ),
+    )
+    assert len(index["shards"]) > 2
+    assert index["nb_transitions"] == 300
+    states, rewards = load_relabeled_dataset(tmp_path / "output")
+    assert states.tolist() == expected_states.tolist()
+
+    relabeler = TrajectoryRelabeler(
+        make_reward_machines(), FLUENTS, step_controller=make_step_controller()
+    )
+    _, expected_rewards = relabeler.relabel_chunk(fluent_matrix, dones)
+    assert rewards.tolist() == expected_rewards.tolist()
+
+
+def test_relabel_dataset_in_memory(tmp_path: Path) -> None:
+    """Test the parallel relabeling of in-memory arrays."""
+    fluent_matrix, dones, expected_states, _ = record_trajectories(100)
+    relabel_dataset(
+        make_reward_machines(),
+        FLUENTS,
+        fluent_matrix,
+        dones,
+        tmp_path,
+        options=RelabelingOptions(
+            step_controller=make_step_controller(), nb_workers=2, shard_size=30
+        ),
+    )
+    states, _ = load_relabeled_dataset(tmp_path)
+    assert states.tolist() == expected_states.tolist()
+
+
+def test_relabel_dataset_in_memory_sends_shard_rows(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the task of a shard of in-memory arrays only carries the rows of the shard."""
+    fluent_matrix, dones, _, _ = record_trajectories(100)
+    relabel_shard = temprl.relabeling._relabel_shard  # pylint: disable=protected-access
+    nb_rows = []
+
+    def record_shard(task) -> None:
+        nb_rows.append(
+            (task.end - task.start, len(task.fluent_matrix), len(task.dones))
+        )
+        relabel_shard(task)
+
+    monkeypatch.setattr(temprl.relabeling, "_relabel_shard", record_shard)
+    relabel_dataset(
+        make_reward_machines(),
+        FLUENTS,
+        fluent_matrix,
+        dones,
+        tmp_path,
+        options=RelabelingOptions(nb_workers=1, shard_size=30),
+    )
+    assert len(nb_rows) > 1
+    assert all(
+        size == nb_fluent_rows == nb_dones for size, nb_fluent_rows, nb_dones in nb_rows
+    )
+    assert sum(size for size, _, _ in nb_rows) == len(dones)
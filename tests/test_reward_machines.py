@@ -0,0 +1,708 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Tests for `temprl.reward_machines` package."""
+import itertools
+import math
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Tuple, cast
+
+import numpy as np
+import pytest
+from pythomata.impl.symbolic import SymbolicDFA
+
+from temprl.fluents import FluentVocabulary
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.reward_machines.base import AbstractRewardMachine
+from temprl.reward_machines.cached import CachedRewardMachine
+from temprl.reward_machines.compiled import CompiledRewardMachine, compute_fingerprint
+from temprl.reward_machines.kernels import NUMBA_AVAILABLE, run_reward_machine
+from temprl.reward_machines.lazy import ExplorationInfo, LazyRewardMachine
+from temprl.reward_machines.minimization import minimize_reward_machine
+from temprl.reward_machines.product import (
+    build_product_reward_machine,
+    get_component_tables,
+)
+from temprl.reward_machines.serialization import (
+    load_compiled_reward_machine,
+    read_fingerprint,
+    save_compiled_reward_machine,
+)
+from temprl.reward_machines.shaping import (
+    PotentialShaping,
+    compute_distances_to_acceptance,
+    get_distances_to_acceptance,
+)
+from temprl.types import State
+from temprl.wrapper import TemporalGoal
+from tests.utils import build_eventually_automaton, build_test_automaton
+
+FLUENTS = ["s0", "s1", "s2", "s3", "s4"]
+
+
+def all_interpretations():
+    """Get all the interpretations over the test fluents."""
+    for size in range(len(FLUENTS) + 1):
+        for combination in itertools.combinations(FLUENTS, size):
+            yield frozenset(combination)
+
+
+class TestCompiledRewardMachine:
+    """Tests for CompiledRewardMachine."""
+
+    reward_automaton: RewardAutomaton
+    compiled: CompiledRewardMachine
+
+    @classmethod
+    def setup_class(cls) -> None:
+        """Set the tests up."""
+        cls.reward_automaton = RewardAutomaton(build_test_automaton(), 10.0)
+        cls.compiled = CompiledRewardMachine.from_reward_machine(cls.reward_automaton)
+
+    def test_structure(self) -> None:
+        """Test the compiled states, fluents and tables."""
+        assert self.compiled.states == self.reward_automaton.states
+        assert self.compiled.initial_state == self.reward_automaton.initial_state
+        assert self.compiled.fluents == ("s0", "s3", "s4")
+        nb_states = len(self.reward_automaton.states)
+        assert self.compiled.transitions.shape == (nb_states, 8)
+        assert self.compiled.rewards.shape == (nb_states, 8)
+        assert not self.compiled.transitions.flags.writeable
+        assert self.compiled.accepting_states == {3}
+        assert self.compiled.fingerprint == compute_fingerprint(self.reward_automaton)
+
+    def test_same_behaviour_as_source(self) -> None:
+        """Test that the compiled machine behaves as the source reward machine."""
+        for state in self.reward_automaton.states:
+            for symbol in all_interpretations():
+                assert self.compiled.get_successor(
+                    state, symbol
+                ) == self.reward_automaton.get_successor(state, symbol)
+                assert self.compiled.get_reward(
+                    state, symbol
+                ) == self.reward_automaton.get_reward(state, symbol)
+
+    def test_encode_decode(self) -> None:
+        """Test the encoding of interpretations into bitmasks."""
+        assert self.compiled.encode({"s0", "s4", "unknown"}) == 0b101
+        assert self.compiled.decode(0b101) == {"s0", "s4"}
+        state_id = self.compiled.get_state_id(2)
+        assert self.compiled.get_state(state_id) == 2
+        assert self.compiled.get_state(self.compiled.transitions[state_id, 0b100]) == 3
+
+    def test_transitions_from_table(self) -> None:
+        """Test that the transitions are derived from the table."""
+        transitions = self.compiled.get_transitions_from(3)
+        assert transitions == {(3, frozenset(all_masks_decoded(self.compiled)), 3)}
+
+    def test_transition(self) -> None:
+        """Test that 'transition' agrees with 'get_successor' and 'get_reward'."""
+        for state in self.reward_automaton.states:
+            for symbol in all_interpretations():
+                expected = (
+                    self.reward_automaton.get_successor(state, symbol),
+                    self.reward_automaton.get_reward(state, symbol),
+                )
+                assert self.reward_automaton.transition(state, symbol) == expected
+                assert self.compiled.transition(state, symbol) == expected
+
+    def test_transition_bitmask(self) -> None:
+        """Test transitions that read bitmasks over another vocabulary."""
+        vocabulary = FluentVocabulary(FLUENTS)
+        # the second round reads the transitions memoized by the reward automaton
+        for state in list(self.reward_automaton.states) * 2:
+            for symbol in all_interpretations():
+                mask = vocabulary.encode(symbol)
+                expected = self.reward_automaton.transition(state, symbol)
+                assert (
+                    self.reward_automaton.transition_bitmask(state, mask, vocabulary)
+                    == expected
+                )
+                assert (
+                    self.compiled.transition_bitmask(state, mask, vocabulary)
+                    == expected
+                )
+        assert self.compiled.translate(0b101, self.compiled.vocabulary) == 0b101
+        assert self.compiled.translate(0b1, FluentVocabulary(["s4"])) == 0b100
+
+    def test_unknown_state(self) -> None:
+        """Test that stepping from an unknown state raises an error."""
+        with pytest.raises(ValueError, match="does not belong"):
+            self.compiled.get_successor(42, set())
+
+
+def all_masks_decoded(compiled: CompiledRewardMachine):
+    """Decode all the bitmasks of a compiled reward machine."""
+    return [compiled.decode(mask) for mask in range(1 << len(compiled.fluents))]
+
+
+class _DelegatingRewardMachine(AbstractRewardMachine):
+    """A reward machine that does not override 'transition'."""
+
+    def __init__(self, reward_machine: AbstractRewardMachine):
+        """Initialize the reward machine."""
+        super().__init__()
+        self._reward_machine = reward_machine
+
+    @property
+    def states(self):
+        """Get the set of states."""
+        return self._reward_machine.states
+
+    @property
+    def initial_state(self):
+        """Get the initial state."""
+        return self._reward_machine.initial_state
+
+    def get_transitions_from(self, state):
+        """Get the outgoing transitions from a state."""
+        return self._reward_machine.get_transitions_from(state)
+
+    def get_reward(self, state, symbol):
+        """Get the reward associated to the transition."""
+        return self._reward_machine.get_reward(state, symbol)
+
+    def get_successor(self, state, symbol):
+        """Get the (unique) successor."""
+        return self._reward_machine.get_successor(state, symbol)
+
+
+def test_default_transition() -> None:
+    """Test the default implementation of 'transition'."""
+    reward_machine = _DelegatingRewardMachine(
+        RewardAutomaton(build_test_automaton(), 10.0)
+    )
+    assert reward_machine.transition(0, {"s3"}) == (1, 0.0)
+    assert reward_machine.transition(2, {"s4"}) == (3, 10.0)
+
+
+def test_compile_incomplete_automaton() -> None:
+    """Test that compiling an incomplete automaton fails."""
+    dfa = SymbolicDFA()
+    dfa.create_state()
+    dfa.add_transition((0, "a", 1))
+    dfa.add_transition((1, "true", 1))
+    dfa.set_accepting_state(1, True)
+    with pytest.raises(ValueError, match="must be complete"):
+        CompiledRewardMachine.from_reward_machine(RewardAutomaton(dfa, 1.0))
+
+
+def test_compile_too_many_fluents() -> None:
+    """Test that compiling over too many fluents fails."""
+    reward_machine = RewardAutomaton(build_test_automaton(), 1.0)
+    with pytest.raises(ValueError, match="cannot compile"):
+        CompiledRewardMachine.from_reward_machine(reward_machine, max_fluents=2)
+
+
+def test_invalid_tables() -> None:
+    """Test that invalid tables are rejected."""
+    with pytest.raises(ValueError, match="invalid state ids"):
+        CompiledRewardMachine([0], ["a"], 0, np.array([[0, 1]]), np.zeros((1, 2)))
+
+
+def test_cached_reward_machine() -> None:
+    """Test that the cached reward machine memoizes the transitions."""
+    reward_automaton = RewardAutomaton(build_test_automaton(), 10.0)
+    cached = CachedRewardMachine(reward_automaton, max_size=2)
+    assert cached.reward_machine is reward_automaton
+    assert cached.states == reward_automaton.states
+    assert cached.initial_state == reward_automaton.initial_state
+    assert cached.get_transitions_from(0) == reward_automaton.get_transitions_from(0)
+
+    assert cached.transition(2, {"s4"}) == (3, 10.0)
+    assert cached.get_successor(2, {"s4"}) == 3
+    assert cached.get_reward(2, frozenset({"s4"})) == 10.0
+    assert cached.cache_info() == (2, 1, 0, 2, 1)
+
+    assert cached.transition(0, {"s3"}) == (1, 0.0)
+    # (2, {s4}) is the least recently used entry, hence it is evicted
+    assert cached.transition(1, set()) == (1, 0.0)
+    assert cached.cache_info() == (2, 3, 1, 2, 2)
+    assert cached.transition(0, {"s3"}) == (1, 0.0)
+    assert cached.transition(2, {"s4"}) == (3, 10.0)
+    assert cached.cache_info().hits == 3
+    assert cached.cache_info().misses == 4
+
+    cached.cache_clear()
+    assert cached.cache_info() == (0, 0, 0, 2, 0)
+
+
+def test_cached_reward_machine_invalid_max_size() -> None:
+    """Test that a non-positive maximum size is rejected."""
+    with pytest.raises(ValueError, match="must be positive"):
+        CachedRewardMachine(RewardAutomaton(build_test_automaton(), 1.0), max_size=0)
+
+
+def test_product_reward_machine() -> None:
+    """Test that the product behaves as its components."""
+    components = [
+        RewardAutomaton(build_test_automaton(), 10.0),
+        RewardAutomaton(build_eventually_automaton("s2"), 1.0),
+    ]
+    product = build_product_reward_machine(components)
+    assert product.initial_state == (0, 0)
+    assert product.fluents == ("s0", "s2", "s3", "s4")
+    # only the reachable product states are built
+    diagonal = build_product_reward_machine([components[0], components[0]])
+    assert diagonal.states == {(q, q) for q in components[0].states}
+
+    rng = np.random.default_rng(42)
+    states = [c.initial_state for c in components]
+    product_state: State = product.initial_state
+    for _ in range(100):
+        symbol = frozenset(f for f in FLUENTS if rng.random() < 0.3)
+        transitions = [c.transition(q, symbol) for c, q in zip(components, states)]
+        states = [q for q, _ in transitions]
+        product_state, reward = product.transition(product_state, symbol)
+        assert product_state == tuple(states)
+        assert reward == sum(r for _, r in transitions)
+
+
+def test_component_tables() -> None:
+    """Test that the tables of a component are indexed by the product states and bitmasks."""
+    components = [
+        CompiledRewardMachine.from_reward_machine(
+            RewardAutomaton(build_test_automaton(), 10.0)
+        ),
+        CompiledRewardMachine.from_reward_machine(
+            RewardAutomaton(build_eventually_automaton("s2"), 1.0)
+        ),
+    ]
+    product = build_product_reward_machine(components)
+    for index, component in enumerate(components):
+        state_ids, next_state_ids, rewards = get_component_tables(
+            product, component, index
+        )
+        assert next_state_ids.shape == rewards.shape == product.transitions.shape
+        for product_state_id, state_id in enumerate(state_ids.tolist()):
+            state = cast(tuple, product.get_state(product_state_id))[index]
+            assert component.get_state(state_id) == state
+            for mask in range(1 << len(product.fluents)):
+                next_state, reward = component.transition(state, product.decode(mask))
+                assert (
+                    component.get_state(int(next_state_ids[product_state_id, mask]))
+                    == next_state
+                )
+                assert rewards[product_state_id, mask] == reward
+
+
+def test_product_too_large() -> None:
+    """Test that the product is not built when it exceeds the size limit."""
+    components = [RewardAutomaton(build_test_automaton(), 1.0)] * 2
+    with pytest.raises(ValueError, match="max size"):
+        build_product_reward_machine(components, max_size=16)
+    with pytest.raises(ValueError, match="no reward machines"):
+        build_product_reward_machine([])
+
+
+def test_fingerprint() -> None:
+    """Test that the fingerprint identifies the reward machine."""
+    automaton = build_test_automaton()
+    assert compute_fingerprint(RewardAutomaton(automaton, 1.0)) == compute_fingerprint(
+        RewardAutomaton(build_test_automaton(), 1.0)
+    )
+    assert compute_fingerprint(RewardAutomaton(automaton, 1.0)) != compute_fingerprint(
+        RewardAutomaton(automaton, 2.0)
+    )
+
+    # the fingerprint does not depend on the order of the states and of the fluents
+    compiled = CompiledRewardMachine.from_reward_machine(
+        RewardAutomaton(automaton, 1.0)
+    )
+    reordered = CompiledRewardMachine.from_reward_machine(
+        compiled, fluents=list(reversed(compiled.fluents))
+    )
+    assert reordered.fluents != compiled.fluents
+    assert reordered.fingerprint == compiled.fingerprint
+
+    # the rewards are part of the fingerprint, even without a 'reward' attribute
+    transitions = np.asarray([[0, 1], [1, 1]], dtype=np.int32)
+    fingerprints = {
+        CompiledRewardMachine(
+            ["q0", "q1"], ["a"], "q0", transitions, np.asarray(rewards)
+        ).fingerprint
+        for rewards in ([[0.0, 1.0], [0.0, 0.0]], [[0.0, 2.0], [0.0, 0.0]])
+    }
+    assert len(fingerprints) == 2
+
+
+def test_fingerprint_does_not_depend_on_hash_seed() -> None:
+    """Test that the fingerprint of a product reward machine is the same in every process."""
+    code = (
+        "from temprl.reward_machines.automata import RewardAutomaton\n"
+        "from temprl.reward_machines.product import build_product_reward_machine\n"
+        "from tests.utils import build_eventually_automaton, build_test_automaton\n"
+        "print(build_product_reward_machine([\n"
+        "    RewardAutomaton(build_test_automaton(), 1.0),\n"
+        "    RewardAutomaton(build_eventually_automaton('s2'), 2.0),\n"
+        "]).fingerprint)\n"
+    )
+    root = str(Path(__file__).parent.parent)
+    fingerprints = {
+        subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=root,
+            env=dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=root),
+        ).stdout.strip()
+        for seed in ("1", "2", "3")
+    }
+    assert len(fingerprints) == 1
+    assert len(fingerprints.pop()) == 64
+
+
+def test_save_load_compiled_reward_machine(tmp_path) -> None:
+    """Test that a saved compiled reward machine is loaded with memory-mapped tables."""
+    source = RewardAutomaton(build_test_automaton(), 10.0)
+    compiled = CompiledRewardMachine.from_reward_machine(source)
+    save_compiled_reward_machine(compiled, tmp_path / "rm")
+    assert read_fingerprint(tmp_path / "rm") == compiled.fingerprint
+    assert read_fingerprint(tmp_path / "missing") is None
+
+    loaded = load_compiled_reward_machine(
+        tmp_path / "rm", fingerprint=compiled.fingerprint
+    )
+    # the tables are views of the memory-mapped files, not copies
+    assert isinstance(loaded.transitions.base, np.memmap)
+    assert isinstance(loaded.rewards.base, np.memmap)
+    assert loaded.states == compiled.states
+    assert loaded.fluents == compiled.fluents
+    assert loaded.initial_state == compiled.initial_state
+    assert loaded.accepting_states == compiled.accepting_states
+    assert loaded.fingerprint == compiled.fingerprint
+    assert [compiled.get_state_id(q) for q in compiled.states] == [
+        loaded.get_state_id(q) for q in compiled.states
+    ]
+    np.testing.assert_array_equal(loaded.transitions, compiled.transitions)
+    np.testing.assert_array_equal(loaded.rewards, compiled.rewards)
+
+    in_memory = load_compiled_reward_machine(tmp_path / "rm", mmap_mode=None)
+    assert not isinstance(in_memory.transitions.base, np.memmap)
+    with pytest.raises(ValueError, match="fingerprint mismatch"):
+        load_compiled_reward_machine(tmp_path / "rm", fingerprint="0" * 64)
+
+
+def test_save_load_product_reward_machine(tmp_path) -> None:
+    """Test that reward machines with tuple states can be saved."""
+    component = RewardAutomaton(build_test_automaton(), 1.0)
+    product = build_product_reward_machine([component, component])
+    save_compiled_reward_machine(product, tmp_path)
+    loaded = load_compiled_reward_machine(tmp_path)
+    assert loaded.states == product.states
+    assert loaded.initial_state == (0, 0)
+    for state in product.states:
+        for mask in range(1 << len(product.fluents)):
+            assert loaded.transition_bitmask(
+                state, mask, loaded.vocabulary
+            ) == product.transition_bitmask(state, mask, product.vocabulary)
+
+
+def test_save_unserializable_states(tmp_path) -> None:
+    """Test that states that cannot be encoded in JSON are rejected."""
+    compiled = CompiledRewardMachine(
+        [frozenset()],
+        [],
+        frozenset(),
+        np.zeros((1, 1), dtype=np.int32),
+        np.zeros((1, 1)),
+    )
+    with pytest.raises(ValueError, match="cannot serialize"):
+        save_compiled_reward_machine(compiled, tmp_path)
+
+
+def test_lazy_reward_machine() -> None:
+    """Test that a lazy reward machine explores states and transitions on demand."""
+    calls = []
+
+    def count_s0(count, symbol):
+        calls.append((count, symbol))
+        successor = count + 1 if "s0" in symbol else count
+        return successor, 1.0 if successor == 3 and count == 2 else 0.0
+
+    lazy = LazyRewardMachine("start", lambda _, symbol: (0, 0.0), 1)
+    assert lazy.states == {0}
+    assert TemporalGoal(lazy).observation_space.n == 1
+
+    lazy = LazyRewardMachine(0, count_s0, max_nb_states=4)
+    assert TemporalGoal(lazy).observation_space.n == 4
+    assert lazy.exploration_info() == ExplorationInfo(1, 4, 0)
+    assert lazy.transition(0, {"s1"}) == (0, 0.0)
+    assert lazy.transition(0, {"s0"}) == (1, 0.0)
+    assert lazy.transition(0, {"s0"}) == (1, 0.0)
+    assert len(calls) == 2
+    assert lazy.get_transitions_from(0) == {
+        (0, frozenset({"s1"}), 0),
+        (0, frozenset({"s0"}), 1),
+    }
+
+    vocabulary = FluentVocabulary(["s0", "s1"])
+    assert lazy.transition_bitmask(1, 0b01, vocabulary) == (2, 0.0)
+    assert lazy.transition_bitmask(2, 0b11, vocabulary) == (3, 1.0)
+    assert lazy.transition_bitmask(2, 0b11, vocabulary) == (3, 1.0)
+    assert len(calls) == 4
+    assert lazy.get_automaton_state(3) == 3
+    assert lazy.get_state_id(3) == 3
+    assert lazy.states == {0, 1, 2, 3}
+    assert lazy.exploration_info() == ExplorationInfo(4, 4, 4)
+
+    with pytest.raises(ValueError, match="exceeds the declared bound"):
+        lazy.transition(3, {"s0"})
+    with pytest.raises(ValueError, match="has not been explored"):
+        lazy.transition(4, {"s0"})
+    with pytest.raises(ValueError, match="has not been explored"):
+        lazy.get_state_id(10)
+    with pytest.raises(ValueError, match="must be positive"):
+        LazyRewardMachine(0, count_s0, max_nb_states=0)
+    with pytest.raises(ValueError, match="cannot compile a lazy reward machine"):
+        build_product_reward_machine([lazy])
+
+
+def build_redundant_automaton() -> SymbolicDFA:
+    """Build an automaton for 'eventually a, then b' with redundant and unreachable states."""
+    dfa = SymbolicDFA()
+    for _ in range(4):
+        dfa.create_state()
+    # states 1 and 2 are equivalent, and state 4 is unreachable
+    dfa.add_transition((0, "a & c", 1))
+    dfa.add_transition((0, "a & ~c", 2))
+    dfa.add_transition((0, "~a", 0))
+    dfa.add_transition((1, "b", 3))
+    dfa.add_transition((1, "~b", 1))
+    dfa.add_transition((2, "b", 3))
+    dfa.add_transition((2, "~b", 2))
+    dfa.add_transition((3, "true", 3))
+    dfa.add_transition((4, "true", 0))
+    dfa.set_accepting_state(3, True)
+    return dfa
+
+
+def test_minimize_reward_machine() -> None:
+    """Test that the minimized reward machine behaves as the original one."""
+    source = RewardAutomaton(build_redundant_automaton(), 1.0)
+    minimized, mapping = minimize_reward_machine(source)
+    assert minimized.states == {0, 1, 2}
+    assert minimized.initial_state == 0
+    assert minimized.accepting_states == {2}
+    assert mapping == {0: 0, 1: 1, 2: 1, 3: 2}
+
+    rng = np.random.default_rng(42)
+    state: State = source.initial_state
+    minimized_state: State = minimized.initial_state
+    for _ in range(100):
+        symbol = frozenset(f for f in "abc" if rng.random() < 0.3)
+        state, reward = source.transition(state, symbol)
+        minimized_state, minimized_reward = minimized.transition(
+            minimized_state, symbol
+        )
+        assert mapping[state] == minimized_state
+        assert reward == minimized_reward
+
+    # the test automaton is already minimal
+    test_automaton = RewardAutomaton(build_test_automaton(), 1.0)
+    assert len(minimize_reward_machine(test_automaton)[0].states) == 5
+
+
+def test_minimize_takes_rewards_into_account() -> None:
+    """Test that states with the same acceptance but different rewards are not merged."""
+    transitions = np.asarray([[1, 2], [1, 1], [2, 2]], dtype=np.int32)
+    rewards = np.asarray([[0.0, 0.0], [1.0, 1.0], [2.0, 2.0]])
+    compiled = CompiledRewardMachine(
+        ["q0", "q1", "q2"], ["a"], "q0", transitions, rewards
+    )
+    minimized, mapping = minimize_reward_machine(compiled)
+    assert len(minimized.states) == 3
+    assert mapping == {"q0": 0, "q1": 1, "q2": 2}
+
+    rewards = np.asarray([[0.0, 0.0], [1.0, 1.0], [1.0, 1.0]])
+    compiled = CompiledRewardMachine(
+        ["q0", "q1", "q2"], ["a"], "q0", transitions, rewards
+    )
+    minimized, mapping = minimize_reward_machine(compiled)
+    assert len(minimized.states) == 2
+    assert mapping == {"q0": 0, "q1": 1, "q2": 1}
+    assert minimized.accepting_states is None
+
+
+def test_support() -> None:
+    """Test that interpretations are projected onto the support of the reward machines."""
+    automaton = RewardAutomaton(build_test_automaton(), 1.0)
+    assert automaton.support == {"s0", "s3", "s4"}
+    compiled = CompiledRewardMachine.from_reward_machine(automaton)
+    assert compiled.support == {"s0", "s3", "s4"}
+    lazy = LazyRewardMachine(0, lambda q, _: (q, 0.0), 1)
+    assert lazy.support is None
+
+    cached = CachedRewardMachine(automaton)
+    assert cached.support == automaton.support
+    global_fluents = [f"f{i}" for i in range(100)]
+    for fluent in global_fluents:
+        assert cached.transition(0, {"s3", fluent}) == (1, 0.0)
+    assert cached.cache_info().misses == 1
+
+
+def test_symbol_classes() -> None:
+    """Test that masks with the same projection onto the support share one cache entry."""
+    automaton = RewardAutomaton(build_test_automaton(), 1.0)
+    vocabulary = FluentVocabulary(FLUENTS + [f"f{i}" for i in range(100)])
+    mask = vocabulary.encode({"s3"})
+    other_mask = vocabulary.encode({"s1", "s3", "f70"})
+    symbol_classes = automaton.symbol_classes
+    assert symbol_classes is not None
+    assert symbol_classes.nb_classes == 8
+    class_id = symbol_classes.get_class_id_bitmask(mask, vocabulary)
+    assert symbol_classes.get_class_id_bitmask(other_mask, vocabulary) == class_id
+    assert symbol_classes.get_class_id({"s3", "f70"}) == class_id
+    assert symbol_classes.get_representative(class_id) == {"s3"}
+
+    cached = CachedRewardMachine(automaton)
+    assert cached.transition_bitmask(0, mask, vocabulary) == (1, 0.0)
+    assert cached.transition_bitmask(0, other_mask, vocabulary) == (1, 0.0)
+    assert cached.transition(0, {"s3", "f1"}) == (1, 0.0)
+    assert cached.cache_info().size == 1
+    assert cached.cache_info().misses == 1
+
+    calls = []
+
+    def read_s0(state, symbol):
+        calls.append(symbol)
+        return state, float("s0" in symbol)
+
+    lazy = LazyRewardMachine(0, read_s0, 1, support=["s0"])
+    assert lazy.support == {"s0"}
+    assert lazy.transition_bitmask(0, mask, vocabulary) == (0, 0.0)
+    assert lazy.transition_bitmask(0, other_mask, vocabulary) == (0, 0.0)
+    assert lazy.transition(0, {"s0", "s1"}) == (0, 1.0)
+    assert lazy.transition(0, {"s0"}) == (0, 1.0)
+    assert calls == [frozenset(), frozenset({"s0"})]
+    assert lazy.exploration_info().nb_transitions == 2
+
+
+def test_distances_to_acceptance() -> None:
+    """Test the distances to acceptance, and that they are cached per reward machine."""
+    automaton = RewardAutomaton(build_test_automaton(), 1.0)
+    distances = get_distances_to_acceptance(automaton)
+    assert distances == {0: 3, 1: 2, 2: 1, 3: 0, 4: math.inf}
+    assert get_distances_to_acceptance(automaton) is distances
+    compiled = CompiledRewardMachine.from_reward_machine(automaton)
+    assert compute_distances_to_acceptance(compiled) == distances
+
+    shaping = PotentialShaping(automaton, discount=0.9, scale=2.0)
+    assert [shaping.potential(q) for q in range(5)] == [-6, -4, -2, 0, -10]
+    assert shaping(2, 3) == 2.0
+    assert shaping(0, 0) == pytest.approx(0.6)
+
+    with pytest.raises(ValueError, match="accepting states"):
+        get_distances_to_acceptance(CachedRewardMachine(automaton))
+
+
+def run_in_two_parts(
+    compiled: CompiledRewardMachine,
+    masks: np.ndarray,
+    dones: np.ndarray,
+    allowed: np.ndarray,
+    use_jit: bool,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Run a compiled reward machine over the two halves of a sequence, carrying over the state."""
+    half = len(masks) // 2
+    first_states, first_rewards, state_id = run_reward_machine(
+        compiled,
+        masks[:half],
+        dones=dones[:half],
+        allowed=allowed[:half],
+        use_jit=use_jit,
+    )
+    second_states, second_rewards, _ = run_reward_machine(
+        compiled,
+        masks[half:],
+        dones=dones[half:],
+        allowed=allowed[half:],
+        state_id=state_id,
+        use_jit=use_jit,
+    )
+    return (
+        np.concatenate([first_states, second_states]),
+        np.concatenate([first_rewards, second_rewards]),
+    )
+
+
+@pytest.mark.parametrize(
+    "use_jit",
+    [
+        False,
+        pytest.param(
+            True,
+            marks=pytest.mark.skipif(not NUMBA_AVAILABLE, reason="numba not installed"),
+        ),
+    ],
+)
+def test_run_reward_machine(use_jit: bool) -> None:
+    """Test that the kernel behaves as stepping the reward machines one symbol at a time."""
+    components = [
+        RewardAutomaton(build_test_automaton(), 10.0),
+        RewardAutomaton(build_eventually_automaton("s2"), 1.0),
+    ]
+    rng = np.random.default_rng(42)
+    for reward_machine in [components[0], build_product_reward_machine(components)]:
+        compiled = CompiledRewardMachine.from_reward_machine(reward_machine)
+        masks = rng.integers(0, 1 << len(compiled.fluents), size=500)
+        dones = rng.random(500) < 0.05
+        allowed = rng.random(500) < 0.8
+        states, rewards, last_state_id = run_reward_machine(
+            compiled, masks, dones=dones, allowed=allowed, use_jit=use_jit
+        )
+        state = reward_machine.initial_state
+        for t, (mask, done, is_allowed) in enumerate(zip(masks, dones, allowed)):
+            reward = 0.0
+            if is_allowed:
+                symbol = compiled.decode(int(mask))
+                state, reward = reward_machine.transition(state, symbol)
+            assert compiled.get_state(int(states[t])) == state
+            assert rewards[t] == reward
+            if done:
+                state = reward_machine.initial_state
+        assert compiled.get_state(last_state_id) == state
+
+        # the sequence can be split, and the kernels give the same results
+        for other_states, other_rewards, *_ in [
+            run_in_two_parts(compiled, masks, dones, allowed, use_jit),
+            run_reward_machine(
+                compiled, masks, dones=dones, allowed=allowed, use_jit=False
+            ),
+        ]:
+            np.testing.assert_array_equal(other_states, states)
+            np.testing.assert_array_equal(other_rewards, rewards)
+
+    with pytest.raises(ValueError, match="episode flags"):
+        run_reward_machine(components[0], np.asarray([0, 1]), dones=np.asarray([False]))
+
+
+@pytest.mark.skipif(NUMBA_AVAILABLE, reason="numba installed")
+def test_run_reward_machine_without_numba() -> None:
+    """Test that the JIT-compiled kernel cannot be requested without numba."""
+    with pytest.raises(ValueError, match="requires numba"):
+        run_reward_machine(
+            RewardAutomaton(build_test_automaton(), 1.0), np.asarray([0]), use_jit=True
+        )
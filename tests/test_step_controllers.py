@@ -20,10 +20,22 @@
 #
 
 """Tests for `temprl.step_controllers` package."""
+import itertools
+
+import numpy as np
+import pytest
 from pythomata.impl.symbolic import SymbolicDFA
 
+from temprl.fluents import FluentVocabulary
+from temprl.step_controllers.compiled import (
+    BatchedCompiledStatefulStepController,
+    CompiledStatefulStepController,
+)
 from temprl.step_controllers.stateful import StatefulStepController
-from temprl.step_controllers.stateless import StatelessStepController
+from temprl.step_controllers.stateless import (
+    BatchedStatelessStepController,
+    StatelessStepController,
+)
 
 
 def test_stateless_step_controller_when_not_started_and_not_allow_first() -> None:
@@ -54,3 +66,135 @@ def test_stateful_step_controller() -> None:
     # after reset, we are in the initial state
     sc.reset()
     assert not sc.step(set())
+
+
+def build_acceptor() -> SymbolicDFA:
+    """Build an acceptor that accepts after 'a', and fails if 'b' occurs before."""
+    dfa = SymbolicDFA()
+    dfa.create_state()
+    dfa.add_transition((0, "a", 1))
+    dfa.add_transition((0, "~a & ~b", 0))
+    dfa.add_transition((1, "true", 1))
+    dfa.set_accepting_state(1, True)
+    return dfa
+
+
+def test_compiled_stateful_step_controller() -> None:
+    """Test that CompiledStatefulStepController behaves as StatefulStepController."""
+    symbols = [set(), {"b"}, {"a"}, {"a", "b"}, {"c"}]
+    for trace in itertools.product(symbols, repeat=3):
+        expected = StatefulStepController(build_acceptor())
+        compiled = CompiledStatefulStepController(build_acceptor())
+        for symbol in trace:
+            result = compiled.step(symbol)
+            assert result == expected.step(symbol)
+            assert compiled.is_true() == result
+
+
+def test_step_controllers_bitmask() -> None:
+    """Test that the step controllers give the same results with bitmasks."""
+    vocabulary = FluentVocabulary(["c", "b", "a"])
+    symbols = [set(), {"b"}, {"a"}, {"a", "b"}, {"c"}]
+    for trace in itertools.product(symbols, repeat=3):
+        controllers = [
+            (
+                StatefulStepController(build_acceptor()),
+                StatefulStepController(build_acceptor()),
+            ),
+            (
+                StatelessStepController(lambda f: "a" in f, allow_first=False),
+                StatelessStepController(lambda f: "a" in f, allow_first=False),
+            ),
+        ]
+        for expected, controller in controllers:
+            for symbol in trace:
+                mask = vocabulary.encode(symbol)
+                assert controller.step_bitmask(mask, vocabulary) == expected.step(
+                    symbol
+                )
+
+
+def test_stateless_step_controller_bounded_cache() -> None:
+    """Test that the stateless step controller memoizes a bounded number of bitmasks."""
+    calls = []
+
+    def step_func(fluents) -> bool:
+        calls.append(fluents)
+        return "a" in fluents
+
+    vocabulary = FluentVocabulary(["c", "b", "a"])
+    sc = StatelessStepController(step_func, allow_first=False, max_cache_size=2)
+    for mask in [0b100, 0b100, 0b001, 0b010, 0b010]:
+        assert sc.step_bitmask(mask, vocabulary) == bool(mask & 0b100)
+    # the last bitmask was read once the cache was full
+    assert len(calls) == 4
+    assert sc.cache_size == 2
+    # only the results over the last vocabulary are kept
+    assert sc.step_bitmask(0b01, FluentVocabulary(["a", "b"]))
+    assert sc.cache_size == 1
+    with pytest.raises(ValueError, match="max cache size must be non-negative"):
+        StatelessStepController(step_func, max_cache_size=-1)
+
+
+def test_compiled_stateful_step_controller_bitmask() -> None:
+    """Test CompiledStatefulStepController with bitmasks."""
+    sc = CompiledStatefulStepController(build_acceptor())
+    assert sc.acceptor.vocabulary.fluents == ("a", "b")
+    # a missing transition leads to the sink state
+    assert sc.acceptor.transitions.shape == (3, 4)
+    assert not sc.step_bitmask(0b01, FluentVocabulary(["c", "a"]))
+    assert sc.step_bitmask(0b10, FluentVocabulary(["c", "a"]))
+    sc.reset()
+    assert not sc.is_true()
+    assert not sc.step_bitmask(0b10, sc.acceptor.vocabulary)
+    assert not sc.step_bitmask(0b01, sc.acceptor.vocabulary)
+
+
+def test_batched_compiled_stateful_step_controller() -> None:
+    """Test BatchedCompiledStatefulStepController."""
+    sc = BatchedCompiledStatefulStepController(build_acceptor(), num_envs=3)
+    assert sc.num_envs == 3
+    fluent_matrix = np.array([[False, False], [True, False], [False, True]])
+    assert sc.step(fluent_matrix).tolist() == [False, True, False]
+    fluent_matrix = np.array([[True, False], [False, False], [True, False]])
+    assert sc.step(fluent_matrix).tolist() == [True, True, False]
+    sc.reset(np.array([False, True, True]))
+    assert sc.is_true().tolist() == [True, False, False]
+    sc.reset()
+    assert sc.is_true().tolist() == [False, False, False]
+
+
+def test_batched_stateless_step_controller() -> None:
+    """Test that BatchedStatelessStepController behaves as one controller per environment."""
+    fluents = ["a", "b"]
+    allow_first = [True, False, True, False]
+    batched = BatchedStatelessStepController(
+        lambda fluent_matrix: fluent_matrix[:, 0], 4, allow_first=allow_first
+    )
+    controllers = [
+        StatelessStepController(lambda f: "a" in f, allow_first=flag)
+        for flag in allow_first
+    ]
+    assert batched.num_envs == 4
+
+    rng = np.random.default_rng(42)
+    for step in range(50):
+        if step % 10 == 9:
+            to_reset = rng.random(4) < 0.5
+            batched.reset(to_reset)
+            for controller, reset in zip(controllers, to_reset):
+                if reset:
+                    controller.reset()
+        fluent_matrix = rng.random((4, 2)) < 0.3
+        allowed = batched.step(fluent_matrix)
+        expected = [
+            controller.step({f for f, value in zip(fluents, row) if value})
+            for controller, row in zip(controllers, fluent_matrix)
+        ]
+        assert allowed.tolist() == expected
+        assert batched.started.tolist() == [c.started for c in controllers]
+
+    batched.reset()
+    assert not batched.started.any()
+    with pytest.raises(ValueError, match="'allow_first' flags"):
+        BatchedStatelessStepController(lambda m: m[:, 0], 4, allow_first=[True] * 3)
@@ -0,0 +1,178 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Tests for `temprl.tabular` module."""
+from typing import Any, Sequence, Tuple, cast
+
+import numpy as np
+import pytest
+from gym.spaces import Box, Discrete
+
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.reward_machines.compiled import CompiledRewardMachine
+from temprl.tabular import QTable
+from temprl.vector_wrapper import VectorTemporalGoalWrapper
+from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
+from tests.utils import GymTestEnv, build_test_automaton, make_vector_test_env
+
+N_STATES = 5
+FLUENTS = [f"s{i}" for i in range(N_STATES)]
+
+# the observations of a wrapper in "dense" observation mode
+DenseObservation = Tuple[Any, Sequence[int]]
+
+
+def make_wrapper(**kwargs) -> TemporalGoalWrapper:
+    """Make a wrapper of the test environment."""
+    return TemporalGoalWrapper(
+        GymTestEnv(n_states=N_STATES),
+        [
+            TemporalGoal(
+                CompiledRewardMachine.from_reward_machine(
+                    RewardAutomaton(build_test_automaton(), 10.0)
+                )
+            )
+        ],
+        lambda obs, _action: {f"s{obs}"},
+        **kwargs,
+    )
+
+
+def test_learning_with_q_table() -> None:
+    """Test that Q-learning with the table learns the temporal goal."""
+    env = make_wrapper(observation_mode="dense")
+    q_table = QTable.from_env(env)
+    assert q_table.values.shape == (N_STATES, 5, 3)
+    rng = np.random.default_rng(42)
+    alpha, gamma = 0.1, 0.9
+    for _ in range(5000):
+        obs_index, automaton_index = q_table.get_index(
+            cast(DenseObservation, env.reset())
+        )
+        done = False
+        while not done:
+            action = int(
+                q_table.epsilon_greedy_actions(
+                    obs_index, automaton_index, eps=0.5, rng=rng
+                )
+            )
+            next_obs, reward, done, _ = env.step(action)
+            next_obs_index, next_automaton_index = q_table.get_index(
+                cast(DenseObservation, next_obs)
+            )
+            target = reward + gamma * q_table.values[
+                next_obs_index, next_automaton_index
+            ].max() * (not done)
+            values = q_table.values[obs_index, automaton_index]
+            values[action] += alpha * (target - values[action])
+            obs_index, automaton_index = next_obs_index, next_automaton_index
+
+    total_reward = 0.0
+    obs, done = env.reset(), False
+    while not done:
+        action = int(
+            q_table.greedy_actions(*q_table.get_index(cast(DenseObservation, obs)))
+        )
+        obs, reward, done, _ = env.step(action)
+        total_reward += reward
+    assert total_reward == 11.0
+
+
+def test_lazy_growth() -> None:
+    """Test that a table over an unbounded observation space grows as observations are met."""
+    q_table = QTable([2, 3], 4, Box(0.0, 1.0, shape=(2,)), initial_capacity=2)
+    assert q_table.nb_observations == 0
+    observations = [np.asarray([i / 10, 0.5], dtype=np.float32) for i in range(5)]
+    for i, observation in enumerate(observations):
+        q_table[observation, (1, 2)][:] = i
+        assert q_table.get_index((observation, (1, 2))) == (i, 5)
+    assert q_table.get_index((observations[0].copy(), (0, 0))) == (0, 0)
+    assert q_table.nb_observations == 5
+    assert q_table.values.shape == (5, 6, 4)
+    np.testing.assert_array_equal(q_table.values[:, 5, 0], np.arange(5))
+    assert (q_table.values[:, :5] == 0.0).all()
+
+    observation_indices, automaton_indices = q_table.get_indices(
+        np.stack([observations[3], np.asarray([1.0, 1.0], dtype=np.float32)]),
+        np.asarray([[1, 2], [0, 1]]),
+    )
+    assert observation_indices.tolist() == [3, 5]
+    assert automaton_indices.tolist() == [5, 1]
+
+
+def test_vectorized_indices_and_actions() -> None:
+    """Test the indices and the greedy actions of a batch of a vectorized environment."""
+    env = VectorTemporalGoalWrapper(
+        make_vector_test_env(N_STATES, 3),
+        [
+            TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+            TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0)),
+        ],
+        FLUENTS,
+        lambda observations, _actions: np.arange(N_STATES)
+        == np.asarray(observations)[:, None],
+    )
+    q_table = QTable.from_env(env)
+    assert q_table.values.shape == (N_STATES, 25, 3)
+    q_table.values[:] = np.random.default_rng(42).random(q_table.values.shape)
+    observations, automata_states = env.reset()
+    for _ in range(10):
+        observation_indices, automaton_indices = q_table.get_indices(
+            observations, automata_states
+        )
+        actions = q_table.greedy_actions(observation_indices, automaton_indices)
+        for i in range(3):
+            index = q_table.get_index((observations[i], automata_states[i]))
+            assert index == (observation_indices[i], automaton_indices[i])
+            assert actions[i] == np.argmax(q_table[observations[i], automata_states[i]])
+        observations, automata_states = env.step(actions)[0]
+
+    rng = np.random.default_rng(42)
+    greedy = q_table.greedy_actions(observation_indices, automaton_indices)
+    np.testing.assert_array_equal(
+        q_table.epsilon_greedy_actions(
+            observation_indices, automaton_indices, eps=0.0, rng=rng
+        ),
+        greedy,
+    )
+
+
+def test_invalid_tables() -> None:
+    """Test the errors when building or indexing a table."""
+    with pytest.raises(ValueError, match="'dense' observation mode"):
+        QTable.from_env(make_wrapper())
+    with pytest.raises(ValueError, match="initial capacity"):
+        QTable([2], 2, initial_capacity=0)
+    # the number of automaton states would overflow a 64-bit integer
+    with pytest.raises(ValueError, match=f"{2 ** 70} automaton states"):
+        QTable([2] * 70, 2)
+    with pytest.raises(ValueError, match="more than the maximum of 20"):
+        QTable([2, 3], 4, Discrete(3), max_size=20)
+    q_table = QTable([2], 2, Box(0.0, 1.0, shape=(1,)), initial_capacity=2, max_size=12)
+    for i in range(3):
+        q_table[np.asarray([i], dtype=np.float32), (0,)][:] = i
+    with pytest.raises(ValueError, match="4 observations"):
+        q_table.get_index((np.asarray([3], dtype=np.float32), (0,)))
+    q_table = QTable([2], 2, Discrete(3))
+    with pytest.raises(ValueError, match="invalid observation"):
+        q_table.get_index((3, (0,)))
+    with pytest.raises(ValueError):
+        q_table.get_index((0, (2,)))
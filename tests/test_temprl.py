@@ -20,18 +20,36 @@
 #
 
 """Tests for `temprl` package."""
-from typing import Any, Dict, cast
+import gc
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple, cast
 
 import gym
 import numpy as np
+import pytest
 import sympy
-from gym.spaces import Discrete, MultiDiscrete
+from gym.spaces import Box, Discrete, MultiDiscrete
 from pythomata.impl.symbolic import SymbolicDFA
 
+from temprl.fluents import FluentVocabulary, SetToBitmaskFluentExtractor
 from temprl.reward_machines.automata import RewardAutomaton
 from temprl.reward_machines.base import AbstractRewardMachine, RewardMachineSimulator
+from temprl.reward_machines.cached import CachedRewardMachine
+from temprl.reward_machines.compiled import CompiledRewardMachine
+from temprl.reward_machines.shaping import PotentialShaping
+from temprl.step_controllers.stateless import StatelessStepController
 from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
-from tests.utils import GymTestEnv, q_function_learn, q_function_test, wrap_observation
+from tests.utils import (
+    GymTestEnv,
+    build_eventually_automaton,
+    build_test_automaton,
+    q_function_learn,
+    q_function_test,
+    wrap_observation,
+)
 
 
 class TestSimpleEnv:
@@ -66,40 +84,10 @@ class TestTempRLWithSimpleEnv:
     tg: TemporalGoal
     wrapped: TemporalGoalWrapper
 
-    @classmethod
-    def _build_automaton(cls) -> SymbolicDFA:
-        """
-        Build the reward automaton.
-
-        It is equivalent to the following regular expression:
-
-            (!s4)*;s3;(!s4)*;s0;(!s4)*;s4;true*
-
-        :returns: the automaton.
-        """
-        automaton = SymbolicDFA()
-        q0 = 0
-        q1 = automaton.create_state()
-        q2 = automaton.create_state()
-        q3 = automaton.create_state()
-
-        automaton.add_transition((q0, "~s4 & ~s3", q0))
-        automaton.add_transition((q0, "s3", q1))
-        automaton.add_transition((q1, "~s4 & ~s0", q1))
-        automaton.add_transition((q1, "s0", q2))
-        automaton.add_transition((q2, "~s4", q2))
-        automaton.add_transition((q2, "s4", q3))
-        automaton.add_transition((q3, "true", q3))
-        automaton.set_accepting_state(q3, True)
-
-        automaton = automaton.complete()
-
-        return automaton
-
     @classmethod
     def setup_class(cls) -> None:
         """Set the tests up."""
-        cls.automaton = cls._build_automaton()
+        cls.automaton = build_test_automaton()
         cls.reward = 10.0
         cls.reward_machine = RewardAutomaton(cls.automaton, cls.reward)
         cls.env = GymTestEnv(n_states=5)
@@ -168,3 +156,506 @@ class TestTempRLWithSimpleEnv:
     @classmethod
     def teardown_class(cls):
         """Tear the tests down."""
+
+
+def test_wrapper_with_bitmask_fluent_extractor() -> None:
+    """Test that the bitmask protocol gives the same results as the set-based one."""
+    fluents = [f"s{i}" for i in range(5)]
+    reward_automaton = RewardAutomaton(build_test_automaton(), 10.0)
+    compiled = CompiledRewardMachine.from_reward_machine(reward_automaton)
+
+    def set_extractor(obs, _action):
+        return {f"s{obs}"}
+
+    wrappers = [
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [TemporalGoal(reward_automaton), TemporalGoal(reward_automaton)],
+            set_extractor,
+        ),
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [TemporalGoal(compiled), TemporalGoal(reward_automaton)],
+            lambda obs, action: np.arange(5) == obs,
+            fluents=fluents,
+        ),
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [TemporalGoal(compiled), TemporalGoal(compiled)],
+            SetToBitmaskFluentExtractor(set_extractor, FluentVocabulary(fluents)),
+            fluents=fluents,
+        ),
+    ]
+    for wrapper in wrappers:
+        wrapper.reset()
+    for action in [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2]:
+        results = [wrapper.step(action) for wrapper in wrappers]
+        expected_observation, expected_reward, _, _ = results[0]
+        for observation, reward, _, _ in results[1:]:
+            assert observation == expected_observation
+            assert reward == expected_reward
+    _, expected_states = cast(Tuple[int, Tuple[int, ...]], expected_observation)
+    assert expected_states == (3, 3)
+
+
+def test_wrapper_with_product() -> None:
+    """Test that stepping the product gives the same results as stepping each goal."""
+    fluents = [f"s{i}" for i in range(5)]
+
+    def make_goals():
+        return [
+            TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+            TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0)),
+        ]
+
+    def set_extractor(obs, _action):
+        return {f"s{obs}"}
+
+    reference = TemporalGoalWrapper(GymTestEnv(n_states=5), make_goals(), set_extractor)
+    wrappers = [
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5), make_goals(), set_extractor, product=True
+        ),
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            make_goals(),
+            lambda obs, action: np.arange(5) == obs,
+            fluents=fluents,
+            product=True,
+        ),
+    ]
+    assert all(wrapper.is_product for wrapper in wrappers)
+    assert all(
+        wrapper.observation_space == reference.observation_space for wrapper in wrappers
+    )
+    expected_obs = reference.reset()
+    for wrapper in wrappers:
+        assert wrapper.reset() == expected_obs
+    for action in [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2]:
+        expected = reference.step(action)
+        for wrapper in wrappers:
+            assert wrapper.step(action) == expected
+    _, expected_states = cast(Tuple[int, Tuple[int, ...]], expected[0])
+    assert expected_states == (3, 3)
+    # the temporal goals are synchronized with the product
+    for wrapper in wrappers:
+        assert tuple(tg.current_state for tg in wrapper.temp_goals) == (3, 3)
+
+
+def test_wrapper_with_product_and_step_controller() -> None:
+    """Test that the product is not used with a step controller, which is queried per goal."""
+    symbols = [{"s3"}, {"s0", "b"}, {"s4", "b"}, {"b"}]
+
+    def make_wrapper(product):
+        remaining = iter(symbols)
+        return TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [
+                TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0))
+                for _ in range(2)
+            ],
+            lambda obs, action: next(remaining),
+            step_controller=StatelessStepController(
+                lambda fluents: "b" in fluents, allow_first=True
+            ),
+            product=product,
+        )
+
+    reference, wrapper = make_wrapper(False), make_wrapper(True)
+    assert not wrapper.is_product
+    reference.reset()
+    wrapper.reset()
+    results = [wrapper.step(0) for _ in symbols]
+    assert results == [reference.step(0) for _ in symbols]
+    assert [reward for _, reward, _, _ in results] == [0.0, 0.0, 1.0, 1.0]
+    assert cast(tuple, results[-1][0])[1] == (3, 4)
+
+
+def test_wrapper_with_product_fallback() -> None:
+    """Test that the goals are stepped separately if the product is too large."""
+    wrapper = TemporalGoalWrapper(
+        GymTestEnv(n_states=5),
+        [TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0))] * 2,
+        lambda obs, action: {f"s{obs}"},
+        product=True,
+        max_product_size=16,
+    )
+    assert not wrapper.is_product
+    wrapper.reset()
+    assert cast(tuple, wrapper.step(2)[0])[1] == (0, 0)
+
+
+def test_wrapper_with_dense_observations() -> None:
+    """Test that the automaton states are encoded as dense indices."""
+    compiled = CompiledRewardMachine.from_reward_machine(
+        RewardAutomaton(build_test_automaton(), 10.0)
+    )
+    # a reward machine with non-integer states
+    named = CompiledRewardMachine(
+        [f"q{i}" for i in range(len(compiled.states))],
+        compiled.fluents,
+        "q0",
+        compiled.transitions,
+        compiled.rewards,
+    )
+
+    def make_goals():
+        return [
+            TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+            TemporalGoal(CachedRewardMachine(named)),
+        ]
+
+    def extractor(obs, _action):
+        return {f"s{obs}"}
+
+    reference = TemporalGoalWrapper(GymTestEnv(n_states=5), make_goals(), extractor)
+    wrappers = [
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5), make_goals(), extractor, observation_mode="dense"
+        ),
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            make_goals(),
+            extractor,
+            product=True,
+            observation_mode="dense",
+        ),
+    ]
+    goals = reference.temp_goals
+    assert goals[1].get_state_index("q3") == 3
+    assert goals[1].get_state(3) == "q3"
+    _, expected_states = cast(tuple, reference.reset())
+    for wrapper in wrappers:
+        _, states = cast(Tuple[int, np.ndarray], wrapper.reset())
+        assert states.tolist() == [
+            tg.get_state_index(q) for tg, q in zip(goals, expected_states)
+        ]
+    for action in [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2]:
+        expected_observation, expected_reward, _, _ = reference.step(action)
+        expected_obs, expected_states = cast(tuple, expected_observation)
+        for wrapper in wrappers:
+            observation, reward, _, _ = wrapper.step(action)
+            obs, states = cast(Tuple[int, np.ndarray], observation)
+            assert obs == expected_obs and reward == expected_reward
+            assert wrapper.observation_space.contains((obs, states))
+            assert wrapper.decode_automata_states(states) == list(expected_states)
+    assert expected_states == (3, "q3")
+    # the encoded states are written into a preallocated array
+    assert (
+        cast(tuple, wrappers[0].step(0)[0])[1] is cast(tuple, wrappers[0].step(0)[0])[1]
+    )
+
+    with pytest.raises(ValueError, match="invalid state index"):
+        wrappers[0].decode_automata_states([5, 0])
+    with pytest.raises(ValueError, match="does not belong"):
+        goals[1].get_state_index("q5")
+    with pytest.raises(ValueError, match="observation mode"):
+        TemporalGoalWrapper(GymTestEnv(), make_goals(), extractor, observation_mode="x")
+
+
+def test_wrapper_with_flat_observations() -> None:
+    """Test that the observation and the automaton states are flattened into a Box."""
+
+    def make_wrapper(**kwargs):
+        return TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [
+                TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+                TemporalGoal(RewardAutomaton(build_eventually_automaton("s2"), 1.0)),
+            ],
+            lambda obs, action: {f"s{obs}"},
+            **kwargs,
+        )
+
+    reference = make_wrapper(observation_mode="dense", copy_observations=True)
+    flat = make_wrapper(observation_mode="flat")
+    flat_copy = make_wrapper(observation_mode="flat", copy_observations=True)
+    assert flat.observation_space == Box(0.0, 1.0, shape=(12,), dtype=np.float32)
+
+    def expected_flat(obs, states):
+        return np.concatenate(
+            [np.eye(5)[obs], np.eye(5)[states[0]], np.eye(2)[states[1]]]
+        )
+
+    np.testing.assert_array_equal(flat.reset(), expected_flat(*reference.reset()))
+    flat_copy.reset()
+    flat_observations, copied_observations = [], []
+    for action in [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2]:
+        (obs, states), expected_reward, expected_done, _ = reference.step(action)
+        flat_obs, reward, done, _ = flat.step(action)
+        copied_obs, _, _, _ = flat_copy.step(action)
+        assert (reward, done) == (expected_reward, expected_done)
+        assert flat.observation_space.contains(flat_obs)
+        np.testing.assert_array_equal(flat_obs, expected_flat(obs, states))
+        np.testing.assert_array_equal(copied_obs, flat_obs)
+        flat_observations.append(flat_obs)
+        copied_observations.append(copied_obs)
+    assert all(flat_obs is flat_observations[0] for flat_obs in flat_observations)
+    assert len({id(copied_obs) for copied_obs in copied_observations}) == 11
+
+
+def test_wrapper_with_reward_shaping() -> None:
+    """Test that the shaping rewards are added, with or without the product."""
+    gamma = 0.9
+
+    def make_wrapper(reward_shaping, product=False):
+        return TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [
+                TemporalGoal(
+                    RewardAutomaton(build_test_automaton(), 10.0),
+                    reward_shaping=reward_shaping,
+                    discount=gamma,
+                ),
+                TemporalGoal(RewardAutomaton(build_eventually_automaton("s2"), 1.0)),
+            ],
+            lambda obs, action: {f"s{obs}"},
+            product=product,
+        )
+
+    reference = make_wrapper(False)
+    shaped = make_wrapper(True)
+    shaped_product = make_wrapper(True, product=True)
+    assert shaped_product.is_product
+    potentials = [-3.0, -2.0, -1.0, 0.0, -5.0]
+    (_, states) = reference.reset()
+    shaped.reset()
+    shaped_product.reset()
+    for action in [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2]:
+        (_, next_states), reward, done, _ = reference.step(action)
+        # the potential of the successor is 0 at the end of the episode
+        next_potential = 0.0 if done else potentials[next_states[0]]
+        expected_reward = reward + gamma * next_potential - potentials[states[0]]
+        assert shaped.step(action)[1] == pytest.approx(expected_reward)
+        assert shaped_product.step(action)[1] == pytest.approx(expected_reward)
+        states = next_states
+
+
+@pytest.mark.parametrize(
+    "product,blocking", [(False, False), (True, False), (False, True)]
+)
+def test_reward_shaping_preserves_returns(product: bool, blocking: bool) -> None:
+    """Test that the shaping changes the discounted return of every episode by -phi(s0)."""
+    gamma = 0.9
+
+    def make_wrapper(reward_shaping: bool) -> TemporalGoalWrapper:
+        return TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [
+                TemporalGoal(
+                    RewardAutomaton(build_test_automaton(), 10.0),
+                    reward_shaping=reward_shaping,
+                    discount=gamma,
+                ),
+                TemporalGoal(
+                    RewardAutomaton(build_eventually_automaton("s2"), 1.0),
+                    reward_shaping=reward_shaping,
+                    discount=gamma,
+                ),
+            ],
+            lambda obs, action: {f"s{obs}"},
+            # the steps that read s2 are not allowed
+            StatelessStepController(lambda fluents: "s2" not in fluents)
+            if blocking
+            else None,
+            product=product,
+        )
+
+    reference = make_wrapper(False)
+    shaped = make_wrapper(True)
+    assert shaped.is_product == product
+    initial_potential = sum(
+        cast(PotentialShaping, tg.shaping).potential(tg.automaton.initial_state)
+        for tg in shaped.temp_goals
+    )
+    assert initial_potential < 0
+    rng = np.random.default_rng(42)
+    for _ in range(20):
+        reference.reset()
+        shaped.reset()
+        returns = [0.0, 0.0]
+        done, discount = False, 1.0
+        while not done:
+            action = int(rng.integers(0, 3))
+            _, reward, done, _ = reference.step(action)
+            _, shaped_reward, shaped_done, _ = shaped.step(action)
+            assert shaped_done == done
+            returns[0] += discount * reward
+            returns[1] += discount * shaped_reward
+            discount *= gamma
+        assert returns[1] - returns[0] == pytest.approx(-initial_potential)
+
+
+def test_counterfactual_transitions() -> None:
+    """Test that the transitions from every automaton state are read from the tables."""
+    automaton = RewardAutomaton(build_test_automaton(), 10.0)
+    goal = TemporalGoal(automaton)
+    shaped_goal = TemporalGoal(automaton, reward_shaping=True, discount=0.9)
+    potentials = np.asarray([-3.0, -2.0, -1.0, 0.0, -5.0])
+    vocabulary = FluentVocabulary([f"s{i}" for i in range(5)])
+    for fluent in vocabulary.fluents:
+        expected = [automaton.transition(q, {fluent}) for q in range(5)]
+        states, next_states, rewards = goal.get_counterfactual_transitions({fluent})
+        assert states.tolist() == list(range(5))
+        assert next_states.tolist() == [q for q, _ in expected]
+        assert rewards.tolist() == [r for _, r in expected]
+        _, _, shaped_rewards = shaped_goal.get_counterfactual_transitions_bitmask(
+            vocabulary.encode({fluent}), vocabulary
+        )
+        np.testing.assert_allclose(
+            shaped_rewards, rewards + 0.9 * potentials[next_states] - potentials
+        )
+
+    # write directly into the storage of a replay buffer
+    buffer_states = np.full(12, -1)
+    buffer_next_states = np.full(12, -1)
+    buffer_rewards = np.zeros(12)
+    out = (buffer_states[2:7], buffer_next_states[2:7], buffer_rewards[2:7])
+    assert goal.get_counterfactual_transitions({"s4"}, out=out)[0] is out[0]
+    assert buffer_states.tolist() == [-1, -1, 0, 1, 2, 3, 4, -1, -1, -1, -1, -1]
+    assert buffer_next_states[2:7].tolist() == [4, 4, 3, 3, 4]
+    assert buffer_rewards[2:7].tolist() == [0.0, 0.0, 10.0, 10.0, 0.0]
+
+    wrappers = [
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5), [goal, shaped_goal], lambda obs, _: {f"s{obs}"}
+        ),
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [goal, shaped_goal],
+            lambda obs, _: np.arange(5) == obs,
+            fluents=vocabulary.fluents,
+        ),
+    ]
+    for wrapper in wrappers:
+        (_, next_states, rewards), (
+            _,
+            _,
+            shaped_rewards,
+        ) = wrapper.get_counterfactual_transitions(3, 2)
+        assert next_states.tolist() == [1, 1, 2, 3, 4]
+        np.testing.assert_allclose(
+            shaped_rewards, rewards + 0.9 * potentials[next_states] - potentials
+        )
+
+
+def test_counterfactual_transitions_state_indices() -> None:
+    """Test that the counterfactual transitions are given in terms of the state indices."""
+    compiled = CompiledRewardMachine.from_reward_machine(
+        RewardAutomaton(build_test_automaton(), 10.0)
+    )
+    named_goal = TemporalGoal(
+        CachedRewardMachine(
+            CompiledRewardMachine(
+                [f"q{4 - i}" for i in range(5)],
+                compiled.fluents,
+                "q4",
+                compiled.transitions,
+                compiled.rewards,
+            )
+        )
+    )
+    states, next_states, _ = named_goal.get_counterfactual_transitions({"s3"})
+    for state_index, next_state_index in zip(states.tolist(), next_states.tolist()):
+        state = named_goal.get_state(state_index)
+        next_state = named_goal.automaton.transition(state, {"s3"})[0]
+        assert named_goal.get_state_index(next_state) == next_state_index
+
+
+def slow_fluent_extractor(obs, _action):
+    """Extract the fluents, slowly."""
+    time.sleep(0.001)
+    return {f"s{obs}"}
+
+
+def test_step_many_with_fluent_executor() -> None:
+    """Test that pipelined steps give the same transitions as sequential steps."""
+
+    def make_wrapper(**kwargs):
+        return TemporalGoalWrapper(
+            GymTestEnv(n_states=5),
+            [
+                TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+                TemporalGoal(RewardAutomaton(build_eventually_automaton("s2"), 1.0)),
+            ],
+            slow_fluent_extractor,
+            **kwargs,
+        )
+
+    actions = [2, 2, 2, 0, 1, 1, 1, 2, 2, 2, 2, 0, 0]
+    reference = make_wrapper(observation_mode="dense")
+    reference.reset()
+    expected = []
+    for action in actions:
+        (obs, states), reward, done, info = reference.step(action)
+        expected.append(((obs, states.tolist()), reward, done, info))
+        if done:
+            break
+    assert len(expected) == 11
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for wrapper in [
+            make_wrapper(observation_mode="dense"),
+            make_wrapper(observation_mode="dense", fluent_executor=executor),
+            make_wrapper(
+                observation_mode="dense", fluent_executor=executor, pipeline_depth=1
+            ),
+            make_wrapper(
+                observation_mode="dense", fluent_executor=executor, pipeline_depth=4
+            ),
+        ]:
+            wrapper.reset()
+            transitions = wrapper.step_many(actions)
+            assert [
+                ((obs, states.tolist()), reward, done, info)
+                for (obs, states), reward, done, info in transitions
+            ] == expected
+
+    with pytest.raises(ValueError, match="pipeline depth"):
+        make_wrapper(pipeline_depth=0)
+
+
+@pytest.mark.parametrize("observation_mode", ["raw", "dense", "flat"])
+def test_step_allocations(observation_mode: str) -> None:
+    """Test that stepping compiled temporal goals allocates a bounded amount of memory."""
+    reward_machine = CompiledRewardMachine.from_reward_machine(
+        RewardAutomaton(build_test_automaton(), 1.0)
+    )
+    temp_goals = [TemporalGoal(reward_machine), TemporalGoal(reward_machine)]
+    assert not hasattr(temp_goals[0], "__dict__")
+    symbols = [frozenset({f"s{i}"}) for i in range(5)]
+    wrapper = TemporalGoalWrapper(
+        GymTestEnv(n_states=5),
+        temp_goals,
+        lambda obs, _action: symbols[obs],
+        observation_mode=observation_mode,
+    )
+    nb_steps = 1000
+    actions = np.random.default_rng(42).integers(0, 3, size=nb_steps).tolist()
+
+    def run() -> None:
+        for action in actions:
+            _, _, done, _ = wrapper.step(action)
+            if done:
+                wrapper.reset()
+
+    # the first steps fill the caches of the bitmasks
+    wrapper.reset()
+    run()
+    gc.collect()
+    before = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    gc.collect()
+    retained_blocks = sys.getallocatedblocks() - before
+    # the peak is bounded by what is allocated within one step,
+    # so it is only a few bytes per step over all the steps
+    assert (peak - start) / nb_steps < 4
+    # nothing is retained across steps
+    assert (current - start) / nb_steps < 2
+    assert retained_blocks / nb_steps < 0.02
@@ -0,0 +1,158 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Tests for `temprl.traces` module."""
+from typing import Tuple, cast
+
+import numpy as np
+import pytest
+
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.step_controllers.stateless import StatelessStepController
+from temprl.traces import Trace, TraceRecorder, load_trace
+from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
+from tests.utils import GymTestEnv, build_eventually_automaton, build_test_automaton
+
+FLUENTS = [f"s{i}" for i in range(5)]
+
+
+def test_trace_recorder(tmp_path) -> None:
+    """Test that the recorder flushes full chunks and that the trace can be loaded."""
+    recorder = TraceRecorder(tmp_path / "trace", ["a", "b"], nb_goals=2, chunk_size=3)
+    for step in range(7):
+        recorder.record([step, step + 1], [float(step), 0.5], step % 4, [True, False])
+        if step == 3:
+            recorder.end_episode()
+    assert recorder.nb_steps == 7
+    assert len(recorder.chunk_paths) == 2
+    recorder.end_episode()
+    recorder.end_episode()
+    assert recorder.nb_episodes == 2
+    recorder.close()
+    assert len(recorder.chunk_paths) == 3
+    assert recorder.flush() is None
+
+    trace = load_trace(tmp_path / "trace")
+    assert trace.fluent_names == ("a", "b")
+    assert trace.episodes.tolist() == [0, 0, 0, 0, 1, 1, 1]
+    assert trace.steps.tolist() == [0, 1, 2, 3, 0, 1, 2]
+    assert trace.states.tolist() == [[i, i + 1] for i in range(7)]
+    assert trace.rewards[:, 0].tolist() == list(range(7))
+    assert trace.fluents.tolist() == [0, 1, 2, 3, 0, 1, 2]
+    assert trace.transitions.tolist() == [[True, False]] * 7
+
+    with pytest.raises(ValueError, match="already contains a trace"):
+        TraceRecorder(tmp_path / "trace", ["a"], nb_goals=1)
+    with pytest.raises(ValueError, match="does not contain a trace"):
+        load_trace(tmp_path / "missing")
+    with pytest.raises(ValueError, match="chunk size"):
+        TraceRecorder(tmp_path / "other", ["a"], nb_goals=1, chunk_size=0)
+    with pytest.raises(ValueError, match="at most 63 fluents"):
+        TraceRecorder(tmp_path / "other", range(64), nb_goals=1)
+
+
+def make_wrapper(product: bool, fluents, trace_recorder=None) -> TemporalGoalWrapper:
+    """Make the wrapper used in the tests, with a fluent vocabulary if the fluents are given."""
+    extractor = (
+        (lambda obs, _action: {f"s{obs}"})
+        if fluents is None
+        else (lambda obs, _action: 1 << obs)
+    )
+    return TemporalGoalWrapper(
+        GymTestEnv(n_states=5),
+        [
+            TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+            TemporalGoal(
+                RewardAutomaton(build_eventually_automaton("s2"), 1.0),
+                reward_shaping=True,
+            ),
+        ],
+        extractor,
+        # the product is only built with the default step controller
+        step_controller=None
+        if product
+        else StatelessStepController(
+            lambda symbol: symbol != {"s1"}, allow_first=False
+        ),
+        fluents=fluents,
+        product=product,
+        observation_mode="dense",
+        trace_recorder=trace_recorder,
+    )
+
+
+def check_transitions(trace: Trace, product: bool) -> None:
+    """Check that the recorded decisions of the step controller match the fluents."""
+    for fluent_mask, transitions in zip(trace.fluents, trace.transitions):
+        symbol = {f for i, f in enumerate(trace.fluent_names) if fluent_mask >> i & 1}
+        assert len(symbol) == 1
+        assert transitions.tolist() == [product or symbol != {"s1"}] * 2
+
+
+@pytest.mark.parametrize("product", [False, True])
+@pytest.mark.parametrize("fluents", [None, FLUENTS])
+def test_wrapper_with_trace_recorder(tmp_path, product, fluents) -> None:
+    """Test that the wrapper records the same steps that it does."""
+    recorder = TraceRecorder(tmp_path, ["s4", "s3", "s2", "s1", "s0"], 2, chunk_size=8)
+    reference = make_wrapper(product, fluents)
+    recorded = make_wrapper(product, fluents, recorder)
+    env = GymTestEnv(n_states=5)
+    assert recorded.is_product == product
+    rng = np.random.default_rng(42)
+    expected_states, expected_rewards, nb_episodes = [], [], 0
+    recorded.reset()
+    reference.reset()
+    env.reset()
+    for step in range(100):
+        action = int(rng.integers(0, 3))
+        observation, reward, done, _ = recorded.step(action)
+        obs, states = cast(Tuple[int, np.ndarray], observation)
+        expected = reference.step(action)
+        assert obs == cast(tuple, expected[0])[0]
+        assert reward == expected[1]
+        expected_states.append(states.tolist())
+        expected_rewards.append(expected[1] - env.step(action)[1])
+        if done or step % 30 == 29:
+            nb_episodes += 1
+            recorded.reset()
+            reference.reset()
+            env.reset()
+    recorder.close()
+
+    trace = load_trace(tmp_path)
+    assert trace.states.tolist() == expected_states
+    np.testing.assert_allclose(trace.rewards.sum(axis=1), expected_rewards)
+    assert recorder.nb_episodes == nb_episodes
+    # the last episode is not ended
+    assert np.unique(trace.episodes).tolist() == list(range(nb_episodes + 1))
+    check_transitions(trace, product)
+
+
+def test_invalid_trace_recorder(tmp_path) -> None:
+    """Test that a trace recorder must match the temporal goals."""
+    temp_goals = [TemporalGoal(RewardAutomaton(build_test_automaton(), 1.0))]
+    with pytest.raises(ValueError, match="expects 2 temporal goals"):
+        TemporalGoalWrapper(
+            GymTestEnv(),
+            temp_goals,
+            lambda obs, _action: {f"s{obs}"},
+            trace_recorder=TraceRecorder(tmp_path / "a", FLUENTS, nb_goals=2),
+        )
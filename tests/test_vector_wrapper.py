@@ -0,0 +1,204 @@
+#
+# Copyright 2020-2022 Marco Favorito
+#
+# ------------------------------
+#
+# This file is part of temprl.
+#
+# temprl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# temprl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with temprl.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""Tests for `temprl.vector_wrapper` module."""
+from typing import Tuple, cast
+
+import numpy as np
+import pytest
+from gym.spaces import Box, MultiDiscrete
+from gym.spaces import Tuple as GymTuple
+
+from temprl.reward_machines.automata import RewardAutomaton
+from temprl.step_controllers.stateless import (
+    BatchedStatelessStepController,
+    StatelessStepController,
+)
+from temprl.vector_wrapper import VectorTemporalGoalWrapper
+from temprl.wrapper import TemporalGoal, TemporalGoalWrapper
+from tests.utils import GymTestEnv, build_test_automaton, make_vector_test_env
+
+NUM_ENVS = 3
+N_STATES = 5
+FLUENTS = [f"s{i}" for i in range(N_STATES)]
+
+
+def batched_fluent_extractor(observations, _actions) -> np.ndarray:
+    """Extract the fluent matrix from a batch of observations."""
+    return np.arange(N_STATES) == np.asarray(observations)[:, None]
+
+
+def make_temp_goals(reward_shaping: bool = False):
+    """Make the temporal goals used in the tests, the second one with the given shaping."""
+    return [
+        TemporalGoal(RewardAutomaton(build_test_automaton(), 10.0)),
+        TemporalGoal(
+            RewardAutomaton(build_test_automaton(), 1.0),
+            reward_shaping=reward_shaping,
+            discount=0.9,
+        ),
+    ]
+
+
+def make_vector_wrapper(
+    reward_shaping: bool = False, **kwargs
+) -> VectorTemporalGoalWrapper:
+    """Make the vectorized wrapper."""
+    env = make_vector_test_env(N_STATES, NUM_ENVS)
+    return VectorTemporalGoalWrapper(
+        env,
+        make_temp_goals(reward_shaping),
+        FLUENTS,
+        batched_fluent_extractor,
+        **kwargs,
+    )
+
+
+def test_observation_space() -> None:
+    """Test the observation spaces of the vectorized wrapper."""
+    wrapped = make_vector_wrapper()
+    single_observation_space = cast(GymTuple, wrapped.single_observation_space)
+    observation_space = cast(GymTuple, wrapped.observation_space)
+    assert single_observation_space[1] == MultiDiscrete([5, 5])
+    assert isinstance(observation_space[1], MultiDiscrete)
+    np.testing.assert_array_equal(observation_space[1].nvec, np.full((NUM_ENVS, 2), 5))
+
+
+@pytest.mark.parametrize("reward_shaping", [False, True])
+def test_same_behaviour_as_single_wrappers(reward_shaping: bool) -> None:
+    """Test that the vectorized wrapper behaves as one TemporalGoalWrapper per copy."""
+    wrapped = make_vector_wrapper(reward_shaping)
+    references = [
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=N_STATES),
+            make_temp_goals(reward_shaping),
+            lambda obs, action: {f"s{obs}"},
+        )
+        for _ in range(NUM_ENVS)
+    ]
+    observations, automata_states = wrapped.reset()
+    assert automata_states.shape == (NUM_ENVS, 2)
+    for reference in references:
+        reference.reset()
+
+    rng = np.random.default_rng(42)
+    nb_dones = 0
+    for _ in range(200):
+        actions = rng.integers(0, 3, size=NUM_ENVS)
+        (observations, automata_states), rewards, dones, _ = wrapped.step(actions)
+        for i, reference in enumerate(references):
+            observation, reward, done, _ = reference.step(int(actions[i]))
+            assert done == dones[i]
+            assert reward == pytest.approx(rewards[i])
+            if done:
+                nb_dones += 1
+                observation = reference.reset()
+            obs, states = cast(Tuple[int, Tuple[int, ...]], observation)
+            assert obs == observations[i]
+            assert list(states) == automata_states[i].tolist()
+    assert nb_dones > 0
+
+
+@pytest.mark.parametrize("reward_shaping", [False, True])
+def test_step_controller(reward_shaping: bool) -> None:
+    """Test that the vectorized wrapper uses a batched step controller."""
+    wrapped = make_vector_wrapper(
+        reward_shaping,
+        step_controller=BatchedStatelessStepController(
+            lambda fluent_matrix: ~fluent_matrix[:, 1], NUM_ENVS, allow_first=False
+        ),
+    )
+    references = [
+        TemporalGoalWrapper(
+            GymTestEnv(n_states=N_STATES),
+            make_temp_goals(reward_shaping),
+            lambda obs, action: {f"s{obs}"},
+            step_controller=StatelessStepController(
+                lambda fluents: "s1" not in fluents, allow_first=False
+            ),
+        )
+        for _ in range(NUM_ENVS)
+    ]
+    wrapped.reset()
+    for reference in references:
+        reference.reset()
+
+    rng = np.random.default_rng(42)
+    nb_dones = 0
+    for _ in range(200):
+        actions = rng.integers(0, 3, size=NUM_ENVS)
+        (_, automata_states), rewards, dones, _ = wrapped.step(actions)
+        for i, reference in enumerate(references):
+            observation, reward, done, _ = reference.step(int(actions[i]))
+            assert done == dones[i]
+            assert reward == pytest.approx(rewards[i])
+            if done:
+                nb_dones += 1
+                observation = reference.reset()
+            _, states = cast(Tuple[int, Tuple[int, ...]], observation)
+            assert list(states) == automata_states[i].tolist()
+    assert nb_dones > 0
+
+
+def test_flat_observations() -> None:
+    """Test that the observations are flattened into a float32 matrix."""
+    raw = make_vector_wrapper()
+    flat = make_vector_wrapper(observation_mode="flat")
+    flat_copy = make_vector_wrapper(observation_mode="flat", copy_observations=True)
+    assert flat.single_observation_space == Box(0.0, 1.0, (15,), dtype=np.float32)
+    assert flat.observation_space == Box(0.0, 1.0, (NUM_ENVS, 15), dtype=np.float32)
+
+    def expected_flat(observations, automata_states):
+        return np.hstack(
+            [
+                np.eye(N_STATES)[observations],
+                np.eye(5)[automata_states[:, 0]],
+                np.eye(5)[automata_states[:, 1]],
+            ]
+        )
+
+    np.testing.assert_array_equal(flat.reset(), expected_flat(*raw.reset()))
+    flat_copy.reset()
+    rng = np.random.default_rng(42)
+    for _ in range(50):
+        actions = rng.integers(0, 3, size=NUM_ENVS)
+        (observations, automata_states), rewards, dones, _ = raw.step(actions)
+        flat_observations, flat_rewards, flat_dones, _ = flat.step(actions)
+        copied_observations, _, _, _ = flat_copy.step(actions)
+        np.testing.assert_array_equal(flat_rewards, rewards)
+        np.testing.assert_array_equal(flat_dones, dones)
+        assert flat.observation_space.contains(flat_observations)
+        np.testing.assert_array_equal(
+            flat_observations, expected_flat(observations, automata_states)
+        )
+        np.testing.assert_array_equal(copied_observations, flat_observations)
+    assert flat.step(actions)[0] is flat.step(actions)[0]
+    assert flat_copy.step(actions)[0] is not flat_copy.step(actions)[0]
+
+
+def test_missing_fluents() -> None:
+    """Test that a temporal goal reading an unknown fluent is rejected."""
+    env = make_vector_test_env(N_STATES, 1)
+    with pytest.raises(ValueError, match="are not provided"):
+        VectorTemporalGoalWrapper(
+            env, make_temp_goals(), ["s0", "s3"], batched_fluent_extractor
+        )
@@ -27,7 +27,9 @@ from typing import Any, Callable, Dict, Optional, cast
 import gym
 import numpy as np
 from gym.spaces import Discrete, MultiDiscrete
+from gym.vector import SyncVectorEnv, VectorEnv
 from numpy.typing import NDArray
+from pythomata.impl.symbolic import SymbolicDFA
 
 
 class Action(Enum):
@@ -136,6 +138,55 @@ class GymTestObsWrapper(gym.ObservationWrapper):
         return np.asarray([observation])
 
 
+def make_vector_test_env(n_states: int, num_envs: int) -> VectorEnv:
+    """Make a synchronous vectorized environment of copies of GymTestEnv."""
+    # gym does not implement the abstract render method in SyncVectorEnv
+    return SyncVectorEnv(  # type: ignore[abstract]
+        [lambda: GymTestEnv(n_states=n_states)] * num_envs
+    )
+
+
+def build_test_automaton() -> SymbolicDFA:
+    """
+    Build the reward automaton used in tests.
+
+    It is equivalent to the following regular expression:
+
+        (!s4)*;s3;(!s4)*;s0;(!s4)*;s4;true*
+
+    :returns: the automaton.
+    """
+    automaton = SymbolicDFA()
+    q0 = 0
+    q1 = automaton.create_state()
+    q2 = automaton.create_state()
+    q3 = automaton.create_state()
+
+    automaton.add_transition((q0, "~s4 & ~s3", q0))
+    automaton.add_transition((q0, "s3", q1))
+    automaton.add_transition((q1, "~s4 & ~s0", q1))
+    automaton.add_transition((q1, "s0", q2))
+    automaton.add_transition((q2, "~s4", q2))
+    automaton.add_transition((q2, "s4", q3))
+    automaton.add_transition((q3, "true", q3))
+    automaton.set_accepting_state(q3, True)
+
+    automaton = automaton.complete()
+
+    return automaton
+
+
+def build_eventually_automaton(fluent: str) -> SymbolicDFA:
+    """Build the automaton that accepts the traces where the fluent eventually holds."""
+    dfa = SymbolicDFA()
+    dfa.create_state()
+    dfa.add_transition((0, fluent, 1))
+    dfa.add_transition((0, f"~{fluent}", 0))
+    dfa.add_transition((1, "true", 1))
+    dfa.set_accepting_state(1, True)
+    return dfa
+
+
 def q_function_learn(
     env: gym.Env, nb_episodes=100, alpha=0.1, eps=0.1, gamma=0.9
 ) -> Dict[Any, np.ndarray]: